@@ -0,0 +1 @@
+"""Offline end-to-end benchmarks, see `benchmarks/run.py`."""
@@ -0,0 +1,332 @@
+"""A minimal in-memory IMAP4rev1 server for the benchmarks.
+
+It implements just enough of the protocol for `imapclient` and the
+`EmailListener`: LOGIN, SELECT (with UIDNEXT), STATUS, UID SEARCH
+(ALL/UNSEEN/SEEN/UID/FROM/OR/NOT), UID FETCH (RFC822, BODY[], BODY.PEEK[],
+ENVELOPE, FLAGS), UID STORE, IDLE and NOOP. TLS is optional (`ssl_context`).
+"""
+import contextlib
+import re
+import select
+import socket
+import socketserver
+import threading
+import time
+from email.utils import formatdate, parseaddr, make_msgid
+
+
+class Mailbox:
+    """The messages of the (single) folder of the server."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.messages = []  # (uid, flags:set, raw bytes, from, subject)
+        self.uid_next = 1
+        self.idle_waiters = set()
+
+    def append(self, raw: bytes, from_address: str, subject: str) -> int:
+        """Add a message to the folder, the IDLE connections are notified.
+
+        Returns:
+            The UID of the message.
+
+        """
+        with self.lock:
+            uid = self.uid_next
+            self.uid_next += 1
+            self.messages.append([uid, set(), raw, from_address, subject])
+            for waiter in self.idle_waiters:
+                waiter.send(b"\0")
+            return uid
+
+
+def build_email(from_address, subject, body, message_id=None) -> bytes:
+    """Build a raw plain text email."""
+    return (
+        f"From: TradingView <{from_address}>\r\n"
+        f"To: you@example.com\r\n"
+        f"Subject: {subject}\r\n"
+        f"Date: {formatdate(time.time())}\r\n"
+        f"Message-ID: {message_id or make_msgid()}\r\n"
+        f"Content-Type: text/plain; charset=utf-8\r\n"
+        f"\r\n{body}\r\n"
+    ).encode()
+
+
+def quote(value: str) -> str:
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+class Handler(socketserver.StreamRequestHandler):
+    # the responses are written line by line, don't let Nagle delay them
+    disable_nagle_algorithm = True
+
+    def send(self, line: str | bytes):
+        if isinstance(line, str):
+            line = line.encode()
+        self.wfile.write(line + b"\r\n")
+        self.wfile.flush()
+
+    def setup(self):
+        super().setup()
+        with self.server.connections_lock:
+            self.server.connections.add(self)
+
+    def finish(self):
+        with self.server.connections_lock:
+            self.server.connections.discard(self)
+        with contextlib.suppress(OSError):
+            super().finish()
+
+    def handle(self):
+        # a client that drops the connection is not an error of the server
+        with contextlib.suppress(OSError):
+            self._handle()
+
+    def _handle(self):
+        self.known = 0
+        self.idling = False
+        self.send("* OK fake IMAP ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            line = line.decode().rstrip("\r\n")
+            tag, _, rest = line.partition(" ")
+            command, _, args = rest.partition(" ")
+            command = command.upper()
+            if command == "UID":
+                command, _, args = args.partition(" ")
+                command = "UID " + command.upper()
+            handler = getattr(self, "cmd_" + command.replace(" ", "_"), None)
+            if handler is None:
+                self.send(f"{tag} BAD unknown command")
+                continue
+            if handler(tag, args) is False:
+                return
+
+    def cmd_CAPABILITY(self, tag, args):
+        self.send("* CAPABILITY IMAP4rev1 IDLE UIDPLUS")
+        self.send(f"{tag} OK CAPABILITY completed")
+
+    def cmd_LOGIN(self, tag, args):
+        with self.server.connections_lock:
+            self.server.logins += 1
+        self.send(f"{tag} OK LOGIN completed")
+
+    def cmd_NOOP(self, tag, args):
+        self.send(f"{tag} OK NOOP completed")
+
+    def cmd_LOGOUT(self, tag, args):
+        self.send("* BYE")
+        self.send(f"{tag} OK LOGOUT completed")
+        return False
+
+    def cmd_SELECT(self, tag, args):
+        mailbox = self.server.mailbox
+        with mailbox.lock:
+            self.known = len(mailbox.messages)
+            self.send(f"* {self.known} EXISTS")
+            self.send("* 0 RECENT")
+            self.send("* FLAGS (\\Seen \\Deleted)")
+            self.send("* OK [UIDVALIDITY 1] UIDs valid")
+            self.send(f"* OK [UIDNEXT {mailbox.uid_next}] Predicted next UID")
+        self.send(f"{tag} OK [READ-WRITE] SELECT completed")
+
+    cmd_EXAMINE = cmd_SELECT
+
+    def cmd_STATUS(self, tag, args):
+        mailbox = self.server.mailbox
+        self.send(f"* STATUS INBOX (UIDNEXT {mailbox.uid_next} MESSAGES {len(mailbox.messages)})")
+        self.send(f"{tag} OK STATUS completed")
+
+    def cmd_IDLE(self, tag, args):
+        mailbox = self.server.mailbox
+        self.send("+ idling")
+        wake_read, wake_write = socket.socketpair()
+        with mailbox.lock:
+            count = len(mailbox.messages)
+            mailbox.idle_waiters.add(wake_write)
+        # report the emails that arrived since the last response, like real servers do
+        if count != self.known:
+            self.send(f"* {count} EXISTS")
+        self.known = count
+        self.idling = True
+        try:
+            while True:
+                readable, _, _ = select.select([self.connection, wake_read], [], [])
+                if self.connection in readable:
+                    # "DONE"
+                    if not self.rfile.readline():
+                        return False
+                    break
+                wake_read.recv(1024)
+                with mailbox.lock:
+                    count = len(mailbox.messages)
+                if count != self.known:
+                    self.known = count
+                    self.send(f"* {count} EXISTS")
+        finally:
+            self.idling = False
+            with mailbox.lock:
+                mailbox.idle_waiters.discard(wake_write)
+            wake_read.close()
+            wake_write.close()
+        self.send(f"{tag} OK IDLE terminated")
+
+    def _uid_set(self, spec):
+        mailbox = self.server.mailbox
+        max_uid = mailbox.messages[-1][0] if mailbox.messages else 0
+        uids = set()
+        for part in spec.split(","):
+            if ":" in part:
+                low, high = part.split(":")
+                low = max_uid if low == "*" else int(low)
+                high = max_uid if high == "*" else int(high)
+                low, high = min(low, high), max(low, high)
+                uids.update(range(low, high + 1))
+            else:
+                uids.add(max_uid if part == "*" else int(part))
+        return uids
+
+    def _tokenize(self, text):
+        return re.findall(r'"(?:[^"\\]|\\.)*"|\(|\)|[^\s()]+', text)
+
+    def _match(self, tokens, message):
+        # consume one search key from `tokens` and check it against the message
+        token = tokens.pop(0)
+        upper = token.upper()
+        if token == "(":
+            result = True
+            while tokens[0] != ")":
+                matched = self._match(tokens, message)
+                result = result and matched
+            tokens.pop(0)
+            return result
+        if upper == "ALL":
+            return True
+        if upper == "UNSEEN":
+            return "\\Seen" not in message[1]
+        if upper == "SEEN":
+            return "\\Seen" in message[1]
+        if upper == "UID":
+            return message[0] in self._uid_set(tokens.pop(0))
+        if upper == "FROM":
+            value = tokens.pop(0).strip('"').lower()
+            return value in message[3].lower()
+        if upper == "OR":
+            left = self._match(tokens, message)
+            right = self._match(tokens, message)
+            return left or right
+        if upper == "NOT":
+            return not self._match(tokens, message)
+        if upper == "CHARSET":
+            tokens.pop(0)
+            return True
+        return True
+
+    def cmd_UID_SEARCH(self, tag, args):
+        mailbox = self.server.mailbox
+        tokens = self._tokenize(args)
+        with mailbox.lock:
+            found = []
+            for message in mailbox.messages:
+                remaining = list(tokens)
+                if remaining and remaining[0].upper() == "CHARSET":
+                    remaining = remaining[2:]
+                matched = True
+                while remaining:
+                    matched = self._match(remaining, message) and matched
+                if matched:
+                    found.append(str(message[0]))
+        self.send("* SEARCH " + " ".join(found))
+        self.send(f"{tag} OK SEARCH completed")
+
+    def _envelope(self, message):
+        name, address = parseaddr(message[3])
+        mailbox_name, _, host = address.partition("@")
+        subject = message[4]
+        return (f'(NIL {quote(subject)} ((NIL NIL {quote(mailbox_name)} {quote(host)})) NIL NIL NIL NIL NIL NIL NIL)')
+
+    def cmd_UID_FETCH(self, tag, args):
+        mailbox = self.server.mailbox
+        spec, _, items = args.partition(" ")
+        items = items.upper()
+        uids = self._uid_set(spec)
+        with mailbox.lock:
+            selected = [m for m in mailbox.messages if m[0] in uids]
+        for message in selected:
+            uid, flags, raw = message[0], message[1], message[2]
+            self.server.fetch_bytes += len(raw) if ("RFC822" in items or "BODY" in items) else 0
+            parts = [f"UID {uid}"]
+            literal = None
+            if "ENVELOPE" in items:
+                parts.append("ENVELOPE " + self._envelope(message))
+            if "FLAGS" in items:
+                parts.append("FLAGS (" + " ".join(sorted(flags)) + ")")
+            if "RFC822" in items and "RFC822." not in items:
+                literal = ("RFC822", raw)
+                flags.add("\\Seen")
+            elif "BODY.PEEK[]" in items:
+                literal = ("BODY[]", raw)
+            elif "BODY[]" in items:
+                literal = ("BODY[]", raw)
+                flags.add("\\Seen")
+            index = mailbox.messages.index(message) + 1
+            if literal:
+                head = f"* {index} FETCH (" + " ".join(parts) + f" {literal[0]} {{{len(literal[1])}}}"
+                self.wfile.write(head.encode() + b"\r\n" + literal[1] + b")\r\n")
+            else:
+                self.send(f"* {index} FETCH (" + " ".join(parts) + ")")
+        self.send(f"{tag} OK FETCH completed")
+
+    def cmd_UID_STORE(self, tag, args):
+        mailbox = self.server.mailbox
+        spec, _, rest = args.partition(" ")
+        action, _, flags = rest.partition(" ")
+        flags = set(flags.strip("()").split())
+        uids = self._uid_set(spec)
+        with mailbox.lock:
+            for message in mailbox.messages:
+                if message[0] in uids:
+                    if action.upper().startswith("+"):
+                        message[1] |= flags
+                    elif action.upper().startswith("-"):
+                        message[1] -= flags
+                    else:
+                        message[1] = set(flags)
+                    if ".SILENT" not in action.upper():
+                        index = mailbox.messages.index(message) + 1
+                        self.send(f"* {index} FETCH (UID {message[0]} FLAGS (" + " ".join(sorted(message[1])) + "))")
+        self.send(f"{tag} OK STORE completed")
+
+
+class FakeIMAPServer(socketserver.ThreadingTCPServer):
+    """The IMAP server, use port 0 to let the OS pick a free port."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=("127.0.0.1", 0), ssl_context=None):
+        super().__init__(address, Handler)
+        self.mailbox = Mailbox()
+        self.fetch_bytes = 0
+        self.logins = 0
+        self.ssl_context = ssl_context
+        self.connections: set[Handler] = set()
+        self.connections_lock = threading.Lock()
+
+    def get_request(self):
+        sock, address = super().get_request()
+        if self.ssl_context is not None:
+            sock = self.ssl_context.wrap_socket(sock, server_side=True)
+        return sock, address
+
+    def drop_idle_connections(self) -> int:
+        """Cut the connections that are in IDLE, like a network drop would. Returns the number of connections cut."""
+        with self.connections_lock:
+            idling = [handler for handler in self.connections if handler.idling]
+        for handler in idling:
+            with contextlib.suppress(OSError):
+                handler.connection.shutdown(socket.SHUT_RDWR)
+        return len(idling)
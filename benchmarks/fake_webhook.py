@@ -0,0 +1,111 @@
+"""A webhook/Telegram sink for the benchmarks.
+
+Every POST is answered after `latency` seconds. A share of the requests
+(`rate_limit_ratio`) is answered with 429 and a Retry-After header. The
+successful deliveries of the benchmark alerts are recorded with their
+alert-to-delivery latency.
+
+The alert payloads must be JSON objects with a `bench_id` and a `sent_at`
+(unix timestamp) field. Telegram messages carry the payload as the `text`
+field.
+"""
+
+import asyncio
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+
+from aiohttp import web
+
+
+@dataclass
+class Delivery:
+    bench_id: int
+    target: str
+    latency: float
+    received_at: float
+
+
+@dataclass
+class WebhookSink:
+    latency: float = 0.0
+    rate_limit_ratio: float = 0.0
+    retry_after: float = 1.0
+    deliveries: list[Delivery] = field(default_factory=list)
+    requests: int = 0
+    rate_limited: int = 0
+
+    def __post_init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._runner = None
+        self.port = None
+
+    def url(self, name: str) -> str:
+        """Get the webhook URL of a target of the sink."""
+        return f"http://127.0.0.1:{self.port}/hook/{name}"
+
+    @property
+    def tg_api_url(self) -> str:
+        """Get the URL to use as the Telegram Bot API URL."""
+        return f"http://127.0.0.1:{self.port}/tg"
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.rate_limit_ratio and random.random() < self.rate_limit_ratio:
+            with self._lock:
+                self.rate_limited += 1
+            return web.Response(status=429, headers={"Retry-After": str(self.retry_after)})
+
+        now = time.time()
+        try:
+            payload = json.loads(body)
+            if "text" in payload and "chat_id" in payload:
+                payload = json.loads(payload["text"])
+            bench_id, sent_at = payload["bench_id"], payload["sent_at"]
+        except (ValueError, KeyError, TypeError):
+            return web.Response(status=204)
+        target = request.match_info.get("name", "telegram")
+        with self._lock:
+            self.deliveries.append(Delivery(bench_id, target, now - sent_at, now))
+        return web.Response(status=200 if target == "telegram" else 204)
+
+    def start(self):
+        """Start the sink on a free port in a background thread."""
+        started = threading.Event()
+
+        def _run():
+            self._loop = asyncio.new_event_loop()
+            app = web.Application()
+            app.add_routes([
+                web.post("/hook/{name}", self._handle),
+                web.post("/tg/{path:.*}", self._handle),
+            ])
+            self._runner = web.AppRunner(app, access_log=None)
+            self._loop.run_until_complete(self._runner.setup())
+            site = web.TCPSite(self._runner, "127.0.0.1", 0)
+            self._loop.run_until_complete(site.start())
+            self.port = site._server.sockets[0].getsockname()[1]
+            started.set()
+            self._loop.run_forever()
+
+        threading.Thread(target=_run, daemon=True).start()
+        started.wait()
+        return self
+
+    def reset(self):
+        """Forget the recorded deliveries."""
+        with self._lock:
+            self.deliveries = []
+            self.requests = 0
+            self.rate_limited = 0
+
+    def snapshot(self) -> list[Delivery]:
+        with self._lock:
+            return list(self.deliveries)
@@ -0,0 +1,80 @@
+"""Open-loop load generator for the ngrok-mode `/api` endpoint.
+
+The alerts are sent at a fixed rate whatever the response time of the
+server is, like TradingView/the forwarder would do.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+import aiohttp
+
+TRADINGVIEW_ADDRESS = "noreply@tradingview.com"
+
+
+@dataclass
+class LoadResult:
+    sent: int = 0
+    accepted: int = 0
+    rejected: int = 0
+    errors: int = 0
+    ack_latencies: list[float] = field(default_factory=list)
+
+
+def build_alert(bench_id: int) -> dict:
+    """Build the data a forwarder would POST to `/api` for one alert."""
+    now = time.time()
+    return {
+        "from": TRADINGVIEW_ADDRESS,
+        "subject": f"Alert: benchmark #{bench_id}",
+        "content": f'{{"bench_id": {bench_id}, "sent_at": {now}}}',
+        "receive_datetime": datetime.fromtimestamp(now, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+    }
+
+
+async def _send(session: aiohttp.ClientSession, url: str, api_key: str, bench_id: int, result: LoadResult):
+    start_time = time.perf_counter()
+    try:
+        async with session.post(url, json=build_alert(bench_id), headers={"X-API-KEY": api_key}) as response:
+            await response.read()
+            if response.status == 204:
+                result.accepted += 1
+            else:
+                result.rejected += 1
+    except aiohttp.ClientError:
+        result.errors += 1
+        return
+    result.ack_latencies.append(time.perf_counter() - start_time)
+
+
+async def generate_load(url: str, api_key: str, rate: float, duration: float, first_id: int = 0, connections: int = 64) -> LoadResult:
+    """Send `rate` alerts per second to `url` for `duration` seconds.
+
+    Args:
+        url (str): The `/api` URL.
+        api_key (str): The API key of the server.
+        rate (float): Alerts per second.
+        duration (float): Seconds to send for.
+        first_id (int): The `bench_id` of the first alert.
+        connections (int): Max number of keep-alive connections.
+
+    Returns:
+        The LoadResult.
+
+    """
+    result = LoadResult()
+    count = int(rate * duration)
+    connector = aiohttp.TCPConnector(limit=connections)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        tasks = []
+        start_time = time.perf_counter()
+        for i in range(count):
+            delay = start_time + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(_send(session, url, api_key, first_id + i, result)))
+            result.sent += 1
+        await asyncio.gather(*tasks)
+    return result
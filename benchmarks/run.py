@@ -0,0 +1,249 @@
+"""End-to-end latency and throughput benchmark.
+
+Runs the real `EmailSignalExtraction` and `NgrokSignalRedirect` pipelines
+against a local fake IMAP server and a local webhook/Telegram sink, then
+reports the alert-to-delivery latency and the max sustained alert rate.
+Nothing leaves the machine, the config file is generated in a temporary
+folder.
+
+Usage (from the project folder):
+
+    python -m benchmarks.run --mode both
+    python -m benchmarks.run --mode ngrok --targets 50 --sink-latency 0.05 --rates 50,100,200,400
+    python -m benchmarks.run --mode email --alerts 100 --sink-429-ratio 0.1
+    python -m benchmarks.run --mode failover --drops 10 --hot-standby
+
+"""
+
+import argparse
+import asyncio
+import logging
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import toml
+
+from .fake_imap import FakeIMAPServer, build_email
+from .fake_webhook import WebhookSink, Delivery
+from .load_generator import generate_load, TRADINGVIEW_ADDRESS
+
+BENCH_API_KEY = "benchmark-api-key"
+BENCH_TG_TOKEN = "0:benchmark"
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """Nearest-rank percentile, NaN if there are no values."""
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    index = max(0, min(len(values) - 1, math.ceil(percent / 100 * len(values)) - 1))
+    return values[index]
+
+
+def summarize(deliveries: list[Delivery], expected_alerts: int, targets: int) -> dict:
+    """Compute the latency statistics of the recorded deliveries.
+
+    The latency of an alert is the latency of its last target (time to last
+    delivery), the first successful delivery of each target is used.
+    """
+    first = {}
+    for delivery in deliveries:
+        key = (delivery.bench_id, delivery.target)
+        if key not in first or delivery.latency < first[key].latency:
+            first[key] = delivery
+    per_alert = {}
+    for (bench_id, _), delivery in first.items():
+        per_alert.setdefault(bench_id, []).append(delivery.latency)
+    complete = [max(latencies) for latencies in per_alert.values() if len(latencies) == targets]
+    delivery_latencies = [delivery.latency for delivery in first.values()]
+    return {
+        "alerts": expected_alerts,
+        "completed": len(complete),
+        "deliveries": len(first),
+        "delivery_p50": percentile(delivery_latencies, 50),
+        "delivery_p99": percentile(delivery_latencies, 99),
+        "alert_p50": percentile(complete, 50),
+        "alert_p99": percentile(complete, 99),
+    }
+
+
+def wait_for(sink: WebhookSink, first_id: int, count: int, targets: int, timeout: float) -> list[Delivery]:
+    """Wait until all targets received the alerts `first_id`...`first_id + count - 1`."""
+    deadline = time.time() + timeout
+    while True:
+        deliveries = [d for d in sink.snapshot() if first_id <= d.bench_id < first_id + count]
+        if len({(d.bench_id, d.target) for d in deliveries}) >= count * targets or time.time() > deadline:
+            return deliveries
+        time.sleep(0.05)
+
+
+def print_summary(title: str, summary: dict):
+    print(f"\n== {title} ==")
+    print(f"alerts completed : {summary['completed']}/{summary['alerts']} ({summary['deliveries']} deliveries)")
+    print(f"delivery latency : p50 {summary['delivery_p50'] * 1000:.1f} ms | p99 {summary['delivery_p99'] * 1000:.1f} ms")
+    print(f"alert latency    : p50 {summary['alert_p50'] * 1000:.1f} ms | p99 {summary['alert_p99'] * 1000:.1f} ms (time to last delivery)")
+
+
+def write_config(folder: str, sink: WebhookSink, args, imap_port: int) -> str:
+    config = {
+        "mode_traditional": args.mode == "email",
+        "email_address": "benchmark@example.com",
+        "login_password": "benchmark",
+        "imap_server_address": "127.0.0.1",
+        "imap_server_port": imap_port,
+        "imap_ssl": False,
+        "imap_auto_reconnect": False,
+        "imap_auto_reconnect_wait": 1,
+        "webhook_urls": [sink.url(f"target-{i}") for i in range(args.targets)],
+        "tg_bot_token": BENCH_TG_TOKEN if args.telegram else "",
+        "tg_chat_id": "1" if args.telegram else "",
+        "tg_api_url": sink.tg_api_url,
+        # the stand-in has no rate limit, measure the pipeline, not Telegram's limits
+        "tg_chat_rate": 10_000.0,
+        "tg_chat_burst": 10_000,
+        "tg_global_rate": 10_000.0,
+        "outbox_path": os.path.join(folder, "outbox.sqlite3"),
+        "dedup_path": os.path.join(folder, "dedup.log"),
+        "ngrok_api_server_auth_key": BENCH_API_KEY,
+        "log_save": False,
+    }
+    path = os.path.join(folder, "config.toml")
+    with open(path, "w") as file:
+        toml.dump(config, file)
+    return path
+
+
+def run_email(args, sink: WebhookSink, imap: FakeIMAPServer, targets: int):
+    from src.handlers.email_signal_extraction import EmailSignalExtraction
+
+    extraction = EmailSignalExtraction(
+        "benchmark@example.com", "benchmark", "127.0.0.1", imap.server_address[1],
+        imap_auto_reconnect=False, imap_auto_reconnect_wait=1, imap_ssl=False,
+        imap_dual_connection=not args.single_connection
+    )
+    threading.Thread(target=extraction.start, daemon=True).start()
+    time.sleep(1) # login + first IDLE
+
+    first_id = 0
+    for i in range(args.alerts):
+        body = f'{{"bench_id": {first_id + i}, "sent_at": {time.time()}}}'
+        imap.mailbox.append(build_email(TRADINGVIEW_ADDRESS, f"Alert: benchmark #{i}", body), TRADINGVIEW_ADDRESS, f"Alert #{i}")
+        time.sleep(args.email_interval)
+    deliveries = wait_for(sink, first_id, args.alerts, targets, timeout=args.timeout)
+    summary = summarize(deliveries, args.alerts, targets)
+    print_summary(f"email mode: {args.alerts} alerts every {args.email_interval}s -> {targets} target(s){', single connection' if args.single_connection else ''}", summary)
+    print(f"IMAP bytes fetched: {imap.fetch_bytes}")
+
+
+def run_failover(args, sink: WebhookSink, imap: FakeIMAPServer, targets: int):
+    from src.handlers.email_signal_extraction import EmailSignalExtraction
+
+    extraction = EmailSignalExtraction(
+        "benchmark@example.com", "benchmark", "127.0.0.1", imap.server_address[1],
+        imap_auto_reconnect=True, imap_auto_reconnect_wait=10, imap_ssl=False,
+        imap_hot_standby=args.hot_standby, imap_dual_connection=not args.single_connection
+    )
+    threading.Thread(target=extraction.main, daemon=True).start()
+    time.sleep(1) # login + first IDLE
+
+    first_id = 2_000_000
+    resume_times = []
+    for i in range(args.drops):
+        dropped = imap.drop_idle_connections()
+        start_time = time.time()
+        body = f'{{"bench_id": {first_id + i}, "sent_at": {start_time}}}'
+        imap.mailbox.append(build_email(TRADINGVIEW_ADDRESS, f"Alert: failover #{i}", body), TRADINGVIEW_ADDRESS, f"Failover #{i}")
+        deliveries = wait_for(sink, first_id + i, 1, targets, timeout=args.timeout)
+        if dropped and deliveries:
+            resume_times.append(max(delivery.received_at for delivery in deliveries) - start_time)
+        # let the standby connection come back
+        time.sleep(1)
+    print(f"\n== failover: {args.drops} connection drop(s), hot standby {'on' if args.hot_standby else 'off'} ==")
+    print(f"alerts delivered : {len(resume_times)}/{args.drops}")
+    print(f"drop to delivery : p50 {percentile(resume_times, 50) * 1000:.1f} ms | max {max(resume_times, default=math.nan) * 1000:.1f} ms")
+
+
+def run_ngrok(args, sink: WebhookSink, targets: int):
+    from src import event_subscribe, event_join, api_server_start
+    from src.handlers.ngrok_signal_redirect import NgrokSignalRedirect
+
+    ports = []
+    redirect = NgrokSignalRedirect("benchmark", BENCH_API_KEY)
+    event_subscribe("benchmark-port", ports.append)
+    redirect.subscribe_data_received()
+    threading.Thread(target=api_server_start, args=("benchmark-port", NgrokSignalRedirect._EventID.API_REV, BENCH_API_KEY), daemon=True).start()
+    while not ports:
+        time.sleep(0.05)
+    url = f"http://127.0.0.1:{ports[0]}/api"
+
+    first_id = 1_000_000
+    best_rate = 0.0
+    print(f"\n== ngrok mode: {targets} target(s), {args.stage_duration}s per stage, p99 SLO {args.slo_p99}s ==")
+    print(f"{'rate/s':>8} {'sent':>6} {'acked':>6} {'ack p99':>9} {'done':>6} {'alert p50':>10} {'alert p99':>10}  result")
+    for rate in args.rates:
+        load = asyncio.run(generate_load(url, BENCH_API_KEY, rate, args.stage_duration, first_id))
+        deliveries = wait_for(sink, first_id, load.sent, targets, timeout=args.stage_duration + args.slo_p99 * 2)
+        summary = summarize(deliveries, load.sent, targets)
+        sustained = summary["completed"] == load.sent and load.accepted == load.sent and summary["alert_p99"] <= args.slo_p99
+        print(
+            f"{rate:>8g} {load.sent:>6} {load.accepted:>6} {percentile(load.ack_latencies, 99) * 1000:>7.1f}ms "
+            f"{summary['completed']:>6} {summary['alert_p50'] * 1000:>8.1f}ms {summary['alert_p99'] * 1000:>8.1f}ms  "
+            f"{'OK' if sustained else 'SATURATED'}"
+        )
+        first_id += load.sent
+        if not sustained:
+            break
+        best_rate = rate
+    print(f"max sustained rate: {best_rate:g} alerts/s")
+    # let the backlog of the last stage drain before exiting
+    event_join(NgrokSignalRedirect._EventID.API_REV)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("email", "ngrok", "both", "failover"), default="both")
+    parser.add_argument("--targets", type=int, default=5, help="number of webhook targets")
+    parser.add_argument("--telegram", action="store_true", help="also deliver to the Telegram stand-in")
+    parser.add_argument("--sink-latency", type=float, default=0.0, help="seconds each target takes to answer")
+    parser.add_argument("--sink-429-ratio", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--sink-retry-after", type=float, default=1.0, help="Retry-After of the 429 responses")
+    parser.add_argument("--alerts", type=int, default=50, help="email mode: number of alerts")
+    parser.add_argument("--email-interval", type=float, default=0.2, help="email mode: seconds between alerts")
+    parser.add_argument("--rates", type=lambda value: [float(rate) for rate in value.split(",")], default=[10, 25, 50, 100, 200, 400], help="ngrok mode: comma separated alert rates to try")
+    parser.add_argument("--stage-duration", type=float, default=5.0, help="ngrok mode: seconds per rate")
+    parser.add_argument("--slo-p99", type=float, default=1.0, help="ngrok mode: max p99 alert latency (s) of a sustained rate")
+    parser.add_argument("--drops", type=int, default=5, help="failover mode: number of connection drops")
+    parser.add_argument("--hot-standby", action="store_true", help="failover mode: keep a standby IMAP connection")
+    parser.add_argument("--single-connection", action="store_true", help="email/failover mode: IDLE and fetch on the same IMAP connection")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds to wait for the deliveries")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sink = WebhookSink(latency=args.sink_latency, rate_limit_ratio=args.sink_429_ratio, retry_after=args.sink_retry_after).start()
+    imap = FakeIMAPServer()
+    threading.Thread(target=imap.serve_forever, daemon=True).start()
+    targets = args.targets + (1 if args.telegram else 0)
+
+    with tempfile.TemporaryDirectory(prefix="tvwa-bench-") as folder:
+        os.environ["TVWA_CONFIG"] = write_config(folder, sink, args, imap.server_address[1])
+        # import after the config is written, the modules read it on import
+        from src import log
+        log.setLevel(logging.WARNING)
+
+        if args.mode in ("email", "both"):
+            run_email(args, sink, imap, targets)
+        if args.mode in ("ngrok", "both"):
+            run_ngrok(args, sink, targets)
+        if args.mode == "failover":
+            run_failover(args, sink, imap, targets)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,30 +1,29 @@
-import pyfiglet
 import logging
-from rich import print as cprint
-from rich import traceback
 
-from src import config, log , create_logger, shutdown
-from src.handlers.discord_log_handler import DiscordLogHandler
-from src.handlers.email_signal_extraction import EmailSignalExtraction
-from src.handlers.ngrok_signal_redirect import NgrokSignalRedirect
+from src import config, log , create_logger, shutdown, startup_mark, startup_report
+from src.broadcast import setup as broadcast_setup, replay_outbox
 
-traceback.install()
+# the handlers are imported by `main`, each mode needs only some of them
 
 # ---------------* Config *---------------
 mode_traditional = config.get("mode_traditional", True)
+fast_start:bool = config.get("fast_start", False)
 
-email_address:str | None = config.get("email_address")
-login_password:str | None = config.get("login_password")
-imap_server_address:str | None = config.get("imap_server_address")
-imap_server_port:int | None = config.get("imap_server_port")
-imap_auto_reconnect:bool | None = config.get("imap_auto_reconnect")
-imap_auto_reconnect_wait:int | None = config.get("imap_auto_reconnect_wait")
+# the email config ("email_address", "imap_*", "imap_accounts"...) is read by `build_extractions`
 
 ngrok_auth_token:str | None = config.get("ngrok_auth_token")
 ngrok_api_server_auth_key:str | None = config.get("ngrok_api_server_auth_key")
+api_workers:int = config.get("api_workers", 1)
+ngrok_domain:str | None = config.get("ngrok_domain") or None
+ngrok_monitor_interval:float = config.get("ngrok_monitor_interval", 30)
+ngrok_monitor_failures:int = config.get("ngrok_monitor_failures", 3)
+
+metrics_port:int = config.get("metrics_port", 0)
+metrics_host:str = config.get("metrics_host", "127.0.0.1")
 
 discord_log:bool = config.get("discord_log", False)
 discord_webhook_url:str | None = config.get("discord_webhook_url")
+discord_log_queue_size:int = config.get("discord_log_queue_size", 1000)
 
 log_with_colors:bool = config.get("log_color", True)
 log_with_time_zone:bool = config.get("log_time_zone", False)
@@ -38,8 +37,7 @@ __version__ = "2.6.4"
 expect_config_version = "1.0.2"
 github_config_toml_url = "https://github.com/soranoo/TradingView-Free-Webhook-Alerts/blob/main/config.example.toml"
 
-def main():
-    log.debug(f"Traditional mode: {mode_traditional}")
+def setup_logging():
     create_logger(
         save_log=save_log, color_print=log_with_colors,
         print_log_msg_color=log_with_full_colors,
@@ -47,40 +45,72 @@ def main():
         log_level=logging.DEBUG, rebuild_mode=True,
         rebuild_logger=log
     )
+
+def main():
+    log.debug(f"Traditional mode: {mode_traditional}")
+    setup_logging()
     if discord_log:
         if not discord_webhook_url:
             log.error("Discord webhook URL is not set, please set it in the config file.")
             shutdown()
-        log.addHandler(DiscordLogHandler(discord_webhook_url))
+        from src.handlers.discord_log_handler import DiscordLogHandler
+        log.addHandler(DiscordLogHandler(discord_webhook_url, max_queue_size=discord_log_queue_size))
+    broadcast_setup()
+    startup_mark("broadcast")
+    replay_outbox()
+    startup_mark("outbox replay")
     if mode_traditional:
-        # Config check before EmailSignalExtraction
-        missing = []
-        if not email_address:
-            missing.append("email_address")
-        if not login_password:
-            missing.append("login_password")
-        if not imap_server_address:
-            missing.append("imap_server_address")
-        if not imap_server_port:
-            missing.append("imap_server_port")
-        if missing:
-            log.error(f"Missing required email config: {', '.join(missing)}. Please set these in the config file.")
+        from src.handlers.mailbox_supervisor import MailboxSupervisor, build_extractions
+        extractions = build_extractions(config)
+        if not extractions:
+            log.error("Missing required email config: email_address. Please set these in the config file.")
             shutdown()
-        EmailSignalExtraction(
-            email_address, login_password,
-            imap_server_address, imap_server_port,
-            imap_auto_reconnect, imap_auto_reconnect_wait
-        ).main()
+        # Config check before EmailSignalExtraction
+        for extraction in extractions:
+            missing = []
+            if not extraction.email_address:
+                missing.append("email_address")
+            if not extraction.login_password:
+                missing.append("login_password")
+            if not extraction.imap_server_address:
+                missing.append("imap_server_address")
+            if not extraction.imap_server_port:
+                missing.append("imap_server_port")
+            if missing:
+                log.error(f"Missing required email config of <{extraction.name}>: {', '.join(missing)}. Please set these in the config file.")
+                shutdown()
+        # the API server serves "/metrics" in ngrok mode
+        if metrics_port:
+            from src.metrics import start_metrics_server
+            start_metrics_server(metrics_port, metrics_host)
+        startup_mark("email mode")
+        log.debug(startup_report())
+        if len(extractions) == 1:
+            extractions[0].main()
+        else:
+            MailboxSupervisor(extractions).main()
     else:
         if not ngrok_auth_token:
             log.error("Missing ngrok auth token, please set it in the config file.")
             shutdown()
         else:
-            NgrokSignalRedirect(ngrok_auth_token, ngrok_api_server_auth_key).main()
+            from src.handlers.ngrok_signal_redirect import NgrokSignalRedirect
+            startup_mark("ngrok mode")
+            log.debug(startup_report())
+            # the API worker processes set up their logger like this one
+            NgrokSignalRedirect(
+                ngrok_auth_token, ngrok_api_server_auth_key, api_workers, setup_logging,
+                ngrok_domain, ngrok_monitor_interval, ngrok_monitor_failures
+            ).main()
 
 if __name__ == "__main__":
-    # welcome message
-    cprint(pyfiglet.figlet_format("TradingView\nFree Webhook"))
+    if not fast_start:
+        import pyfiglet
+        from rich import print as cprint
+        from rich import traceback
+        traceback.install()
+        # welcome message
+        cprint(pyfiglet.figlet_format("TradingView\nFree Webhook"))
     # startup check
     print(f"Version: {__version__}  |  Config Version: {config_version}")
     if(config_version != expect_config_version):
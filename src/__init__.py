@@ -1,17 +1,33 @@
+from src.startup import mark as startup_mark, report as startup_report
 import time as _time
 import toml as _toml
 import os as _os
 
-from src.network import send_post_request, is_url_valid
-from src.event import subscribe as event_subscribe, unsubscribe as event_unsubscribe, post_event as event_post
+from src.network import send_post_request, is_url_valid, get_session as network_get_session, close_session as network_close_session
+from src.event import subscribe as event_subscribe, unsubscribe as event_unsubscribe, post_event as event_post, join as event_join, queue_depth as event_queue_depth, stats as event_stats, Backpressure as EventBackpressure
 from src.logger import logger as log, add_logging_level, Colorcode, create_logger
-from src.email_listener import EmailListener
 from src.multi_task import StoppableThread
-from src.api_server import start as api_server_start
-from src.discord_utilities import Embed as DiscordEmbed
-from src.plan_to_run import run_at as plan_to_run_run_at, terminate as plan_to_run_terminate
+from src.plan_to_run import run_at as plan_to_run_run_at, cancel as plan_to_run_cancel, terminate as plan_to_run_terminate
 from src.constants import TRADINGVIEW_ALERT_EMAIL_ADDRESS, RETRY_AFTER_HEADER, POST_REQUEST_HEADERS
 
+# imported on first use, each mode needs only some of them (aiohttp, discord.py...)
+_LAZY_EXPORTS = {
+    "EmailListener": ("src.email_listener", "EmailListener"),
+    "api_server_start": ("src.api_server", "start"),
+    "DiscordEmbed": ("src.discord_utilities", "Embed"),
+}
+
+def __getattr__(name: str):
+    if name not in _LAZY_EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import importlib
+    module_name, attribute = _LAZY_EXPORTS[name]
+    value = getattr(importlib.import_module(module_name), attribute)
+    globals()[name] = value
+    return value
+
+startup_mark("imports")
+
 class log_levels:
     """
     Log-Levels:\n
@@ -38,7 +54,10 @@ class log_levels:
 __location__ = _os.path.realpath(_os.path.join(_os.getcwd(), _os.path.dirname(__file__))) # get current directory
 project_main_directory = _os.path.dirname(__location__)
 
-config = _toml.load(_os.path.join(project_main_directory, "config.toml"))
+# the config file can be moved with the "TVWA_CONFIG" environment variable
+config_path = _os.environ.get("TVWA_CONFIG") or _os.path.join(project_main_directory, "config.toml")
+config = _toml.load(config_path)
+startup_mark("config")
 
 def shutdown(seconds:float = 10):
     """
@@ -50,4 +69,5 @@ def shutdown(seconds:float = 10):
     """
     log.warning(f"The program will shut down after {seconds}s...")
     _time.sleep(seconds)
+    network_close_session()
     exit()
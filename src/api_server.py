@@ -1,10 +1,10 @@
-from waitress import serve
-from flask import Flask, request
-from . import log, event_post, StoppableThread
-import time
-import requests
+import asyncio
+import hmac
 import secrets
-import logging
+import time
+from aiohttp import web
+from . import log, event_post, event_queue_depth
+from .metrics import render as render_metrics, CONTENT_TYPE, API_REQUESTS, API_REQUEST_DURATION, API_QUEUE_DEPTH
 
 #! Store API key in header is more secure than in URL
 
@@ -12,79 +12,165 @@ api_key = None
 GEN_API_KEY_LENGTH = 32 # Length of the generated API key
 event_id_receive = None
 START_PORT = 5000
+MAX_PORT_TRIES = 100 # Number of ports to try before giving up
+KEEPALIVE_TIMEOUT = 75 # seconds, keep the forwarder connections open between alerts
+MAX_QUEUE_SIZE = 10_000 # Max number of received alerts waiting to be processed, the queue size of the `event_id_receive` subscriber
+MAX_BATCH_SIZE = 1_000 # Max number of alerts in one batch request
+
+# the received alerts wait in the queue of the asynchronous `event_id_receive` subscriber
+API_QUEUE_DEPTH.set_function(lambda: event_queue_depth(event_id_receive) if event_id_receive else 0)
+
+def _is_authorized(request: web.Request) -> bool:
+    key = request.headers.get("X-API-KEY")
+    return bool(api_key and key) and hmac.compare_digest(key, api_key)
+
+def _is_authorized_query(request: web.Request) -> bool:
+    key = request.query.get("auth")
+    return bool(api_key and key) and hmac.compare_digest(key, api_key)
 
-app = Flask("API Server")
-# app.config["DEBUG"] = True
+def _enqueue(items: list) -> bool:
+    # a batch is accepted or rejected as a whole
+    if event_queue_depth(event_id_receive) + len(items) > MAX_QUEUE_SIZE:
+        log.warning(f"Receive queue is full, {len(items)} alert(s) rejected.")
+        return False
+    rejected = sum(not event_post(event_id_receive, item) for item in items)
+    if rejected:
+        log.warning(f"Receive queue is full, {rejected} alert(s) rejected.")
+        return False
+    return True
+
+def _busy_response() -> web.Response:
+    return web.Response(status=503, headers={"Retry-After": "1"})
 
 # Route to receive JSON data
-@app.route("/api", methods=["POST"])
-def api():
+async def api(request: web.Request) -> web.Response:
+    # verify API key
+    if not _is_authorized(request):
+        return web.Response(status=403)
+    try:
+        data = await request.json()
+    except ValueError:
+        return web.Response(status=400)
+    if not _enqueue([data]):
+        return _busy_response()
+    return web.Response(status=204)
+
+# Route to receive a JSON list of data
+async def api_batch(request: web.Request) -> web.Response:
     # verify API key
-    if request.headers.get("X-API-KEY") != api_key:
-        return "", 403
-    data = request.json
-    event_post(event_id_receive, data)
-    return "", 204
+    if not _is_authorized(request):
+        return web.Response(status=403)
+    try:
+        data = await request.json()
+    except ValueError:
+        return web.Response(status=400)
+    if not isinstance(data, list):
+        return web.Response(status=400, text="Expected a JSON list")
+    if len(data) > MAX_BATCH_SIZE:
+        return web.Response(status=413, text=f"Max {MAX_BATCH_SIZE} alerts per batch")
+    if not _enqueue(data):
+        return _busy_response()
+    return web.Response(status=204)
+
+async def auth(request: web.Request) -> web.Response:
+    return web.Response(status=204) if _is_authorized_query(request) else web.Response(status=403)
 
-@app.route("/ping", methods=["GET"])
-def auth():
-    auth = request.args.get("auth")
-    return ("", 204) if auth == api_key else ("", 403)
+# The server is exposed to the public through ngrok, so the metrics require the API key
+async def metrics(request: web.Request) -> web.Response:
+    if not _is_authorized(request) and not _is_authorized_query(request):
+        return web.Response(status=403)
+    # the API workers render the aggregate of all the processes through the coordinator, off the event loop
+    body = await asyncio.get_running_loop().run_in_executor(None, render_metrics)
+    return web.Response(body=body.encode(), headers={"Content-Type": CONTENT_TYPE})
+
+@web.middleware
+async def metrics_middleware(request: web.Request, handler) -> web.StreamResponse:
+    start_time = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as err:
+        status = err.status
+        raise
+    finally:
+        path = request.match_info.route.resource.canonical if request.match_info.route.resource else "unknown"
+        API_REQUESTS.labels(path, status).inc()
+        API_REQUEST_DURATION.labels(path).observe(time.perf_counter() - start_time)
+
+def create_app() -> web.Application:
+    app = web.Application(middlewares=[metrics_middleware])
+    app.add_routes([
+        web.post("/api", api),
+        web.post("/api/batch", api_batch),
+        web.get("/ping", auth),
+        web.get("/metrics", metrics),
+    ])
+    return app
 
 def generate_api_key(num:int = 16) -> str:
     return secrets.token_urlsafe(num)
 
-def start(event_id_port:str | None = None, event_id_rev:str | None = None, fixed_api_key:str | None = None):
+async def _bind(runner: web.AppRunner, port: int | None = None, reuse_port: bool = False) -> int:
+    if port is not None:
+        # eg. a worker process sharing the port of the others (SO_REUSEPORT)
+        await web.TCPSite(runner, port=port, reuse_port=reuse_port).start()
+        return port
+    # bind the first free port, the OS tells us if the port is in use
+    for port in range(START_PORT, START_PORT + MAX_PORT_TRIES):
+        site = web.TCPSite(runner, port=port)
+        try:
+            await site.start()
+            return port
+        except OSError:
+            log.info(f"Port {port} is in use, trying next port...")
+    raise OSError(f"No free port found in range {START_PORT}-{START_PORT + MAX_PORT_TRIES - 1}")
+
+def start(event_id_port:str | None = None, event_id_rev:str | None = None, fixed_api_key:str | None = None, port:int | None = None, reuse_port:bool = False, announce:bool = True):
     """
     ### Description ###
-    Start the API server
-    
+    Start the API server, this function blocks until the server is stopped.
+
     ### Parameters ###
         - `event_id_port`: Event ID to post the port number
-        - `event_id_rev`: Event ID to post the received data
+        - `event_id_rev`: Event ID to post the received data, its subscriber should be asynchronous
+          (eg. `queue_size=MAX_QUEUE_SIZE` and the reject policy) so the requests are answered at once
         - `fixed_api_key`: Optional fixed API key to use instead of generating one
+        - `port`: Optional port to listen on instead of the first free one from `START_PORT`
+        - `reuse_port`: Share `port` with other processes (SO_REUSEPORT), the kernel spreads the connections between them
+        - `announce`: Log the port and the API key, eg. not by every worker process
     """
-    def _try_start_with(p:int):
-        # start server
-        serve(app, port=p, ident="API Server") # production server
-        # app.run(port=p) # development server
-        
     global api_key
     global event_id_receive
-    log.info("Start port test...")
-    port = START_PORT
-    while True:
-        log.info(f"Testing port {port}")
-        
-        # disable waitress logging to avoid double logging
-        # ref: https://stackoverflow.com/a/73718530
-        noop = logging.NullHandler()
-        logging.getLogger().addHandler(noop)
-        
-        thread = StoppableThread(target=_try_start_with, args=(port,))
-        thread.start()
-        # Use fixed API key if provided, otherwise generate a temporary one for testing
-        api_key = fixed_api_key if fixed_api_key else generate_api_key(32)
-        time.sleep(1)
-        rep = requests.get(f"http://127.0.0.1:{port}/ping?auth={api_key}")
-        if rep.status_code == 204:
-            # If ping is successful, the port is free
-            log.info(f"Port {port} is free~")
-            log.ok(f"API server is ready to use, port: {port}")
-            # Use fixed API key if provided, otherwise generate a new one
-            if not fixed_api_key:
-                api_key = generate_api_key(GEN_API_KEY_LENGTH)
-            log.info(f"Your API key: {api_key}")
-            if fixed_api_key:
-                log.info("Using configured fixed API key from config file.")
-            log.info("Please add 'X-API-KEY' and the API key to the header as the header name and header value of your request.")
-            if event_id_port:
-                event_post(event_id_port, port)
-            if event_id_rev:
-                event_id_receive = event_id_rev
-            break
-        thread.stop()
-        port += 1
-    
+    # Use fixed API key if provided, otherwise generate a new one
+    api_key = fixed_api_key if fixed_api_key else generate_api_key(GEN_API_KEY_LENGTH)
+    if event_id_rev:
+        event_id_receive = event_id_rev
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    # disable access logging to avoid double logging
+    runner = web.AppRunner(create_app(), access_log=None, keepalive_timeout=KEEPALIVE_TIMEOUT)
+    loop.run_until_complete(runner.setup())
+    port = loop.run_until_complete(_bind(runner, port, reuse_port))
+
+    if announce:
+        log.ok(f"API server is ready to use, port: {port}")
+        log.info(f"Your API key: {api_key}")
+        if fixed_api_key:
+            log.info("Using configured fixed API key from config file.")
+        log.info("Please add 'X-API-KEY' and the API key to the header as the header name and header value of your request.")
+    else:
+        log.debug(f"API server is listening on port {port}")
+    if event_id_port:
+        event_post(event_id_port, port)
+
+    try:
+        loop.run_forever()
+    finally:
+        loop.run_until_complete(runner.cleanup())
+        loop.close()
+
 if __name__ == "__main__":
     start()
@@ -0,0 +1,56 @@
+import random
+
+class Backoff:
+    """
+    Exponential backoff with jitter.
+
+    The n-th delay is picked at random between `base` * `factor` ** (n-1) / 2
+    and `base` * `factor` ** (n-1), capped at `cap`, so many clients that
+    failed at the same time don't retry at the same time.
+
+    - Reference: https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/
+    """
+
+    def __init__(self, base: float = 0.5, cap: float = 60, factor: float = 2, jitter: bool = True):
+        if base <= 0 or cap <= 0:
+            raise ValueError("'base' and 'cap' must be greater than 0")
+        self.base = base
+        self.cap = cap
+        self.factor = factor
+        self.jitter = jitter
+        self.attempts = 0
+
+    def peek(self, attempt: int | None = None) -> float:
+        """
+        ### Description ###
+        Get the max delay of an attempt without counting it.
+
+        ### Parameters ###
+            - `attempt` (int | optional): The attempt number (starting at 1), the next attempt if not specified.
+
+        ### Returns ###
+            - (float): The max delay in seconds
+        """
+        attempt = self.attempts + 1 if attempt is None else attempt
+        # avoid the float overflow of huge exponents
+        exponent = min(attempt - 1, 64)
+        return min(self.cap, self.base * self.factor ** exponent)
+
+    def next(self) -> float:
+        """
+        ### Description ###
+        Count an attempt and get the delay to wait before it.
+
+        ### Returns ###
+            - (float): The delay in seconds
+        """
+        delay = self.peek()
+        self.attempts += 1
+        return random.uniform(delay / 2, delay) if self.jitter else delay
+
+    def reset(self):
+        """
+        ### Description ###
+        Start again from the first delay, eg. after a success.
+        """
+        self.attempts = 0
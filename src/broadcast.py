@@ -1,27 +1,59 @@
-import json
+import email.utils
+import threading
 import time
 
-from . import config, log, is_url_valid, send_post_request, plan_to_run_run_at
+import os
+from typing import Callable
+from urllib.parse import urlparse
+
+from . import config, log, is_url_valid, send_post_request, project_main_directory
 from . import POST_REQUEST_HEADERS, RETRY_AFTER_HEADER
+from .fan_out import FanOut, DeliveryJob, DeliveryResult, DEFAULT_MAX_WORKERS
+from .payload import Payload, dumps as json_dumps, set_json_backend
+from .outbox import Outbox, DeliveryState
+from .retry import RetryPolicy, RetryQueue, RetryEntry
+from .targets import DEFAULT_TIMEOUT, Target, build_targets, make_target
+from .routing import Router, build_router
+from .rate_limit import TokenBucket
+from .proxy_pool import ProxyPool, DEFAULT_PROBE_URL, DEFAULT_PROBE_INTERVAL
+from .telegram_sender import TelegramSender, TARGET_NAME as TELEGRAM_TARGET_NAME, DEFAULT_CHAT_RATE, DEFAULT_CHAT_BURST, DEFAULT_GLOBAL_RATE, DEFAULT_MAX_QUEUE
+from .metrics import DELIVERIES, DELIVERY_DURATION, BROADCASTS_IN_FLIGHT, DELIVERY_RETRIES, RETRY_QUEUE_DEPTH, TELEGRAM_QUEUE_DEPTH
 
-webhook_urls:list[str] | None = config.get("webhook_urls")
 tg_bot_token:str | None = config.get("tg_bot_token")
 tg_chat_id:str | None = config.get("tg_chat_id")
+tg_chat_rate:float = config.get("tg_chat_rate", DEFAULT_CHAT_RATE)
+tg_chat_burst:float = config.get("tg_chat_burst", DEFAULT_CHAT_BURST)
+tg_global_rate:float = config.get("tg_global_rate", DEFAULT_GLOBAL_RATE)
+tg_queue_size:int = config.get("tg_queue_size", DEFAULT_MAX_QUEUE)
+tg_digest_threshold:int = config.get("tg_digest_threshold", 0)
+# the messages are sent by one thread, a request that never ends would stop all of them
+tg_timeout:float = config.get("tg_timeout", DEFAULT_TIMEOUT)
+broadcast_max_workers:int = config.get("broadcast_max_workers", DEFAULT_MAX_WORKERS)
+webhook_timeout:float = config.get("webhook_timeout", DEFAULT_TIMEOUT)
+json_backend:str = config.get("json_backend", "auto")
+outbox_enabled:bool = config.get("outbox_enabled", True)
+outbox_path:str = config.get("outbox_path") or os.path.join(project_main_directory, ".temp", "outbox.sqlite3")
+outbox_replay_max_age:float = config.get("outbox_replay_max_age", 300)
+outbox_retention:float = config.get("outbox_retention_days", 7) * 24 * 60 * 60
+archive_enabled:bool = config.get("archive_enabled", False)
+archive_path:str = config.get("archive_path") or os.path.join(project_main_directory, ".temp", "archive")
+archive_max_bytes:int = int(config.get("archive_max_mb", 64) * 1024 * 1024)
+archive_max_age:float = config.get("archive_max_age_hours", 24) * 60 * 60
+retry_policy = RetryPolicy(
+    max_attempts=config.get("retry_max_attempts", 5),
+    backoff_base=config.get("retry_backoff_base", 1.0),
+    backoff_cap=config.get("retry_backoff_cap", 60.0),
+    jitter=config.get("retry_jitter", True),
+    max_age=config.get("retry_max_age", 300),
+)
+# per target overrides, keyed by the webhook URL, its host name or "telegram"
+retry_policies:dict[str, RetryPolicy] = {
+    target: RetryPolicy.from_config(values, retry_policy) for target, values in config.get("retry_policies", {}).items()
+}
 
-if (tg_bot_token and not tg_chat_id) or (not tg_bot_token and tg_chat_id):
-    log.error("Telegram bot token and chat ID must be both set or both empty.")
-    exit()
-
-# List broadcast methods
-log.info("Broadcast methods:")
-if webhook_urls:
-    log.info(f"[+] Webhook: {len(webhook_urls)} URL(s) found.")
-else :
-    log.info("[-] Webhook: Disabled")
-if tg_bot_token and tg_chat_id:
-    log.info("[+] Telegram: ✅")
-else:
-    log.info("[-] Telegram: Disabled")
+TG_TARGET_NAME = TELEGRAM_TARGET_NAME
+TG_API_URL = config.get("tg_api_url") or "https://api.telegram.org"
+TG_API_HOST = urlparse(TG_API_URL).hostname
 
 proxy_url = config.get("proxy_url")
 proxies = {
@@ -29,84 +61,455 @@ proxies = {
     "https": proxy_url
 } if proxy_url else None
 
-# Validate proxy URL
-if proxies != None:
-    if is_valid_url := is_url_valid(proxy_url):
-        log.info(f"Using proxy: {proxy_url}")
-    else:
-        log.error(f"Invalid proxy URL: {proxy_url}")
-        exit()
+# several proxies: each request goes through the fastest healthy one
+proxy_urls:list[str] = config.get("proxy_urls") or []
+
+# created by `setup`, nothing is done when the module is imported
+proxy_pool:ProxyPool | None = None
+webhook_targets:list[Target] = []
+_targets_by_name:dict[str, Target] = {}
+outbox:Outbox | None = None
+archive = None
+tg_sender: TelegramSender | None = None
+router:Router | None = None
+fan_out = FanOut(max_workers=broadcast_max_workers)
+retry_queues:dict[str, RetryQueue] = {}
+_retry_queues_lock = threading.Lock()
+_setup_lock = threading.Lock()
+_is_setup = False
+
+def setup(archive_name: str = "alerts", bucket_factory: Callable[[str, float, float | None], TokenBucket] | None = None):
+    """
+    ### Description ###
+    Validate the broadcast config, build the webhook targets and the
+    Telegram sender, open the outbox and the archive and start the proxy
+    pool. Called once, before the first broadcast if not called before
+    (the program exits if the config is invalid).
+
+    ### Parameters ###
+        - `archive_name` (str): The base name of the archive files, each process needs its own
+        - `bucket_factory` (Callable | optional): The Telegram rate limits, see `TelegramSender.set_bucket_factory`
+    """
+    global proxy_pool, webhook_targets, _targets_by_name, outbox, archive, router, tg_sender, _is_setup
+    with _setup_lock:
+        if _is_setup:
+            return
+        if (tg_bot_token and not tg_chat_id) or (not tg_bot_token and tg_chat_id):
+            log.error("Telegram bot token and chat ID must be both set or both empty.")
+            exit()
+
+        # Validate proxy URL
+        if proxies != None:
+            if is_valid_url := is_url_valid(proxy_url):
+                log.info(f"Using proxy: {proxy_url}")
+            else:
+                log.error(f"Invalid proxy URL: {proxy_url}")
+                exit()
+
+        if proxy_urls:
+            for url in proxy_urls:
+                if not is_url_valid(url):
+                    log.error(f"Invalid proxy URL: {url}")
+                    exit()
+            proxy_pool = ProxyPool(
+                proxy_urls,
+                probe_url=config.get("proxy_probe_url") or DEFAULT_PROBE_URL,
+                probe_interval=config.get("proxy_probe_interval", DEFAULT_PROBE_INTERVAL)
+            )
+            proxy_pool.start()
+            log.info(f"Using a pool of {len(proxy_urls)} proxies.")
+
+        # validated once here, nothing is parsed when an alert is sent
+        webhook_targets = build_targets(config, proxies, retry_policy, retry_policies, proxy_pool)
+        _targets_by_name = {target.name: target for target in webhook_targets}
+
+        # List broadcast methods
+        log.info("Broadcast methods:")
+        if enabled_count := sum(target.enabled for target in webhook_targets):
+            log.info(f"[+] Webhook: {enabled_count} URL(s) found.")
+        else :
+            log.info("[-] Webhook: Disabled")
+        if tg_bot_token and tg_chat_id:
+            log.info("[+] Telegram: ✅")
+        else:
+            log.info("[-] Telegram: Disabled")
+
+        tg_sender = TelegramSender(
+            lambda chat_id, text: send_msg_to_tg(text, chat_id), get_retry_policy(TG_TARGET_NAME),
+            chat_rate=tg_chat_rate, chat_burst=tg_chat_burst, global_rate=tg_global_rate,
+            max_queue=tg_queue_size, digest_threshold=tg_digest_threshold, on_result=_on_tg_result
+        )
+        if bucket_factory is not None:
+            tg_sender.set_bucket_factory(bucket_factory)
+        TELEGRAM_QUEUE_DEPTH.set_function(tg_sender.pending)
+
+        # compiled once here, an alert is matched against all the rules at once
+        router = build_router(config, [target.name for target in webhook_targets] + [TG_TARGET_NAME])
+        if router is not None:
+            log.info(f"[+] Routing: {len(router.routes)} rule(s), unmatched alerts go to {router.unmatched} targets.")
+
+        log.debug(f"JSON backend: {set_json_backend(json_backend)}")
+
+        outbox = Outbox(outbox_path) if outbox_enabled else None
+        if archive_enabled:
+            # imports the email listener, not needed in ngrok mode otherwise
+            from .email_listener.email_processing import get_archive
+            archive = get_archive(archive_path, name=archive_name, max_bytes=archive_max_bytes, max_age=archive_max_age, logger=log.error)
+        _is_setup = True
+
+def get_target(target: Target | str) -> Target:
+    """
+    ### Description ###
+    Get a webhook target by name, the URLs that are not configured are validated.
+
+    ### Parameters ###
+        - `target` (Target | str): The target, its name or a webhook URL
+
+    ### Returns ###
+        - (Target): The target
+
+    ### Raises ###
+        - ValueError: If the target is not configured and is not a valid URL
+    """
+    if isinstance(target, Target):
+        return target
+    if not _is_setup:
+        setup()
+    if target in _targets_by_name:
+        return _targets_by_name[target]
+    return make_target(target, timeout=webhook_timeout, proxies=proxies, retry_policy=get_retry_policy(target), proxy_pool=proxy_pool)
 
-def send_webhook(payload: str | dict):
+def send_webhook_to(target: Target | str, payload: Payload | str | dict, alert_id: str | None = None) -> DeliveryResult:
     """
     ### Description ###
-    Send a webhook to the specified URL(s).
+    Send a webhook to one target.
     
     ### Parameters ###
-        - `payload` (str | dict): The content of the webhook to send
+        - `target` (Target | str): The target, its name or the URL to send the webhook to
+        - `payload` (Payload | str | dict): The content of the webhook to send
+        - `alert_id` (str | optional): The outbox ID of the alert
+
+    ### Returns ###
+        - (DeliveryResult): The delivery result
     """
-    for webhook_url in webhook_urls:
-        res = send_post_request(webhook_url, payload, POST_REQUEST_HEADERS, proxies=proxies)
-        if res.status_code >= 200 and res.status_code < 300:
-            log.ok(f"Sent webhook to {webhook_url} successfully, response code: {res.status_code}")
-        elif retry_after := res.headers.get("Retry-After"):
-            if res.status_code == 429:
-                log.warning(f"Sent webhook to {webhook_url} failed, response code: {res.status_code}, Content: {payload}, Retry-After header({RETRY_AFTER_HEADER}) found, auto retry after {retry_after}s...")
-                plan_to_run_run_at(time.time() + float(retry_after), send_webhook, payload)
-                continue
-            log.error(f"Sent webhook to {webhook_url} failed, response code: {res.status_code}, Content: {payload}.")
+    target = get_target(target)
+    res = _post(target.url, payload, target.headers, target.proxies, target.proxy_pool, target.timeout, target.host)
+    if res.status_code >= 200 and res.status_code < 300:
+        log.ok(f"Sent webhook to {target.name} successfully, response code: {res.status_code}")
+        return DeliveryResult(target.name, True, res.status_code)
+    if res.status_code == 429 and (retry_after := _parse_retry_after(res.headers.get(RETRY_AFTER_HEADER))) is not None:
+        log.warning(f"Sent webhook to {target.name} failed, response code: {res.status_code}, Content: {payload}, Retry-After header({RETRY_AFTER_HEADER}) found, retry after {retry_after}s...")
+        return DeliveryResult(target.name, False, res.status_code, error=f"Rate limited, retry after {retry_after}s", retry_after=retry_after)
+    log.error(f"Sent webhook to {target.name} failed, response code: {res.status_code}, Content: {payload}.")
+    return DeliveryResult(target.name, False, res.status_code, error=f"HTTP {res.status_code}")
 
-def send_msg_to_tg(payload:str | dict) -> None:
+def _post(url: str, payload: Payload | bytes | str | dict, headers: dict, proxies: dict | None, pool: ProxyPool | None, timeout: float | None, host: str | None):
+    if pool is None:
+        return send_post_request(url, payload, headers, proxies=proxies, timeout=timeout, host=host)
+    # fails over to the next proxy when the proxy can't be reached
+    return pool.call(lambda pool_proxies: send_post_request(url, payload, headers, proxies=pool_proxies, timeout=timeout, host=host))
+
+def _parse_retry_after(value: str | None) -> float | None:
+    # https://www.rfc-editor.org/rfc/rfc9110#field.retry-after seconds or an HTTP date
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def _webhook_jobs(payload: Payload, targets: list[Target], alert_id: str | None = None) -> list[DeliveryJob]:
+    return [
+        DeliveryJob(target.name, target.url, lambda target=target: send_webhook_to(target, payload, alert_id), target.host)
+        for target in targets
+    ]
+
+def send_webhook(payload: Payload | str | dict, alert_id: str | None = None) -> list[DeliveryResult]:
     """
     ### Description ###
-    Send a message to the specified Telegram chat.
+    Send a webhook to the specified URL(s) in parallel.
     
     ### Parameters ###
-        - `payload` (str | dict): The content of the message to send
+        - `payload` (Payload | str | dict): The content of the webhook to send
+        - `alert_id` (str | optional): The outbox ID of the alert
+
+    ### Returns ###
+        - (list[DeliveryResult]): The delivery result of each URL
+    """
+    if not _is_setup:
+        setup()
+    payload = Payload.of(payload)
+    created = time.time()
+    with BROADCASTS_IN_FLIGHT.track_in_progress():
+        results = fan_out.run(_webhook_jobs(payload, [target for target in webhook_targets if target.enabled], alert_id))
+    _retry_failures(payload, alert_id, created, results)
+    _record_results(alert_id, results)
+    _record_metrics(results)
+    return results
+
+def send_msg_to_tg(payload:Payload | str | dict, chat_id: str | None = None) -> DeliveryResult:
+    """
+    ### Description ###
+    Send a message to the specified Telegram chat, right away. `broadcast`
+    queues the messages to `tg_sender` instead, which splits the long
+    messages and follows the rate limits.
+    
+    ### Parameters ###
+        - `payload` (Payload | str | dict): The content of the message to send
+        - `chat_id` (str | optional): The chat ID, `tg_chat_id` if not specified
+
+    ### Returns ###
+        - (DeliveryResult): The delivery result
 
     ### Raises ###
         - ValueError: If message exceeds Telegram's length limit
     """
-    if isinstance(payload, dict):
-        payload = json.dumps(payload)
+    if not isinstance(payload, str):
+        payload = Payload.of(payload).text
         
     if len(payload) > 4096:
         raise ValueError("Message exceeds Telegram's 4096 character limit")
 
-    payload = json.dumps({"chat_id": f"{tg_chat_id}", "text": f"{payload}"})
-    response = send_post_request(
-        f"https://api.telegram.org/bot{tg_bot_token}/sendMessage",
+    payload = json_dumps({"chat_id": f"{chat_id or tg_chat_id}", "text": payload})
+    response = _post(
+        f"{TG_API_URL}/bot{tg_bot_token}/sendMessage",
         payload,
         POST_REQUEST_HEADERS,
-        proxies=proxies
+        proxies,
+        proxy_pool,
+        tg_timeout,
+        TG_API_HOST
     )
     if response.status_code >= 400:
         log.error(f"Telegram API error: {response.text}")
+        return DeliveryResult(TG_TARGET_NAME, False, response.status_code, error=response.text, retry_after=_tg_retry_after(response))
+    return DeliveryResult(TG_TARGET_NAME, True, response.status_code)
+
+def _tg_retry_after(response) -> float | None:
+    # https://core.telegram.org/bots/api#responseparameters
+    try:
+        return float(response.json()["parameters"]["retry_after"])
+    except (ValueError, KeyError, TypeError):
+        return _parse_retry_after(response.headers.get(RETRY_AFTER_HEADER))
+
+def _is_tg_enabled() -> bool:
+    return bool(tg_bot_token and tg_chat_id and tg_bot_token.strip() and tg_chat_id.strip())
 
-def broadcast(payload:str | dict) -> None:
+def get_retry_policy(target: str) -> RetryPolicy:
     """
     ### Description ###
-    Broadcast the payload to all available methods.
+    Get the retry policy of a target, set by its `retry` key, in
+    `retry_policies` by target name or host name, `retry_*` otherwise.
+
+    ### Parameters ###
+        - `target` (str): The target name
+
+    ### Returns ###
+        - (RetryPolicy): The policy
+    """
+    if target in _targets_by_name:
+        return _targets_by_name[target].retry_policy
+    if target in retry_policies:
+        return retry_policies[target]
+    return retry_policies.get(urlparse(target).hostname or "", retry_policy)
+
+def get_retry_queue(target: str) -> RetryQueue:
+    """
+    ### Description ###
+    Get the retry queue of a target, create it if it does not exist yet.
+
+    ### Parameters ###
+        - `target` (str): The target name
+
+    ### Returns ###
+        - (RetryQueue): The queue
+    """
+    with _retry_queues_lock:
+        if target not in retry_queues:
+            retry_queues[target] = RetryQueue(target, lambda payload, alert_id: send_webhook_to(target, payload, alert_id), get_retry_policy(target), _on_retry_result)
+        return retry_queues[target]
+
+def _retry_failures(payload: Payload, alert_id: str | None, created: float, results: list[DeliveryResult]):
+    # only the targets that failed are retried, the others never get the alert twice
+    for result in results:
+        if result.success or result.queued:
+            continue
+        if get_retry_queue(result.target).add(payload, alert_id, created, result):
+            result.retrying = True
+            DELIVERY_RETRIES.labels(_metric_target(result.target), "queued").inc()
+
+def _on_retry_result(entry: RetryEntry, result: DeliveryResult, final: bool):
+    _record_metrics([result])
+    if result.success:
+        outcome, state = "delivered", DeliveryState.DELIVERED
+    elif final:
+        outcome, state = "gave_up", DeliveryState.FAILED
+    else:
+        return
+    DELIVERY_RETRIES.labels(_metric_target(result.target), outcome).inc()
+    if outbox is not None and entry.alert_id is not None:
+        outbox.mark(entry.alert_id, result.target, state, result.error)
+
+def _on_tg_result(alert_ids: list[str | None], result: DeliveryResult):
+    _record_metrics([result])
+    for alert_id in alert_ids:
+        _record_results(alert_id, [result])
+
+def _record_results(alert_id: str | None, results: list[DeliveryResult]):
+    if outbox is None or alert_id is None:
+        return
+    for result in results:
+        if result.queued:
+            # still pending, recorded when sent
+            continue
+        if result.success:
+            state = DeliveryState.DELIVERED
+        elif result.retrying:
+            state = DeliveryState.RETRYING
+        else:
+            state = DeliveryState.FAILED
+        outbox.mark(alert_id, result.target, state, result.error)
+
+def _record_metrics(results: list[DeliveryResult]):
+    for result in results:
+        if result.queued:
+            continue
+        host = _metric_target(result.target)
+        if result.status_code is not None:
+            status = str(result.status_code)
+        else:
+            status = "error"
+        DELIVERIES.labels(host, status).inc()
+        DELIVERY_DURATION.labels(host).observe(result.elapsed)
+
+def _metric_target(target: str) -> str:
+    # label by host, the URLs can be many and may contain secrets
+    if target in _targets_by_name:
+        return _targets_by_name[target].host
+    return TG_TARGET_NAME if target == TG_TARGET_NAME else (urlparse(target).hostname or "unknown")
+
+RETRY_QUEUE_DEPTH.set_function(lambda: sum(len(queue) for queue in list(retry_queues.values())))
+
+def _queue_tg(payload: Payload, alert_id: str | None, created: float) -> DeliveryResult:
+    if not tg_sender.submit(tg_chat_id, payload.text, alert_id, created):
+        log.error("Telegram queue is full, the message is dropped.")
+        return DeliveryResult(TG_TARGET_NAME, False, error="Telegram queue is full", retryable=False)
+    return DeliveryResult(TG_TARGET_NAME, False, queued=True)
+
+def get_targets() -> list[str]:
+    """
+    ### Description ###
+    Get the names of all available broadcast targets.
+
+    ### Returns ###
+        - (list[str]): The target names
+    """
+    if not _is_setup:
+        setup()
+    targets = [target.name for target in webhook_targets if target.enabled]
+    if _is_tg_enabled():
+        targets.append(TG_TARGET_NAME)
+    return targets
+
+def deliver(payload: Payload | str | dict, targets: list[str], alert_id: str | None = None, created: float | None = None) -> list[DeliveryResult]:
+    """
+    ### Description ###
+    Deliver the payload to the given targets in parallel. The failed
+    deliveries are retried in the background, per target, see `get_retry_policy`.
+    The Telegram message is only queued to `tg_sender`, so it never delays the webhooks.
+
+    ### Parameters ###
+        - `payload` (Payload | str | dict): The content to deliver, decoded and encoded once for all the targets
+        - `targets` (list[str]): The target names, see `get_targets`
+        - `alert_id` (str | optional): The outbox ID of the alert
+        - `created` (float | optional): When the alert was received (timestamp), now if not specified
+
+    ### Returns ###
+        - (list[DeliveryResult]): The delivery result of each target
+    """
+    payload = Payload.of(payload)
+    jobs = _webhook_jobs(payload, [_targets_by_name[target] for target in targets if target in _targets_by_name], alert_id)
+    created = time.time() if created is None else created
+    with BROADCASTS_IN_FLIGHT.track_in_progress():
+        results = fan_out.run(jobs)
+    if TG_TARGET_NAME in targets:
+        results.append(_queue_tg(payload, alert_id, created))
+    _retry_failures(payload, alert_id, created, results)
+    _record_results(alert_id, results)
+    _record_metrics(results)
+    return results
+
+def replay_outbox():
+    """
+    ### Description ###
+    Deliver the alerts that were accepted but not delivered before the last
+    shutdown. Alerts older than `outbox_replay_max_age` seconds are expired
+    instead of delivered.
+    """
+    setup()
+    if outbox is None:
+        return
+    pending_alerts = outbox.pending(max_age=outbox_replay_max_age)
+    outbox.prune(outbox_retention)
+    if not pending_alerts:
+        return
+    log.warning(f"Replaying {len(pending_alerts)} undelivered alert(s) from the outbox...")
+    available_targets = set(get_targets())
+    for alert in pending_alerts:
+        targets = [target for target in alert.targets if target in available_targets]
+        for target in set(alert.targets) - available_targets:
+            outbox.mark(alert.alert_id, target, DeliveryState.FAILED, "Target no longer configured")
+        if targets:
+            deliver(alert.payload, targets, alert.alert_id, alert.created)
+
+def broadcast(payload:Payload | str | dict, source: dict | None = None) -> list[DeliveryResult]:
+    """
+    ### Description ###
+    Broadcast the payload in parallel to all available methods, or to
+    those selected by the `routes` of the config.
+    The alert is recorded in the outbox before it is sent, and in the
+    archive (if enabled) with its delivery results once sent.
     
     ### Parameters ###
-        - `payload` (str | dict): The content to broadcast
-    """
-    success = True
-    if webhook_urls:
-        try:
-            send_webhook(payload)
-        except Exception as e:
-            success = False
-            log.error(f"Webhook broadcast failed: {str(e)}")
-
-    if tg_bot_token and tg_chat_id and tg_bot_token.strip() and tg_chat_id.strip():
-        try:
-            send_msg_to_tg(payload)
-        except Exception as e:
-            success = False
-            log.error(f"Telegram broadcast failed: {str(e)}")
-
-    if success:
+        - `payload` (Payload | str | dict): The content to broadcast
+        - `source` (dict | optional): Where the alert comes from (eg. subject, sender), archived with it
+
+    ### Returns ###
+        - (list[DeliveryResult]): The delivery result of each target
+    """
+    if not _is_setup:
+        setup()
+    payload = Payload.of(payload)
+    targets = get_targets()
+    if router is not None:
+        targets = router.select(targets, payload.data, source)
+        if not targets:
+            log.info("No route matches the alert, SKIP.")
+            return []
+    alert_id = None
+    if outbox is not None:
+        alert_id = outbox.add_alert(payload.text, targets)
+
+    results = deliver(payload, targets, alert_id)
+    for result in results:
+        if not result.success and not result.queued and result.status_code is None:
+            log.error(f"Broadcast to {result.target} failed: {result.error}")
+
+    if all(result.success or result.queued for result in results):
         log.info("Broadcasted successfully.")
     else:
-        log.warning("Broadcast completed with some failures.")
+        log.warning(f"Broadcast completed with some failures ({sum(not result.success and not result.queued for result in results)}/{len(results)}, {sum(result.retrying for result in results)} retrying).")
+    if archive is not None:
+        # queued only, written in batches by the archive thread
+        archive.write({
+            "archived_at": time.time(),
+            "alert_id": alert_id,
+            **(source or {}),
+            "payload": payload.data,
+            "deliveries": [{"target": result.target, "success": result.success, "status_code": result.status_code, "error": result.error} for result in results],
+        })
+    return results
@@ -0,0 +1,195 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from . import config, log, project_main_directory
+
+DEFAULT_TTL = 24 * 60 * 60 # seconds
+DEFAULT_MAX_ENTRIES = 100_000
+COMPACT_MIN_LINES = 10_000 # Do not compact the file before it has this many lines
+
+class Deduplicator:
+    """
+    Remember the keys of the alerts that have been broadcasted so the same
+    alert is not broadcasted twice.
+
+    The keys are stored as 8-byte digests in an insertion ordered hash map,
+    the oldest entries are evicted when they are older than `ttl` seconds or
+    when there are more than `max_entries` entries. All operations are O(1).
+
+    If `path` is given, every new key is appended to that file and the file
+    is loaded back on start, so a restart does not re-fire the same alerts.
+    """
+
+    def __init__(self, path: str | None = None, ttl: float = DEFAULT_TTL, max_entries: int = DEFAULT_MAX_ENTRIES):
+        if ttl <= 0:
+            raise ValueError("'ttl' must be greater than 0")
+        if max_entries <= 0:
+            raise ValueError("'max_entries' must be greater than 0")
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[bytes, float] = OrderedDict()
+        self._lock = threading.Lock()
+        self._file = None
+        self._file_lines = 0
+        if path:
+            self._load()
+
+    @staticmethod
+    def _digest(key: str) -> bytes:
+        return hashlib.blake2b(key.encode(), digest_size=8).digest()
+
+    def _load(self):
+        if folder := os.path.dirname(self.path):
+            os.makedirs(folder, exist_ok=True)
+        if os.path.exists(self.path):
+            expire_before = time.time() - self.ttl
+            with open(self.path, "r", encoding="ascii", errors="ignore") as file:
+                for line in file:
+                    self._file_lines += 1
+                    timestamp, _, digest = line.strip().partition(" ")
+                    try:
+                        timestamp = float(timestamp)
+                        digest = bytes.fromhex(digest)
+                    except ValueError:
+                        continue
+                    if timestamp >= expire_before:
+                        self._entries[digest] = timestamp
+                        self._entries.move_to_end(digest)
+            self._evict(time.time())
+        self._file = open(self.path, "a", encoding="ascii")
+        if self._file_lines > max(COMPACT_MIN_LINES, 2 * len(self._entries)):
+            self._compact()
+
+    def _compact(self):
+        # rewrite the file with the live entries only
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="ascii") as file:
+            file.writelines(f"{timestamp:.0f} {digest.hex()}\n" for digest, timestamp in self._entries.items())
+        if self._file:
+            self._file.close()
+        os.replace(temp_path, self.path)
+        self._file = open(self.path, "a", encoding="ascii")
+        self._file_lines = len(self._entries)
+
+    def _evict(self, now: float):
+        expire_before = now - self.ttl
+        while self._entries:
+            digest, timestamp = next(iter(self._entries.items()))
+            if timestamp >= expire_before and len(self._entries) <= self.max_entries:
+                break
+            self._entries.popitem(last=False)
+
+    def seen(self, *keys: str) -> bool:
+        """
+        ### Description ###
+        Check if any of the keys has been seen.
+
+        ### Parameters ###
+            - `keys` (str): The keys of the alert
+
+        ### Returns ###
+            - (bool): True if any of the keys has been seen
+        """
+        with self._lock:
+            self._evict(time.time())
+            return any(self._digest(key) in self._entries for key in keys if key)
+
+    def check_and_add(self, *keys: str) -> bool:
+        """
+        ### Description ###
+        Remember the keys if none of them has been seen.
+
+        ### Parameters ###
+            - `keys` (str): The keys of the alert, empty keys are ignored
+
+        ### Returns ###
+            - (bool): True if the alert is new, False if it is a duplicate
+        """
+        digests = [self._digest(key) for key in keys if key]
+        now = time.time()
+        with self._lock:
+            self._evict(now)
+            if any(digest in self._entries for digest in digests):
+                return False
+            for digest in digests:
+                self._entries[digest] = now
+            self._evict(now)
+            if self._file:
+                try:
+                    self._file.write("".join(f"{now:.0f} {digest.hex()}\n" for digest in digests))
+                    self._file.flush()
+                    self._file_lines += len(digests)
+                    if self._file_lines > max(COMPACT_MIN_LINES, 2 * len(self._entries)):
+                        self._compact()
+                except OSError as err:
+                    log.error(f"Failed to save the deduplication keys, reason: {err}")
+        return True
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def close(self):
+        """
+        ### Description ###
+        Close the file of the deduplicator.
+        """
+        with self._lock:
+            if self._file:
+                self._file.close()
+            self._file = None
+
+def content_key(*parts) -> str:
+    """
+    ### Description ###
+    Build a deduplication key from the content of an alert.
+
+    ### Parameters ###
+        - `parts`: The parts of the alert, eg. sender, subject and body
+
+    ### Returns ###
+        - (str): The key
+    """
+    content_hash = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        content_hash.update(str(part).encode())
+        content_hash.update(b"\0")
+    return f"hash:{content_hash.hexdigest()}"
+
+_deduplicator: Deduplicator | None = None
+_deduplicator_lock = threading.Lock()
+
+def get_deduplicator() -> Deduplicator:
+    """
+    ### Description ###
+    Get the deduplicator shared by the ingestion modes, it is configured by
+    `dedup_ttl`, `dedup_max_entries` and `dedup_path` in the config file.
+
+    ### Returns ###
+        - (Deduplicator): The shared deduplicator
+    """
+    global _deduplicator
+    with _deduplicator_lock:
+        if _deduplicator is None:
+            _deduplicator = Deduplicator(
+                path=config.get("dedup_path") or os.path.join(project_main_directory, ".temp", "dedup.log"),
+                ttl=config.get("dedup_ttl", DEFAULT_TTL),
+                max_entries=config.get("dedup_max_entries", DEFAULT_MAX_ENTRIES)
+            )
+    return _deduplicator
+
+def set_deduplicator(deduplicator: Deduplicator):
+    """
+    ### Description ###
+    Replace the shared deduplicator, eg. by the one of the coordinator
+    process when there are several API workers.
+
+    ### Parameters ###
+        - `deduplicator` (Deduplicator): The deduplicator, or a proxy with `seen` and `check_and_add`
+    """
+    global _deduplicator
+    with _deduplicator_lock:
+        _deduplicator = deduplicator
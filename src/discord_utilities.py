@@ -3,6 +3,11 @@ import json
 from discord.embeds import Embed as OrginalEmbed
 from .network import send_post_request
 
+# ref: https://discord.com/developers/docs/resources/channel#embed-object-embed-limits
+MAX_EMBEDS_PER_MESSAGE = 10
+MAX_EMBED_DESCRIPTION_LENGTH = 4096
+MAX_EMBEDS_TOTAL_LENGTH = 6000 # characters of all embeds in one message
+
 class Embed(OrginalEmbed):
     class Color:
         # ref: https://gist.github.com/thomasbnt/b6f455e2c7d743b796917fa3c205f812
@@ -57,3 +62,20 @@ class Embed(OrginalEmbed):
 def send_message_to_webhook(url: str, message: str, embeds: list[dict] | None = None) -> requests.models.Response:
     payload = json.dumps({"content": message, "embeds": embeds})
     return send_post_request(url, payload)
+
+def send_embeds_to_webhook(url: str, embeds: list[dict], timeout: float | None = None) -> requests.models.Response:
+    """
+    ### Description ###
+    Send multiple embeds (max 10) in one webhook message.
+
+    ### Parameters ###
+        - `url` (str): Discord webhook URL
+        - `embeds` (list[dict]): The embeds, see `Embed.to_dict()`
+        - `timeout` (float | optional): Request timeout in seconds
+
+    ### Returns ###
+        - (requests.models.Response): Response
+    """
+    if len(embeds) > MAX_EMBEDS_PER_MESSAGE:
+        raise ValueError(f"Discord allows max {MAX_EMBEDS_PER_MESSAGE} embeds per message, got {len(embeds)}")
+    return send_post_request(url, json.dumps({"embeds": embeds}), timeout=timeout)
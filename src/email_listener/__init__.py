@@ -26,19 +26,29 @@ Example:
 """
 
 # Imports from other packages
+import contextlib
 import email
 import html2text
 from imapclient import IMAPClient, SEEN
 import os
+import threading
 
 from datetime import datetime
 
 # Imports from this package
+from .lean import parse_lean, decode_header_value, decode_charset, strip_line_break, html_to_text
+from .tls import ResumableSSLContext
 from .helpers import (
     calc_timeout,
+    enable_tcp_keepalive,
     get_time,
 )
 from .email_processing import write_txt_file
+from ..multi_task import StoppableThread
+from ..metrics import IMAP_IDLE_WAKEUPS, IMAP_FETCHED_EMAILS, IMAP_FETCH_BYTES
+
+# Restart IDLE every 5 minutes, some servers and NATs drop longer silent connections
+IDLE_RESTART_INTERVAL = 60*5
 
 
 class EmailListener:
@@ -54,7 +64,7 @@ class EmailListener:
 
     """
 
-    def __init__(self, email, app_password, folder="Inbox", attachment_dir=f"{os.getcwd()}/data/email attachments", logger=print, imap_address="imap.gmail.com", imap_port=993):
+    def __init__(self, email, app_password, folder="Inbox", attachment_dir=f"{os.getcwd()}/data/email attachments", logger=print, imap_address="imap.gmail.com", imap_port=993, imap_ssl=True, ssl_context=None, lean_parsing=False):
         """Initialize an EmailListener instance.
 
         Args:
@@ -66,23 +76,31 @@ class EmailListener:
             logger (function): The function for messages printed to the console.
             imap_address (str): The IMAP server to log into. Defaults to Gmail (imap.gmail.com).
             imap_port (int): The port to log into the IMAP server on. Defaults to 993.
+            imap_ssl (bool): Whether to connect with SSL/TLS. Defaults to True.
+            ssl_context (ssl.SSLContext): The SSL context to connect with, eg. a
+                ResumableSSLContext shared by the reconnections. Defaults to None.
+            lean_parsing (bool): Only parse the headers and the text of the emails,
+                the text is decoded on first access and nothing is written to disk,
+                see the `lean` module. Defaults to False.
         Returns:
             None
 
         """
 
-        # create attachment directory if it's not exist.
-        if not os.path.exists(attachment_dir):
-            os.makedirs(attachment_dir)
-
         self.email = email
         self.app_password = app_password
         self.folder = folder
         self.attachment_dir = attachment_dir
         self.server = None
+        self.idle_server = None
+        self.folder_info = None
+        self.last_uid = None
         self.logger = logger
         self.imap_address = imap_address
         self.imap_port = imap_port
+        self.imap_ssl = imap_ssl
+        self.ssl_context = ssl_context
+        self.lean_parsing = lean_parsing
 
 
     def login(self):
@@ -96,9 +114,60 @@ class EmailListener:
 
         """
 
-        self.server = IMAPClient(self.imap_address, self.imap_port)
-        self.server.login(self.email, self.app_password)
-        self.server.select_folder(self.folder, readonly=False)
+        self.server, self.folder_info = self.__connect(readonly=False)
+
+
+    def __connect(self, readonly):
+        """Helper function, opens a connection and selects the folder.
+
+        Args:
+            readonly (bool): Whether to select the folder read-only.
+
+        Returns:
+            The IMAPClient and the response of the folder selection.
+
+        """
+
+        server = IMAPClient(self.imap_address, self.imap_port, ssl=self.imap_ssl, ssl_context=self.ssl_context)
+        enable_tcp_keepalive(server.socket())
+        server.login(self.email, self.app_password)
+        # keep the TLS session (the TLS 1.3 ticket arrives after the handshake) to resume it on reconnect
+        if self.imap_ssl and isinstance(self.ssl_context, ResumableSSLContext):
+            self.ssl_context.remember(server.socket(), self.imap_address)
+        return server, server.select_folder(self.folder, readonly=readonly)
+
+
+    def open_idle_connection(self):
+        """Opens the read-only connection that `listen` keeps in IDLE with
+        `dual_connection`, ahead of time (eg. for a standby listener).
+
+        Args:
+            None
+
+        Returns:
+            None
+
+        """
+
+        if self.idle_server is None:
+            self.idle_server, _ = self.__connect(readonly=True)
+
+
+    def noop(self):
+        """Sends NOOP on the open connections, keeps them from being logged
+        out for inactivity, it raises if one of them is dead.
+
+        Args:
+            None
+
+        Returns:
+            None
+
+        """
+
+        for server in (self.server, self.idle_server):
+            if server is not None:
+                server.noop()
 
 
     def logout(self):
@@ -114,8 +183,46 @@ class EmailListener:
 
         self.server.logout()
         self.server = None
+        if self.idle_server is not None:
+            self.idle_server.logout()
+            self.idle_server = None
+        self.folder_info = None
+
+    def ensure_attachment_dir(self):
+        """Create the attachment directory if it doesn't exist, it is only
+        created when something is written to it.
+
+        Args:
+            None
+
+        Returns:
+            The attachment directory.
+
+        """
+
+        os.makedirs(self.attachment_dir, exist_ok=True)
+        return self.attachment_dir
+
+    def shutdown(self):
+        """Closes the connections without logging out, eg. when they are
+        probably dead and LOGOUT would only wait for a timeout.
+
+        Args:
+            None
+
+        Returns:
+            None
+
+        """
+
+        for server in (self.server, self.idle_server):
+            if server is not None:
+                with contextlib.suppress(Exception):
+                    server.shutdown()
+        self.server = None
+        self.idle_server = None
 
-    def scrape(self, move=None, unread=False, delete=False, search_filter="UNSEEN", latest_only=False, no_log = False):
+    def scrape(self, move=None, unread=False, delete=False, search_filter="UNSEEN", latest_only=False, no_log = False, incremental=False, from_filter=None):
         """Scrape unread emails from the current folder.
 
         Args:
@@ -126,14 +233,22 @@ class EmailListener:
             delete (bool): Whether the emails should be deleted. Defaults to
                 False.
             search_filter (str): The search filter to use. Defaults to "UNSEEN".
+                Ignored if `incremental` is True.
             latest_only (bool): Get the latest email only(the last email that the user received).
                 Defaults to False.
             no_log (bool): Whether to hide the notice. Defaults to False.
+            incremental (bool): Only fetch the emails with a UID greater than
+                `last_uid`, see `scrape_incremental`. Defaults to False.
+            from_filter (list): The sender addresses to accept, only used
+                if `incremental` is True. Defaults to None (any sender).
         Returns:
             A list of the file paths to each scraped email.
 
         """
 
+        if incremental:
+            return self.scrape_incremental(from_filter=from_filter, move=move, unread=unread, delete=delete, no_log=no_log)
+
         # Ensure server is connected
         if type(self.server) is not IMAPClient:
             raise ValueError("server attribute must be type IMAPClient")
@@ -147,50 +262,191 @@ class EmailListener:
             messages = messages[-1]
         # For each unseen message
         for uid, message_data in self.server.fetch(messages, 'RFC822').items():
-            # Get the message
-            email_message = email.message_from_bytes(message_data[b'RFC822'])
-            # Get who the message is from
-            from_email = self.__get_from(email_message)
+            IMAP_FETCHED_EMAILS.inc()
+            IMAP_FETCH_BYTES.inc(len(message_data[b'RFC822']))
+            key, val_dict = self.__parse_message(uid, message_data[b'RFC822'], no_log)
+            msg_dict[key] = val_dict
 
-            # Generate the dict key for this email
-            key = f"{uid}_{from_email}"
-            # Generate the value dictionary to be filled later
-            val_dict = {}
+            # If required, move the email, mark it as unread, or delete it
+            self.__execute_options(uid, move, unread, delete)
 
-            # Display notice
-            if (not no_log):
-                self.logger(f"PROCESSING: Email UID<{uid}> from {from_email}")
+        # Return the dictionary of messages and their contents
+        return msg_dict
+
+
+    def get_uid_next(self):
+        """Get the UID the next email of the current folder will be given.
+
+        Args:
+            None
+
+        Returns:
+            The next UID (int).
+
+        """
+
+        # Ensure server is connected
+        if type(self.server) is not IMAPClient:
+            raise ValueError("server attribute must be type IMAPClient")
+
+        uid_next = self.folder_info.get(b'UIDNEXT') if self.folder_info else None
+        if uid_next is None:
+            uid_next = self.server.folder_status(self.folder, [b'UIDNEXT'])[b'UIDNEXT']
+        return int(uid_next)
 
-            # Add the email address
-            val_dict["From_Address"] = from_email
 
-            # Add the email uid
-            val_dict["Email_UID"] = uid
+    def scrape_incremental(self, from_filter=None, move=None, unread=False, delete=False, no_log=False):
+        """Scrape the emails that arrived after the last scrape.
 
-            # Add the date, ref: https://docs.python.org/2/library/datetime.html#strftime-and-strptime-behavior
-            # eg. Wed, 2 Feb 2022 04:16:44 +0000
-            val_dict["Date"] = datetime.strptime(self.__get_date(email_message), "%a, %d %b %Y %H:%M:%S %z")
+        Only the UIDs greater than `last_uid` are searched, the sender is
+        filtered by the server, the envelopes are fetched first and the
+        full body is only fetched (without setting the \\Seen flag) for
+        the emails from an address in `from_filter`.
 
-            # Add the subject
-            val_dict["Subject"] = self.__get_subject(email_message).strip()
+        Args:
+            from_filter (list): The sender addresses to accept. Defaults to
+                None (any sender).
+            move (str): The folder to move the emails to. If None, the emails
+                are not moved. Defaults to None.
+            unread (bool): Whether the emails should stay unread.
+                Defaults to False.
+            delete (bool): Whether the emails should be deleted. Defaults to
+                False.
+            no_log (bool): Whether to hide the notice. Defaults to False.
+        Returns:
+            The dictionary of scraped emails, same as `scrape`.
+
+        """
 
-            # If the email has multiple parts
-            if email_message.is_multipart():
-                val_dict = self.__parse_multipart_message(email_message, val_dict)
+        # Ensure server is connected
+        if type(self.server) is not IMAPClient:
+            raise ValueError("server attribute must be type IMAPClient")
 
-            # If the message isn't multipart
-            else:
-                val_dict = self.__parse_singlepart_message(email_message, val_dict)
+        if self.last_uid is None:
+            self.last_uid = self.get_uid_next() - 1
+
+        criteria = ["UID", f"{self.last_uid + 1}:*"]
+        from_filter = [address.lower() for address in from_filter or []]
+        # (OR FROM a (OR FROM b FROM c))
+        if from_filter:
+            from_criteria = ["FROM", from_filter[-1]]
+            for address in reversed(from_filter[:-1]):
+                from_criteria = ["OR", "FROM", address, from_criteria]
+            criteria += from_criteria
+
+        # "n:*" always matches the last email, even if its UID is lower than n
+        uids = [uid for uid in self.server.search(criteria) if uid > self.last_uid]
+        if not uids:
+            return {}
+        # Advanced once the emails are fetched, a failed fetch is tried again next time
+        last_uid = max(uids)
+
+        # Check the sender with the envelope before fetching the body
+        if from_filter:
+            envelopes = self.server.fetch(uids, ["ENVELOPE"])
+            uids = [uid for uid, data in envelopes.items() if self.__get_envelope_from(data[b'ENVELOPE']) in from_filter]
+            if not uids:
+                self.last_uid = last_uid
+                return {}
 
+        msg_dict = {}
+        for uid, message_data in sorted(self.server.fetch(uids, ["BODY.PEEK[]"]).items()):
+            IMAP_FETCHED_EMAILS.inc()
+            IMAP_FETCH_BYTES.inc(len(message_data[b'BODY[]']))
+            key, val_dict = self.__parse_message(uid, message_data[b'BODY[]'], no_log)
             msg_dict[key] = val_dict
 
-            # If required, move the email, mark it as unread, or delete it
-            self.__execute_options(uid, move, unread, delete)
+        # BODY.PEEK does not mark the emails as read, do it in one go
+        if not unread:
+            self.server.add_flags(uids, [SEEN])
+        if move is not None or delete:
+            for uid in uids:
+                self.__execute_options(uid, move, False, delete)
 
-        # Return the dictionary of messages and their contents
+        self.last_uid = last_uid
         return msg_dict
 
 
+    def __get_envelope_from(self, envelope):
+        """Helper function for getting the sender address from an envelope.
+
+        Args:
+            envelope (imapclient.response_types.Envelope): The envelope.
+
+        Returns:
+            The lower case sender address, or None if there is no sender.
+
+        """
+
+        if not envelope.from_:
+            return None
+        address = envelope.from_[0]
+        if not address.mailbox or not address.host:
+            return None
+        return f"{address.mailbox.decode()}@{address.host.decode()}".lower()
+
+
+    def __parse_message(self, uid, raw_message, no_log):
+        """Helper function for parsing a raw email message.
+
+        Args:
+            uid (int): The email UID.
+            raw_message (bytes): The raw email message.
+            no_log (bool): Whether to hide the notice.
+
+        Returns:
+            A tuple of the dict key and the value dictionary of the message.
+
+        """
+
+        # Only parse the headers, the text is decoded on demand
+        if self.lean_parsing:
+            val_dict = parse_lean(uid, raw_message)
+            if (not no_log):
+                self.logger(f"PROCESSING: Email UID<{uid}> from {val_dict['From_Address']}")
+            return f"{uid}_{val_dict['From_Address']}", val_dict
+
+        # Get the message
+        email_message = email.message_from_bytes(raw_message)
+        # Get who the message is from
+        from_email = self.__get_from(email_message)
+
+        # Generate the dict key for this email
+        key = f"{uid}_{from_email}"
+        # Generate the value dictionary to be filled later
+        val_dict = {}
+
+        # Display notice
+        if (not no_log):
+            self.logger(f"PROCESSING: Email UID<{uid}> from {from_email}")
+
+        # Add the email address
+        val_dict["From_Address"] = from_email
+
+        # Add the email uid
+        val_dict["Email_UID"] = uid
+
+        # Add the date, ref: https://docs.python.org/2/library/datetime.html#strftime-and-strptime-behavior
+        # eg. Wed, 2 Feb 2022 04:16:44 +0000
+        val_dict["Date"] = datetime.strptime(self.__get_date(email_message), "%a, %d %b %Y %H:%M:%S %z")
+
+        # Add the subject
+        val_dict["Subject"] = self.__get_subject(email_message).strip()
+
+        # Add the message id
+        val_dict["Message_ID"] = (email_message.get("Message-ID") or "").strip()
+
+        # If the email has multiple parts
+        if email_message.is_multipart():
+            val_dict = self.__parse_multipart_message(email_message, val_dict)
+
+        # If the message isn't multipart
+        else:
+            val_dict = self.__parse_singlepart_message(email_message, val_dict)
+
+        return key, val_dict
+
+
     def __get_from(self, email_message):
         """Helper function for getting who an email message is from.
 
@@ -219,10 +475,10 @@ class EmailListener:
 
         """
 
-        # Get the subject
-        subject = email_message.get("Subject")
+        # Get the subject, decoded if it is RFC 2047 encoded
+        subject = decode_header_value(email_message.get("Subject")).strip()
         # If there isn't a subject
-        if subject is None:
+        if not subject:
             return "No Subject"
         return subject
 
@@ -259,7 +515,7 @@ class EmailListener:
             file_name = part.get_filename()
             if bool(file_name):
                 # Generate file path
-                file_path = os.path.join(self.attachment_dir, file_name)
+                file_path = os.path.join(self.ensure_attachment_dir(), file_name)
                 with open(file_path, "wb") as file:
                     file.write(part.get_payload(decode=True))
                 # Get the list of attachments, or initialize it if there isn't one
@@ -269,13 +525,16 @@ class EmailListener:
 
             elif part.get_content_type() == "text/html":
                 # Convert the body from html to plain text
-                val_dict["Plain_HTML"] = html2text.html2text(
-                        part.get_payload())
-                val_dict["HTML"] = part.get_payload()
+                val_dict["HTML"] = self.__get_text(part)
+                val_dict["Plain_HTML"] = html2text.html2text(val_dict["HTML"])
+
+            elif part.get_content_type() == "text/plain" and "Plain_Text" not in val_dict:
+                # Get the body, the first text part is the message
+                val_dict["Plain_Text"] = strip_line_break(self.__get_text(part))
 
-            elif part.get_content_type() == "text/plain":
-                # Get the body
-                val_dict["Plain_Text"] = part.get_payload()
+        # An HTML only message, like the lean parser
+        if "Plain_Text" not in val_dict and "HTML" in val_dict:
+            val_dict["Plain_Text"] = html_to_text(val_dict["HTML"])
 
         return val_dict
 
@@ -294,11 +553,29 @@ class EmailListener:
 
         """
 
-        # Get the message body, which is plain text
-        val_dict["Plain_Text"] = email_message.get_payload()
+        # Get the message body, the text of an HTML message
+        text = self.__get_text(email_message)
+        if email_message.get_content_type() == "text/html":
+            val_dict["Plain_Text"] = html_to_text(text)
+        else:
+            val_dict["Plain_Text"] = strip_line_break(text)
         return val_dict
 
 
+    def __get_text(self, part):
+        """Helper function for decoding the body of a message part.
+
+        Args:
+            part (email.message): The message part.
+
+        Returns:
+            The body decoded with its Content-Transfer-Encoding and charset.
+
+        """
+
+        return decode_charset(part.get_payload(decode=True) or b"", part.get_content_charset())
+
+
     def __execute_options(self, uid, move, unread, delete):
         """Loop through optional arguments and execute any required processing.
 
@@ -357,6 +634,11 @@ class EmailListener:
                     delete (bool): Whether the emails should be deleted. If not
                         set, emails are not deleted.
                     latest_only {on development} (bool): Get the latest email only(the last email that the user received).
+                    incremental (bool): Only fetch the emails that arrived after the last scrape.
+                    from_filter (list): The sender addresses to accept, only used if `incremental` is set.
+                    dual_connection (bool): Keep a second connection in IDLE all the time,
+                        the emails are fetched with the main connection, so no new email
+                        notification is missed while the emails are being processed.
 
         Returns:
             None
@@ -370,6 +652,11 @@ class EmailListener:
         # Get the timeout value
         outer_timeout = calc_timeout(timeout)
 
+        if kwargs.get("dual_connection"):
+            self.__listen_dual(None if timeout == -1 else outer_timeout, update_frequency, process_func, **kwargs)
+            self.logger("Email listener has stopped, reson: timeout")
+            return
+
         # Run until the timeout is reached
         if timeout == -1:
             while True:
@@ -399,6 +686,8 @@ class EmailListener:
                     delete (bool): Whether the emails should be deleted. If not
                         set, emails are not deleted.
                     latest_only (bool): Get the latest email only(the last email that the user received).
+                    incremental (bool): Only fetch the emails that arrived after the last scrape.
+                    from_filter (list): The sender addresses to accept, only used if `incremental` is set.
 
         Returns:
             None
@@ -410,21 +699,35 @@ class EmailListener:
         unread = bool(kwargs.get("unread"))
         delete = bool(kwargs.get("delete"))
         latest_only = bool(kwargs.get("latest_only"))
+        incremental = bool(kwargs.get("incremental"))
+        from_filter = kwargs.get("from_filter")
 
         # Start idling
         self.server.idle()
         # Set idle timeout to 5 minutes
-        inner_timeout = get_time() + 60*5
+        inner_timeout = get_time() + IDLE_RESTART_INTERVAL
         # Until idle times out
         while (get_time() < inner_timeout):
             # Check for a new response every x seconds
+            check_start = get_time()
             responses = self.server.idle_check(timeout=timeout)
+            # idle_check returns nothing at once when the connection is closed (EOF),
+            # restart the idling, it raises if the connection is dead
+            if not responses and get_time() - check_start < timeout / 2:
+                # the server may have sent the new emails along with the end of the idling
+                responses = self.server.idle_done()[1]
+                if self.__has_new_email(responses):
+                    IMAP_IDLE_WAKEUPS.inc()
+                    msgs = self.scrape(move=move, unread=unread, delete=delete, latest_only=latest_only, incremental=incremental, from_filter=from_filter)
+                    process_func(self, msgs)
+                self.server.idle()
             # If there is a response
-            if (responses):
+            elif (responses):
+                IMAP_IDLE_WAKEUPS.inc()
                 # Suspend the idling
                 self.server.idle_done()
                 # Process the new emails
-                msgs = self.scrape(move=move, unread=unread, delete=delete, latest_only=latest_only)
+                msgs = self.scrape(move=move, unread=unread, delete=delete, latest_only=latest_only, incremental=incremental, from_filter=from_filter)
                 # Run the process function
                 process_func(self, msgs)
                 # Restart idling
@@ -433,3 +736,109 @@ class EmailListener:
         self.server.idle_done()
         return
 
+
+    def __listen_dual(self, outer_timeout, update_frequency, process_func, **kwargs):
+        """Helper function, listens with one connection in IDLE and one fetching.
+
+        The IDLE connection only signals the new emails (EXISTS), it never
+        leaves IDLE to fetch, so the emails that arrive while the previous
+        ones are processed are noticed right away.
+
+        Args:
+            outer_timeout (float): The time to stop at, None to never stop.
+            update_frequency (int): Check the connections every certain time.
+            process_func (function): A function called to further process the emails.
+            **kwargs (dict): Additional arguments for processing the email, see `listen`.
+
+        Returns:
+            None
+
+        """
+
+        move = kwargs.get("move")
+        unread = bool(kwargs.get("unread"))
+        delete = bool(kwargs.get("delete"))
+        latest_only = bool(kwargs.get("latest_only"))
+        incremental = bool(kwargs.get("incremental"))
+        from_filter = kwargs.get("from_filter")
+
+        # read-only, the flags are only changed by the fetching connection,
+        # it may be open already (eg. a standby listener taking over)
+        self.open_idle_connection()
+        self._new_email = threading.Event()
+        self._idle_error = None
+        watcher = StoppableThread(target=self.__watch_idle, args=(update_frequency,), daemon=True)
+        watcher.start()
+        # the incremental scrape is cheap, catch the emails that arrived before IDLE started
+        if incremental:
+            self._new_email.set()
+        last_command = get_time()
+        try:
+            while outer_timeout is None or get_time() < outer_timeout:
+                if not self._new_email.wait(update_frequency):
+                    # keep the fetching connection from being logged out for inactivity
+                    if get_time() - last_command > IDLE_RESTART_INTERVAL:
+                        self.server.noop()
+                        last_command = get_time()
+                    continue
+                # clear before scraping, the emails that arrive from now on set it again
+                self._new_email.clear()
+                if self._idle_error is not None:
+                    raise self._idle_error
+                msgs = self.scrape(move=move, unread=unread, delete=delete, latest_only=latest_only, incremental=incremental, from_filter=from_filter)
+                last_command = get_time()
+                process_func(self, msgs)
+        finally:
+            watcher.stop()
+            idle_server, self.idle_server = self.idle_server, None
+            with contextlib.suppress(Exception):
+                idle_server.shutdown()
+
+
+    @staticmethod
+    def __has_new_email(responses):
+        """Helper function, checks the IDLE responses for a new email.
+
+        Args:
+            responses (list): The responses of idle_check or idle_done.
+
+        Returns:
+            True if one of the responses is EXISTS or RECENT, False otherwise.
+
+        """
+
+        return any(len(response) > 1 and response[1] in (b"EXISTS", b"RECENT") for response in responses)
+
+    def __watch_idle(self, timeout):
+        """Helper function, keeps the IDLE connection in IDLE and signals the new emails.
+
+        Args:
+            timeout (int): Idle check timeout.
+
+        Returns:
+            None
+
+        """
+
+        thread = threading.current_thread()
+        server = self.idle_server
+        try:
+            server.idle()
+            restart_at = get_time() + IDLE_RESTART_INTERVAL
+            while not thread.stopped():
+                check_start = get_time()
+                responses = server.idle_check(timeout=timeout)
+                # restart the idling regularly, and at once if idle_check returned
+                # nothing right away (EOF), it raises if the connection is dead
+                if get_time() >= restart_at or (not responses and get_time() - check_start < timeout / 2):
+                    responses += server.idle_done()[1]
+                    server.idle()
+                    restart_at = get_time() + IDLE_RESTART_INTERVAL
+                # only the new emails matter, not eg. the flags set by the other connection
+                if self.__has_new_email(responses):
+                    IMAP_IDLE_WAKEUPS.inc()
+                    self._new_email.set()
+        except Exception as err:
+            if not thread.stopped():
+                self._idle_error = err
+                self._new_email.set()
@@ -0,0 +1,248 @@
+"""archive: Append-only, rotating and compressed archive of the emails/alerts.
+
+The records are appended as JSON lines to `<name>.jsonl` in the archive
+folder by a writer thread, in batches, so `write` never does any I/O. When
+the file reaches `max_bytes` or gets older than `max_age` seconds it is
+renamed to `<name>-<YYYYmmdd-HHMMSS>-<n>.jsonl` and gzipped in the background.
+`iter_archive` reads the archive back as a stream, oldest record first.
+
+Example:
+
+    archive = AlertArchive("./archive")
+    archive.write({"subject": "Alert: BTCUSD", "content": "..."})
+    archive.close()
+
+    for record in iter_archive("./archive"):
+        print(record)
+
+"""
+
+import gzip
+import itertools
+import json
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+
+from ..multi_task import StoppableThread
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_AGE = 24 * 60 * 60
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_NAME = "alerts"
+
+
+class AlertArchive:
+    """Rotating JSONL archive, written by a background thread.
+
+    Attributes:
+        directory (str): The archive folder.
+        name (str): The base name of the archive files.
+        max_bytes (int): Rotate the file when it gets bigger than this.
+        max_age (float): Rotate the file when it gets older than this (seconds).
+
+    """
+
+    def __init__(self, directory, name=DEFAULT_NAME, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, batch_size=DEFAULT_BATCH_SIZE, logger=print):
+        """Initialize an AlertArchive instance, the folder is created on the first write.
+
+        Args:
+            directory (str): The archive folder.
+            name (str): The base name of the archive files. Defaults to "alerts".
+            max_bytes (int): Rotate the file when it gets bigger than this. Defaults to 64 MiB.
+            max_age (float): Rotate the file when it gets older than this (seconds). Defaults to 1 day.
+            flush_interval (float): Max seconds a record waits before it is written. Defaults to 1.
+            batch_size (int): Max number of records written at once. Defaults to 1000.
+            logger (function): The function for messages printed to the console.
+        Returns:
+            None
+
+        """
+
+        self.directory = directory
+        self.name = name
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.logger = logger
+        self.written = 0
+        self._queue = queue.Queue()
+        self._file = None
+        self._opened_at = 0.0
+        self._sequence = itertools.count(1)
+        self._compressors: list[threading.Thread] = []
+        self._thread = StoppableThread(target=self._thread_main, daemon=True)
+        self._thread.start()
+
+    @property
+    def current_path(self):
+        return os.path.join(self.directory, f"{self.name}.jsonl")
+
+    def write(self, record):
+        """Queue a record to be archived.
+
+        Args:
+            record (dict): The record, values that are not JSON serializable
+                (eg. datetime) are stored as strings.
+        Returns:
+            None
+
+        """
+
+        self._queue.put(record)
+
+    def flush(self, timeout=None):
+        """Wait until the queued records are written.
+
+        Args:
+            timeout (float): Max seconds to wait. Defaults to None (no limit).
+        Returns:
+            True if all the records are written.
+
+        """
+
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        """Write the queued records and stop the writer, the compressions in
+        progress are waited for.
+
+        Args:
+            None
+        Returns:
+            None
+
+        """
+
+        if self._thread.is_alive():
+            self.flush()
+            self._thread.stop()
+            self._queue.put(None)
+            self._thread.join()
+        for compressor in self._compressors:
+            compressor.join()
+
+    def _thread_main(self):
+        # compress the files rotated by a previous run that was stopped before compressing them
+        for path in _archive_files(self.directory, self.name):
+            if path.endswith(".jsonl") and path != self.current_path:
+                self._compress_in_background(path)
+        while not self._thread.stopped():
+            batch = []
+            events = []
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+                while True:
+                    if isinstance(item, threading.Event):
+                        events.append(item)
+                    elif item is not None:
+                        batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        break
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                self._rotate_if_needed()
+                if batch:
+                    self._write(batch)
+            except OSError as err:
+                self.logger(f"Failed to write {len(batch)} record(s) to the archive, reason: {err}")
+            for event in events:
+                event.set()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write(self, batch):
+        if self._file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            exists = os.path.exists(self.current_path)
+            self._file = open(self.current_path, "a", encoding="utf-8")
+            # the age of a file left by a previous run counts (roughly) from its last change
+            self._opened_at = os.path.getctime(self.current_path) if exists else time.time()
+        self._file.write("".join(json.dumps(record, ensure_ascii=False, default=str) + "\n" for record in batch))
+        self._file.flush()
+        self.written += len(batch)
+
+    def _rotate_if_needed(self):
+        if self._file is None:
+            return
+        if self._file.tell() < self.max_bytes and time.time() - self._opened_at < self.max_age:
+            return
+        self._file.close()
+        self._file = None
+        rotated = os.path.join(self.directory, f"{self.name}-{time.strftime('%Y%m%d-%H%M%S')}-{next(self._sequence):06d}.jsonl")
+        os.replace(self.current_path, rotated)
+        self._compress_in_background(rotated)
+
+    def _compress_in_background(self, path):
+        self._compressors = [compressor for compressor in self._compressors if compressor.is_alive()]
+        compressor = StoppableThread(target=_compress, args=(path,), daemon=True)
+        compressor.start()
+        self._compressors.append(compressor)
+
+
+def _compress(path):
+    """Gzip a rotated file, the .gz only appears once it is complete."""
+
+    temp_path = path + ".gz.tmp"
+    with open(path, "rb") as source, gzip.open(temp_path, "wb") as target:
+        shutil.copyfileobj(source, target)
+    os.replace(temp_path, path + ".gz")
+    os.remove(path)
+
+
+def _archive_files(directory, name):
+    """The archive files, oldest first, the current file last."""
+
+    if not os.path.isdir(directory):
+        return []
+    # only the rotated files of this name, not those of a name it prefixes (eg. "alerts-worker-0")
+    pattern = re.compile(rf"{re.escape(name)}-\d{{8}}-\d{{6}}-\d{{6}}\.jsonl(\.gz)?")
+    rotated = {}
+    for file_name in os.listdir(directory):
+        if not pattern.fullmatch(file_name):
+            continue
+        if file_name.endswith(".jsonl.gz"):
+            rotated[file_name[:-3]] = file_name
+        # the compressed file wins over the file being deleted
+        elif file_name.endswith(".jsonl") and file_name not in rotated:
+            rotated[file_name] = file_name
+    files = [os.path.join(directory, rotated[key]) for key in sorted(rotated)]
+    current = os.path.join(directory, f"{name}.jsonl")
+    if os.path.exists(current):
+        files.append(current)
+    return files
+
+
+def iter_archive(directory, name=DEFAULT_NAME):
+    """Iterate the records of an archive, oldest first, one line at a time.
+
+    Args:
+        directory (str): The archive folder.
+        name (str): The base name of the archive files. Defaults to "alerts".
+    Returns:
+        An iterator of the records (dict).
+
+    """
+
+    for path in _archive_files(directory, name):
+        opener = gzip.open if path.endswith(".gz") else open
+        try:
+            with opener(path, "rt", encoding="utf-8") as file:
+                for line in file:
+                    # the last line can be partial if the writer is appending to it
+                    if line.endswith("\n"):
+                        yield json.loads(line)
+        except FileNotFoundError:
+            # rotated or compressed meanwhile
+            continue
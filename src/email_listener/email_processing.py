@@ -18,9 +18,34 @@ Example:
 # Imports from other packages
 import json
 import os
+import threading
 # Imports from this package
+from .archive import AlertArchive
 from .email_responder import EmailResponder
 
+# One archive (and writer thread) per folder, shared by the listeners
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+def get_archive(directory, **kwargs):
+    """Get the archive of a folder, it is created on first use.
+
+    Args:
+        directory (str): The archive folder.
+        **kwargs: Passed to AlertArchive when the archive is created.
+
+    Returns:
+        The AlertArchive.
+
+    """
+
+    directory = os.path.abspath(directory)
+    with _archives_lock:
+        if directory not in _archives:
+            _archives[directory] = AlertArchive(directory, **kwargs)
+        return _archives[directory]
+
 
 def write_txt_file(email_listener, msg_dict):
     """Write the email message data returned from scrape to text files.
@@ -40,7 +65,7 @@ def write_txt_file(email_listener, msg_dict):
     file_list = []
     # For each key, create a file and ensure it doesn't exist
     for key in msg_dict.keys():
-        file_path = os.path.join(email_listener.attachment_dir, f"{key}.txt")
+        file_path = os.path.join(email_listener.ensure_attachment_dir(), f"{key}.txt")
         if os.path.exists(file_path):
             print("File has already been created.")
             continue
@@ -134,6 +159,28 @@ def send_basic_reply(email_listener, msg_dict):
     return file_list
 
 
+def write_archive(email_listener, msg_dict):
+    """Append the email message data returned from scrape to the archive in
+    the "archive" folder of attachment_dir, instead of one file per email.
+
+    Args:
+        email_listener (EmailListener): The EmailListener object this function
+            is used with.
+        msg_dict (dict): The dictionary of email message data returned by the
+            scraping function.
+
+    Returns:
+        The AlertArchive the messages are written to.
+
+    """
+
+    archive = get_archive(os.path.join(email_listener.attachment_dir, "archive"), logger=email_listener.logger)
+    for key, msg in msg_dict.items():
+        # the lazy fields (eg. Plain_Text of the lean parsing) are not stored in the dict yet
+        archive.write({"key": key, "Folder": email_listener.folder, **msg, "Plain_Text": msg.get("Plain_Text")})
+    return archive
+
+
 def write_json_file(email_listener, msg_dict):
     """Write the email message data returned from scrape to json files.
 
@@ -152,7 +199,7 @@ def write_json_file(email_listener, msg_dict):
     file_list = []
     # For each key, create a file and ensure it doesn't exist
     for key in msg_dict.keys():
-        file_path = os.path.join(email_listener.attachment_dir, f"{key}.json")
+        file_path = os.path.join(email_listener.ensure_attachment_dir(), f"{key}.json")
         if os.path.exists(file_path):
             print("File has already been created.")
             continue
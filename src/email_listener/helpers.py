@@ -14,6 +14,7 @@ Examples:
 """
 
 import datetime
+import socket
 
 
 def calc_timeout(timeout):
@@ -76,3 +77,25 @@ def get_time():
 
     return datetime.datetime.now().timestamp()
 
+
+
+def enable_tcp_keepalive(sock, idle=60, interval=15, count=4):
+    """Enable TCP keepalive on a socket, so a connection that died silently
+    (eg. NAT timeout, network switch) fails instead of hanging in IDLE.
+
+    Args:
+        sock (socket.socket): The socket.
+        idle (int): Seconds without traffic before the first probe.
+        interval (int): Seconds between the probes.
+        count (int): Number of failed probes before the connection is closed.
+
+    Returns:
+        None
+
+    """
+
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    # the fine tuning is not available on every platform
+    for option, value in (("TCP_KEEPIDLE", idle), ("TCP_KEEPINTVL", interval), ("TCP_KEEPCNT", count)):
+        if hasattr(socket, option):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
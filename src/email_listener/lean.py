@@ -0,0 +1,222 @@
+"""lean: Lightweight parsing of the emails, for when only the text is needed.
+
+Only the headers are parsed up front. The body is decoded the first time
+`Plain_Text` is read, and only the first text/plain part is decoded (the
+other parts, eg. HTML and attachments, are skipped without being parsed).
+A quick HTML to text conversion is used only when there is no text/plain
+part. Nothing is written to disk.
+
+Example:
+
+    message = parse_lean(uid, raw_message)
+    message["Subject"]     # decoded header
+    message["Plain_Text"]  # decoded on first access
+
+"""
+
+import base64
+import email.utils
+import html
+import quopri
+import re
+from datetime import timezone
+from email.header import decode_header, make_header
+from email.parser import BytesHeaderParser
+
+_header_parser = BytesHeaderParser()
+
+# https://www.rfc-editor.org/rfc/rfc5322#section-2.1 headers and body are separated by an empty line
+_HEADER_END = re.compile(rb"\r?\n\r?\n")
+_HTML_DROP = re.compile(r"<(script|style|head)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+_HTML_BREAK = re.compile(r"<\s*(br|/p|/div|/tr|/li|/h[1-6])\b[^>]*>", re.IGNORECASE)
+_HTML_TAG = re.compile(r"<[^>]+>")
+_BLANK_LINES = re.compile(r"\n\s*\n+")
+_SPACES = re.compile(r"[ \t\r\f\v]+")
+
+
+class LeanMessage(dict):
+    """The fields of an email, same keys as `EmailListener.scrape` returns.
+
+    `Plain_Text` is computed on first access (item access, `get` or `in`).
+
+    """
+
+    LAZY_KEYS = ("Plain_Text",)
+
+    def __init__(self, raw_message, headers, body_start, **fields):
+        super().__init__(**fields)
+        self._raw_message = raw_message
+        self._headers = headers
+        self._body_start = body_start
+
+    def __missing__(self, key):
+        if key != "Plain_Text":
+            raise KeyError(key)
+        value = self[key] = _body_text(self._headers, self._raw_message[self._body_start:])
+        return value
+
+    def get(self, key, default=None):
+        if key in self.LAZY_KEYS:
+            return self[key]
+        return super().get(key, default)
+
+    def __contains__(self, key):
+        return key in self.LAZY_KEYS or super().__contains__(key)
+
+
+def parse_lean(uid, raw_message):
+    """Parse the headers of an email, the body is decoded on demand.
+
+    Args:
+        uid (int): The email UID.
+        raw_message (bytes): The raw email message.
+
+    Returns:
+        The LeanMessage.
+
+    """
+
+    headers, body_start = _split(raw_message)
+    return LeanMessage(
+        raw_message, headers, body_start,
+        From_Address=get_from_address(headers),
+        Email_UID=uid,
+        Date=_parse_date(headers["Date"]),
+        Subject=decode_header_value(headers["Subject"]).strip() or "No Subject",
+        Message_ID=(headers["Message-ID"] or "").strip(),
+    )
+
+
+def _parse_date(value):
+    """Parse the Date header to an aware datetime, None if there is no date."""
+
+    if not value:
+        return None
+    date = email.utils.parsedate_to_datetime(value)
+    # "-0000" means the time zone is unknown, the time is in UTC anyway
+    return date if date.tzinfo else date.replace(tzinfo=timezone.utc)
+
+
+def decode_header_value(value):
+    """Decode an RFC 2047 encoded header (eg. "=?utf-8?q?...?="), "" if there is no value."""
+
+    if not value:
+        return ""
+    try:
+        return str(make_header(decode_header(value)))
+    except (LookupError, ValueError):
+        return str(value)
+
+
+def get_from_address(headers):
+    """Get the sender address of the parsed headers, "UnknownEmail" if there is none."""
+
+    addresses = email.utils.getaddresses(headers.get_all("From", []))
+    return addresses[0][1] if addresses and addresses[0][1] else "UnknownEmail"
+
+
+def html_to_text(content):
+    """Quick HTML to text conversion, tags are dropped and entities decoded.
+
+    Much lighter than html2text (no Markdown), good enough for the alert
+    messages that are sent as HTML only.
+
+    Args:
+        content (str): The HTML.
+
+    Returns:
+        The text.
+
+    """
+
+    content = _HTML_DROP.sub("", content)
+    content = _HTML_BREAK.sub("\n", content)
+    content = html.unescape(_HTML_TAG.sub("", content))
+    content = _SPACES.sub(" ", content)
+    return _BLANK_LINES.sub("\n\n", "\n".join(line.strip() for line in content.split("\n"))).strip()
+
+
+def _split(raw_message):
+    """Parse the headers of a message (or part), returns them and the offset of the body."""
+
+    # a part without headers starts with the empty line
+    if raw_message.startswith((b"\r\n", b"\n")):
+        return _header_parser.parsebytes(b""), 2 if raw_message.startswith(b"\r\n") else 1
+    match = _HEADER_END.search(raw_message)
+    end = match.end() if match else len(raw_message)
+    return _header_parser.parsebytes(raw_message[:end]), end
+
+
+def decode_charset(body, charset):
+    """Decode a body with its charset, utf-8 if the charset is missing or unknown."""
+
+    try:
+        return body.decode(charset or "utf-8", errors="replace")
+    except LookupError:
+        return body.decode("utf-8", errors="replace")
+
+
+def strip_line_break(text):
+    """Remove the line break that ends a body, it belongs to the message, not to the text."""
+
+    return text[:-2] if text.endswith("\r\n") else text[:-1] if text.endswith("\n") else text
+
+
+def _decode(headers, body):
+    """Decode a body with its Content-Transfer-Encoding and charset."""
+
+    encoding = (headers["Content-Transfer-Encoding"] or "").strip().lower()
+    if encoding == "base64":
+        body = base64.b64decode(body, validate=False)
+    elif encoding == "quoted-printable":
+        body = quopri.decodestring(body)
+    return decode_charset(body, headers.get_content_charset())
+
+
+def _parts(headers, body):
+    """Yield the (headers, body) of the leaf parts, in order, without parsing their bodies."""
+
+    if headers.get_content_maintype() != "multipart":
+        yield headers, body
+        return
+    boundary = headers.get_boundary()
+    if not boundary:
+        return
+    delimiter = b"--" + boundary.encode()
+    # the preamble is before the first delimiter, the epilogue after the last one,
+    # the parts are only sliced out when the previous ones are not what we look for
+    start = body.find(delimiter)
+    while start != -1:
+        start += len(delimiter)
+        if body.startswith(b"--", start):
+            return
+        end = body.find(delimiter, start)
+        chunk = body[start:] if end == -1 else body[start:end]
+        start = end
+        # the line break after the delimiter belongs to the delimiter
+        chunk = chunk[2:] if chunk.startswith(b"\r\n") else chunk[1:] if chunk.startswith(b"\n") else chunk
+        part_headers, part_start = _split(chunk)
+        part_body = chunk[part_start:]
+        # and so does the line break before the next one
+        if part_body.endswith(b"\r\n"):
+            part_body = part_body[:-2]
+        elif part_body.endswith(b"\n"):
+            part_body = part_body[:-1]
+        yield from _parts(part_headers, part_body)
+
+
+def _body_text(headers, body):
+    """Get the text of the first text/plain part, or of the first text/html part if there is none."""
+
+    html_part = None
+    for part_headers, part_body in _parts(headers, body):
+        if part_headers.get_filename():
+            continue
+        content_type = part_headers.get_content_type()
+        if content_type == "text/plain":
+            return strip_line_break(_decode(part_headers, part_body))
+        if content_type == "text/html" and html_part is None:
+            html_part = (part_headers, part_body)
+    if html_part is not None:
+        return html_to_text(_decode(*html_part))
+    return ""
@@ -0,0 +1,84 @@
+"""tls: An SSL context that resumes the TLS sessions of the previous connections.
+
+A reconnection to the same IMAP server then skips the full TLS handshake
+(one round trip less and no certificate verification), which shortens the
+time to get back to IDLE after a drop.
+
+Example:
+
+    context = ResumableSSLContext()
+    listener = EmailListener(..., ssl_context=context)
+
+"""
+
+import ssl
+import threading
+
+
+class ResumableSSLContext(ssl.SSLContext):
+    """SSLContext that remembers the last TLS session of each host and
+    offers it when connecting to that host again.
+
+    The context verifies the certificates like `ssl.create_default_context()`.
+
+    """
+
+    def __new__(cls, protocol=ssl.PROTOCOL_TLS_CLIENT, *args, **kwargs):
+        return super().__new__(cls, protocol, *args, **kwargs)
+
+    def __init__(self, protocol=ssl.PROTOCOL_TLS_CLIENT):
+        """Initialize a ResumableSSLContext instance.
+
+        Args:
+            protocol (int): The SSL protocol. Defaults to ssl.PROTOCOL_TLS_CLIENT.
+        Returns:
+            None
+
+        """
+
+        super().__init__()
+        self.load_default_certs(ssl.Purpose.SERVER_AUTH)
+        self._sessions: dict[str, ssl.SSLSession] = {}
+        self._sessions_lock = threading.Lock()
+        self.resumed_count = 0
+
+    def wrap_socket(self, sock, *args, server_hostname=None, session=None, **kwargs):
+        """Wrap the socket, offering the cached session of `server_hostname`."""
+
+        if session is None and server_hostname:
+            with self._sessions_lock:
+                session = self._sessions.get(server_hostname)
+        try:
+            ssl_sock = super().wrap_socket(sock, *args, server_hostname=server_hostname, session=session, **kwargs)
+        except ValueError:
+            # the cached session does not fit, do a full handshake
+            self.forget(server_hostname)
+            ssl_sock = super().wrap_socket(sock, *args, server_hostname=server_hostname, **kwargs)
+        if ssl_sock.session_reused:
+            self.resumed_count += 1
+        return ssl_sock
+
+    def remember(self, ssl_sock, server_hostname):
+        """Store the session of an established connection.
+
+        With TLS 1.3 the session ticket is sent after the handshake, so this
+        should be called after the first exchange (eg. after LOGIN).
+
+        Args:
+            ssl_sock (ssl.SSLSocket): The connection.
+            server_hostname (str): The host the connection is to.
+        Returns:
+            None
+
+        """
+
+        session = getattr(ssl_sock, "session", None)
+        if session is not None and server_hostname:
+            with self._sessions_lock:
+                self._sessions[server_hostname] = session
+
+    def forget(self, server_hostname):
+        """Drop the cached session of a host."""
+
+        with self._sessions_lock:
+            self._sessions.pop(server_hostname, None)
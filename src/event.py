@@ -2,17 +2,242 @@
 # https://dev.to/kuba_szw/build-your-own-event-system-in-python-5hk6
 # -----------------------------------------------
 
-from collections import defaultdict
+import threading
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass
+
+from .multi_task import StoppableThread
+from .logger import logger as log
+from .metrics import EVENT_QUEUE_DEPTH, EVENT_HANDLER_DURATION, EVENT_DISCARDED
+
+DEFAULT_QUEUE_SIZE = 10_000
+
+class Backpressure:
+    """
+    What `post_event` does when the queue of an asynchronous subscriber is full.
+
+    - `BLOCK`: Wait for a free slot
+    - `DROP_OLDEST`: Drop the oldest queued data to make room
+    - `REJECT`: Don't queue the data, `post_event` returns False
+    """
+    BLOCK = "block"
+    DROP_OLDEST = "drop_oldest"
+    REJECT = "reject"
+
+@dataclass
+class SubscriberStats:
+    """
+    The counters of an asynchronous subscriber.
+    """
+    event_name: str
+    handler: str
+    queue_depth: int
+    queue_size: int
+    processed: int
+    failed: int
+    dropped: int
+    rejected: int
+    handler_seconds_avg: float
+    handler_seconds_max: float
+
+class _AsyncSubscriber:
+    """
+    A subscriber called from its own worker threads, the data is queued by
+    `post_event` which returns at once.
+    """
+
+    def __init__(self, event_name: str, fn, queue_size: int, workers: int, policy: str):
+        if queue_size <= 0 or workers <= 0:
+            raise ValueError("'queue_size' and 'workers' must be greater than 0")
+        if policy not in (Backpressure.BLOCK, Backpressure.DROP_OLDEST, Backpressure.REJECT):
+            raise ValueError(f"Unknown backpressure policy <{policy}>")
+        self.event_name = event_name
+        self.fn = fn
+        self.queue_size = queue_size
+        self.policy = policy
+        self._queue: deque = deque()
+        self._condition = threading.Condition()
+        self._unfinished = 0
+        self._stopped = False
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.rejected = 0
+        self._handler_seconds = 0.0
+        self._handler_seconds_max = 0.0
+        self._threads = [
+            StoppableThread(target=self._thread_main, daemon=True, name=f"event-{event_name}-{index}")
+            for index in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def offer(self, data) -> bool:
+        with self._condition:
+            if len(self._queue) >= self.queue_size and not self._stopped:
+                if self.policy == Backpressure.REJECT:
+                    return self._reject()
+                if self.policy == Backpressure.DROP_OLDEST:
+                    self._queue.popleft()
+                    self._unfinished -= 1
+                    self.dropped += 1
+                    EVENT_DISCARDED.labels(self.event_name, "dropped").inc()
+                else:
+                    while len(self._queue) >= self.queue_size and not self._stopped:
+                        self._condition.wait()
+            if self._stopped:
+                # nobody would handle it
+                return self._reject()
+            self._queue.append(data)
+            self._unfinished += 1
+            # wakes a worker, or a producer waiting for a free slot that will check again
+            self._condition.notify_all()
+        return True
+
+    def depth(self) -> int:
+        return len(self._queue)
+
+    def join(self, timeout: float | None = None) -> bool:
+        with self._condition:
+            return self._condition.wait_for(lambda: self._unfinished == 0, timeout)
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            for thread in self._threads:
+                thread.stop()
+            # the queued data will never be handled, don't let `join` wait for it
+            if self._queue:
+                self.dropped += len(self._queue)
+                EVENT_DISCARDED.labels(self.event_name, "dropped").inc(len(self._queue))
+                self._queue.clear()
+            self._unfinished = 0
+            self._condition.notify_all()
+
+    def stats(self) -> SubscriberStats:
+        return SubscriberStats(
+            self.event_name, getattr(self.fn, "__qualname__", repr(self.fn)),
+            len(self._queue), self.queue_size,
+            self.processed, self.failed, self.dropped, self.rejected,
+            self._handler_seconds / self.processed if self.processed else 0.0,
+            self._handler_seconds_max,
+        )
+
+    def _reject(self) -> bool:
+        self.rejected += 1
+        EVENT_DISCARDED.labels(self.event_name, "rejected").inc()
+        return False
+
+    def _thread_main(self):
+        thread = threading.current_thread()
+        while True:
+            with self._condition:
+                while not self._queue and not thread.stopped():
+                    self._condition.wait()
+                if thread.stopped():
+                    return
+                data = self._queue.popleft()
+                self._condition.notify_all()
+            start_time = time.perf_counter()
+            failed = False
+            try:
+                self.fn(data)
+            except Exception as err:
+                failed = True
+                log.error(f"Subscriber of <{self.event_name}> failed, reason: {err}")
+            elapsed = time.perf_counter() - start_time
+            EVENT_HANDLER_DURATION.labels(self.event_name).observe(elapsed)
+            with self._condition:
+                self.processed += 1
+                self.failed += failed
+                self._handler_seconds += elapsed
+                self._handler_seconds_max = max(self._handler_seconds_max, elapsed)
+                # already 0 if the subscriber was stopped meanwhile
+                self._unfinished = max(self._unfinished - 1, 0)
+                if self._unfinished == 0:
+                    self._condition.notify_all()
 
 subscribers = defaultdict(list)
 
-def subscribe(event_name, fn):
-    subscribers[event_name].append(fn)
+def subscribe(event_name, fn, asynchronous: bool = False, queue_size: int = DEFAULT_QUEUE_SIZE, workers: int = 1, policy: str = Backpressure.BLOCK):
+    """
+    ### Description ###
+    Call `fn(data)` for each data posted to `event_name`.
+
+    ### Parameters ###
+        - `event_name`: The event name
+        - `fn`: The subscriber
+        - `asynchronous` (bool): Call `fn` from its own worker threads instead of the thread that posts,
+          the data waits in a queue of `queue_size`
+        - `queue_size` (int): Max data waiting, asynchronous only
+        - `workers` (int): Number of worker threads, asynchronous only (the order is kept with 1 worker)
+        - `policy` (str): What to do when the queue is full, see `Backpressure`, asynchronous only
+    """
+    if asynchronous:
+        subscriber = _AsyncSubscriber(str(event_name), fn, queue_size, workers, policy)
+        EVENT_QUEUE_DEPTH.labels(str(event_name)).set_function(lambda: queue_depth(event_name))
+        subscribers[event_name].append(subscriber)
+    else:
+        subscribers[event_name].append(fn)
 
 def unsubscribe(event_name, fn):
-    subscribers[event_name].remove(fn)
+    for subscriber in subscribers[event_name]:
+        # compared with ==, the bound methods are new objects each time
+        if subscriber == fn or (isinstance(subscriber, _AsyncSubscriber) and subscriber.fn == fn):
+            subscribers[event_name].remove(subscriber)
+            if isinstance(subscriber, _AsyncSubscriber):
+                subscriber.stop()
+            return
+    raise ValueError(f"{fn} is not subscribed to <{event_name}>")
 
-def post_event(event_name, data):
+def post_event(event_name, data) -> bool:
+    """
+    ### Description ###
+    Post data to the subscribers of an event. The synchronous subscribers
+    are called right away, the data is queued for the asynchronous ones.
+
+    ### Returns ###
+        - (bool): False if an asynchronous subscriber rejected the data (its queue is full)
+    """
+    accepted = True
     if event_name in subscribers:
         for fn in subscribers[event_name]:
-            fn(data)
+            if isinstance(fn, _AsyncSubscriber):
+                accepted = fn.offer(data) and accepted
+            else:
+                fn(data)
+    return accepted
+
+def queue_depth(event_name) -> int:
+    """
+    ### Description ###
+    Get the number of data waiting for the asynchronous subscribers of an event.
+
+    ### Returns ###
+        - (int): The number of data, the deepest queue if there are several subscribers
+    """
+    return max((fn.depth() for fn in subscribers.get(event_name, []) if isinstance(fn, _AsyncSubscriber)), default=0)
+
+def join(event_name, timeout: float | None = None) -> bool:
+    """
+    ### Description ###
+    Wait until the asynchronous subscribers of an event have processed all the posted data.
+
+    ### Parameters ###
+        - `timeout` (float | optional): Max seconds to wait for each subscriber
+
+    ### Returns ###
+        - (bool): True if all the data are processed
+    """
+    return all([fn.join(timeout) for fn in list(subscribers.get(event_name, [])) if isinstance(fn, _AsyncSubscriber)])
+
+def stats() -> list[SubscriberStats]:
+    """
+    ### Description ###
+    Get the counters of all the asynchronous subscribers.
+
+    ### Returns ###
+        - (list[SubscriberStats]): The counters
+    """
+    return [fn.stats() for fns in list(subscribers.values()) for fn in list(fns) if isinstance(fn, _AsyncSubscriber)]
@@ -0,0 +1,144 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from dataclasses import dataclass
+from typing import Callable
+from urllib.parse import urlparse
+
+from .network import POOL_MAXSIZE
+
+DEFAULT_MAX_WORKERS = 32
+
+@dataclass
+class DeliveryResult:
+    """
+    The result of delivering a payload to one target.
+    """
+    target: str
+    success: bool
+    status_code: int | None = None
+    elapsed: float = 0.0
+    error: str | None = None
+    retrying: bool = False
+    # seconds the target asked to wait before trying again (eg. Retry-After)
+    retry_after: float | None = None
+    # False when trying again would fail the same way (eg. the payload is invalid)
+    retryable: bool = True
+    # handed to a sender queue (eg. Telegram), the result comes later
+    queued: bool = False
+
+@dataclass
+class DeliveryJob:
+    """
+    A delivery to run by the `FanOut` engine.
+
+    - `target`: The name of the target, used in the result
+    - `url`: The URL of the target, its host is used to group the connections
+    - `send`: A callable that delivers the payload and returns a `DeliveryResult`
+    - `host`: The host of the URL if already known, the URL is parsed otherwise
+    """
+    target: str
+    url: str
+    send: Callable[[], DeliveryResult]
+    host: str | None = None
+
+class FanOut:
+    """
+    Deliver one payload to many targets in parallel.
+
+    The jobs are grouped by host, at most `per_host_limit` jobs of the same
+    host run at the same time (this matches the size of the connection pool
+    so each host reuses its keep-alive connections) and at most `max_workers`
+    jobs run in total.
+    """
+
+    def __init__(self, max_workers: int = DEFAULT_MAX_WORKERS, per_host_limit: int = POOL_MAXSIZE):
+        if max_workers <= 0:
+            raise ValueError("'max_workers' must be greater than 0")
+        if per_host_limit <= 0:
+            raise ValueError("'per_host_limit' must be greater than 0")
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+        self._executor: ThreadPoolExecutor | None = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="fan-out")
+        return self._executor
+
+    def shutdown(self, wait: bool = True):
+        """
+        ### Description ###
+        Stop the worker threads.
+
+        ### Parameters ###
+            - `wait` (bool): Whether to wait for the running jobs to finish
+        """
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+            self._executor = None
+
+    def run(self, jobs: list[DeliveryJob]) -> list[DeliveryResult]:
+        """
+        ### Description ###
+        Run all jobs and wait for them to finish.
+
+        ### Parameters ###
+            - `jobs` (list[DeliveryJob]): The jobs to run
+
+        ### Returns ###
+            - (list[DeliveryResult]): The results, in the same order as `jobs`
+        """
+        if not jobs:
+            return []
+
+        results: list[DeliveryResult | None] = [None] * len(jobs)
+        by_host: dict[str, deque] = {}
+        for index, job in enumerate(jobs):
+            host = job.host or urlparse(job.url).hostname or job.url
+            by_host.setdefault(host, deque()).append((index, job))
+
+        lock = threading.Lock()
+        remaining = [len(jobs)]
+        finished = threading.Event()
+
+        def submit_next(host: str):
+            with lock:
+                if not by_host[host]:
+                    return
+                index, job = by_host[host].popleft()
+            future = self.executor.submit(self._call, job)
+            future.add_done_callback(lambda f: on_done(host, index, f))
+
+        def on_done(host: str, index: int, future: Future):
+            results[index] = future.result()
+            # the host slot is free now, start the next job of the same host
+            submit_next(host)
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    finished.set()
+
+        for host, host_jobs in by_host.items():
+            for _ in range(min(self.per_host_limit, len(host_jobs))):
+                submit_next(host)
+
+        finished.wait()
+        return results
+
+    @staticmethod
+    def _call(job: DeliveryJob) -> DeliveryResult:
+        start_time = time.perf_counter()
+        try:
+            result = job.send()
+        except Exception as err:
+            # the network errors (requests' included) are OSError, the others are bugs or invalid payloads
+            result = DeliveryResult(job.target, False, error=str(err), retryable=isinstance(err, OSError))
+        result.elapsed = time.perf_counter() - start_time
+        return result
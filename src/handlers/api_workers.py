@@ -0,0 +1,242 @@
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from dataclasses import dataclass
+from multiprocessing.managers import BaseManager
+from typing import Callable
+
+from .. import StoppableThread, log, api_server
+from ..backoff import Backoff
+from ..dedup import get_deduplicator, set_deduplicator
+from ..rate_limit import TokenBucket
+from ..metrics import REGISTRY, API_WORKERS_ALIVE, API_WORKER_RESTARTS, merge as merge_metrics, set_renderer as set_metrics_renderer
+
+SUPERVISE_INTERVAL = 1 # seconds between two checks of the workers
+RESTART_BACKOFF_BASE = 1 # seconds before restarting a worker that exited, doubles while it keeps exiting
+RESTART_BACKOFF_CAP = 30 # seconds
+STABLE_UPTIME = 60 # seconds, a worker running this long restarts at once the next time it exits
+METRICS_PUSH_INTERVAL = 5 # seconds between two pushes of the metrics of a worker to the coordinator
+
+# ---------------* Coordinator *---------------
+# runs in the parent process, the workers reach it on a local socket
+
+_buckets: dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+def _shared_bucket(name: str, rate: float, capacity: float | None) -> TokenBucket:
+    with _buckets_lock:
+        if name not in _buckets:
+            _buckets[name] = TokenBucket(rate, capacity)
+        return _buckets[name]
+
+class _MetricsStore:
+    """
+    The last metrics pushed by each worker, merged with the metrics of the
+    parent process so "/metrics" gives the same totals whichever worker
+    answers.
+    """
+
+    def __init__(self):
+        self._snapshots: dict[int, tuple[int, str]] = {}
+        # the counters and histograms of the exited workers, so the totals do not go back
+        self._retired = ""
+        self._lock = threading.Lock()
+
+    def push(self, worker: int, pid: int, text: str):
+        with self._lock:
+            previous = self._snapshots.get(worker)
+            if previous is not None and previous[0] != pid:
+                self._retired = merge_metrics([self._retired, previous[1]], cumulative_only=True)
+            self._snapshots[worker] = (pid, text)
+
+    def render(self) -> str:
+        with self._lock:
+            workers = sorted(self._snapshots.items())
+        # the counters of the exited workers have no gauges, their source is not used
+        texts = [REGISTRY.render(), self._retired] + [text for _, (_, text) in workers]
+        sources = ["parent", "retired"] + [str(worker) for worker, _ in workers]
+        return merge_metrics(texts, sources=sources)
+
+_metrics_store = _MetricsStore()
+
+class Coordinator(BaseManager):
+    """
+    The state shared by the API workers: the deduplicator, the rate
+    limits and the metrics. They are kept by the parent process, the
+    workers use them through proxies.
+    """
+
+Coordinator.register("deduplicator", callable=get_deduplicator, exposed=("seen", "check_and_add"))
+Coordinator.register("bucket", callable=_shared_bucket, exposed=("delay", "try_acquire", "release", "drain"))
+Coordinator.register("metrics", callable=lambda: _metrics_store, exposed=("push", "render"))
+
+# ---------------* Worker *---------------
+
+def _worker_main(index: int, port: int, api_key: str, address, authkey: bytes, ngrok_auth_token: str, initializer: Callable[[], None] | None):
+    # a new interpreter (spawn), nothing is inherited from the parent but the arguments
+    from .. import broadcast
+    from .ngrok_signal_redirect import NgrokSignalRedirect
+    if initializer is not None:
+        initializer()
+    coordinator = Coordinator(address=address, authkey=authkey)
+    coordinator.connect()
+    set_deduplicator(coordinator.deduplicator())
+    broadcast.setup(archive_name=f"alerts-worker-{index}", bucket_factory=coordinator.bucket)
+    _share_metrics(coordinator, index)
+
+    redirect = NgrokSignalRedirect(ngrok_auth_token, api_key)
+    redirect.subscribe_data_received()
+    api_server.start(
+        event_id_rev=NgrokSignalRedirect._EventID.API_REV, fixed_api_key=api_key,
+        port=port, reuse_port=True, announce=False,
+    )
+
+def _share_metrics(coordinator: Coordinator, index: int):
+    # the kernel picks the worker answering "/metrics", so all of them serve the aggregate
+    store = coordinator.metrics()
+    pid = os.getpid()
+
+    def push():
+        store.push(index, pid, REGISTRY.render())
+
+    def render() -> str:
+        push()
+        return store.render()
+
+    def push_periodically():
+        while True:
+            try:
+                push()
+            except Exception as err:
+                log.debug(f"Failed to push the metrics of API worker {index}, reason: {err}")
+            time.sleep(METRICS_PUSH_INTERVAL)
+
+    set_metrics_renderer(render)
+    StoppableThread(target=push_periodically, daemon=True, name="metrics-push").start()
+
+# ---------------* Supervisor *---------------
+
+def reserve_port(start: int = api_server.START_PORT, tries: int = api_server.MAX_PORT_TRIES) -> socket.socket:
+    """
+    ### Description ###
+    Find a free port and keep it with a socket that does not listen, the
+    workers bind the same port with SO_REUSEPORT.
+
+    ### Returns ###
+        - (socket.socket): The bound socket, keep it open while the workers run
+
+    ### Raises ###
+        - OSError: If no port is free
+    """
+    for port in range(start, start + tries):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        try:
+            sock.bind(("", port))
+            return sock
+        except OSError:
+            sock.close()
+            log.info(f"Port {port} is in use, trying next port...")
+    raise OSError(f"No free port found in range {start}-{start + tries - 1}")
+
+@dataclass
+class _Worker:
+    process: multiprocessing.Process
+    started: float
+    backoff: Backoff
+    restart_at: float | None = None
+
+class ApiWorkers:
+    """
+    Several processes running the API server on the same port
+    (SO_REUSEPORT), so the alerts are parsed and broadcasted on several
+    cores. The kernel spreads the connections between the workers, they
+    share the deduplicator and the Telegram rate limits through the
+    coordinator of the parent process, which restarts the workers that exit.
+
+    The outbox (SQLite) is shared, each worker has its own archive files.
+    The workers push their metrics to the coordinator, "/metrics" and the
+    metrics port serve the sum of the counters and histograms of all the
+    processes, and the gauges of each process with a `worker` label.
+    """
+
+    def __init__(self, workers: int, ngrok_auth_token: str, api_key: str, initializer: Callable[[], None] | None = None):
+        """
+        ### Parameters ###
+            - `workers` (int): The number of worker processes
+            - `ngrok_auth_token` (str): The ngrok auth token
+            - `api_key` (str): The API key of all the workers
+            - `initializer` (Callable | optional): Called first in each worker (eg. to set up the logger),
+              must be a module level function
+        """
+        if workers <= 0:
+            raise ValueError("'workers' must be greater than 0")
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise OSError("SO_REUSEPORT is not supported on this platform")
+        self.workers = workers
+        self.ngrok_auth_token = ngrok_auth_token
+        self.api_key = api_key
+        self.initializer = initializer
+        self.port: int | None = None
+        self._sock: socket.socket | None = None
+        self._authkey = os.urandom(32)
+        self._address = None
+        self._context = multiprocessing.get_context("spawn")
+        self._workers: list[_Worker | None] = [None] * workers
+
+    def start(self) -> int:
+        """
+        ### Description ###
+        Reserve the port, start the coordinator and the workers.
+
+        ### Returns ###
+            - (int): The port the workers listen on
+        """
+        self._sock = reserve_port()
+        self.port = self._sock.getsockname()[1]
+        server = Coordinator(authkey=self._authkey).get_server()
+        self._address = server.address
+        StoppableThread(target=server.serve_forever, daemon=True, name="api-coordinator").start()
+        set_metrics_renderer(_metrics_store.render)
+        for index in range(self.workers):
+            self._spawn(index)
+        API_WORKERS_ALIVE.set_function(lambda: sum(worker is not None and worker.process.is_alive() for worker in self._workers))
+        log.ok(f"{self.workers} API workers are listening on port {self.port}")
+        return self.port
+
+    def _spawn(self, index: int):
+        process = self._context.Process(
+            target=_worker_main, name=f"api-worker-{index}", daemon=True,
+            args=(index, self.port, self.api_key, self._address, self._authkey, self.ngrok_auth_token, self.initializer),
+        )
+        process.start()
+        worker = self._workers[index]
+        if worker is None:
+            self._workers[index] = _Worker(process, time.monotonic(), Backoff(RESTART_BACKOFF_BASE, RESTART_BACKOFF_CAP))
+        else:
+            worker.process = process
+            worker.started = time.monotonic()
+            worker.restart_at = None
+
+    def supervise(self):
+        """
+        ### Description ###
+        Restart the workers that exit, this function blocks forever.
+        """
+        while True:
+            time.sleep(SUPERVISE_INTERVAL)
+            now = time.monotonic()
+            for index, worker in enumerate(self._workers):
+                if worker.process.is_alive():
+                    if now - worker.started >= STABLE_UPTIME:
+                        worker.backoff.reset()
+                    continue
+                if worker.restart_at is None:
+                    delay = worker.backoff.next()
+                    worker.restart_at = now + delay
+                    log.warning(f"API worker {index} exited (code {worker.process.exitcode}), restarting in {delay:.1f}s...")
+                elif now >= worker.restart_at:
+                    API_WORKER_RESTARTS.inc()
+                    self._spawn(index)
@@ -1,51 +1,190 @@
 import logging
-from queue import Queue
+import threading
+import time
+from collections import Counter, deque
+from dataclasses import dataclass
 from .. import DiscordEmbed, StoppableThread, log
+from ..discord_utilities import send_embeds_to_webhook, MAX_EMBEDS_PER_MESSAGE, MAX_EMBED_DESCRIPTION_LENGTH, MAX_EMBEDS_TOTAL_LENGTH
+from ..metrics import BROADCASTS_IN_FLIGHT, DISCORD_LOG_QUEUE_DEPTH, DISCORD_LOG_RECORDS
+
+MAX_QUEUE_SIZE = 1000 # Max number of log records waiting to be sent, the oldest are dropped when full
+MAX_BROADCAST_DEFER = 5 # seconds, max time to hold the logs back while alerts are being delivered
+BROADCAST_POLL_INTERVAL = 0.05 # seconds
+REQUEST_TIMEOUT = 10 # seconds
+MAX_SEND_ATTEMPTS = 3 # attempts of a message that failed for other reasons than rate limiting
+DEFAULT_RETRY_AFTER = 1 # seconds, if Discord answers 429 without telling how long to wait
+
+LEVEL_COLORS = {
+    "INFO": DiscordEmbed.Color.BLUE,
+    "OK": DiscordEmbed.Color.GREEN,
+    "WARNING": DiscordEmbed.Color.YELLOW,
+    "ERROR": DiscordEmbed.Color.RED,
+    "CRITICAL": DiscordEmbed.Color.PURPLE,
+}
+
+@dataclass
+class DiscordLogStats:
+    queued: int = 0
+    sent_messages: int = 0
+    sent_records: int = 0
+    dropped_records: int = 0
+    rate_limited: int = 0
 
 class DiscordLogHandler(logging.Handler):
     """
     A log handler that will send the log record to the Discord.
+
+    The records are queued in a bounded queue and sent by a background
+    thread, the pending records are coalesced into messages of up to 10
+    embeds. When the queue is full the oldest records are dropped and a
+    summary of the dropped records is sent with the next message.
+    Discord's rate limits (429 and the `X-RateLimit-*` headers) are
+    honoured, and the sending is held back while alerts are being delivered.
     """
     discord_webhook_url: str | None = None
 
-    def __init__(self, discord_webhook_url: str):
+    def __init__(self, discord_webhook_url: str, max_queue_size: int = MAX_QUEUE_SIZE):
         super().__init__(level=logging.INFO)
-        self.queue = Queue()
-        self.thread = StoppableThread(target=self._thread_main, args=(self.queue,))
-        self.thread.start()
         self.discord_webhook_url = discord_webhook_url
-    
-    def _thread_main(self, queue):
-        while True:
-            # get the next log embed from the queue
-            embed = queue.get()
-
-            # send the log embed to Discord
-            self._send_to_webhook(embed)
-
-            # mark the log embed as processed
-            queue.task_done()
-    
-    def _send_to_webhook(self, embed: DiscordEmbed):
+        # (levelname, message) of the pending records
+        self.queue: deque[tuple[str, str]] = deque()
+        self.max_queue_size = max_queue_size
+        self._condition = threading.Condition()
+        self._dropped_levels: Counter = Counter()
+        self._stats = DiscordLogStats()
+        self._blocked_until = 0.0 # rate limited until this time
+        self.thread = StoppableThread(target=self._thread_main, daemon=True)
+        self.thread.start()
+        DISCORD_LOG_QUEUE_DEPTH.set_function(lambda: len(self.queue))
+
+    def stats(self) -> DiscordLogStats:
+        """
+        ### Description ###
+        Get the statistics of the handler.
+
+        ### Returns ###
+            - (DiscordLogStats): A copy of the statistics
+        """
+        with self._condition:
+            return DiscordLogStats(
+                queued=len(self.queue),
+                sent_messages=self._stats.sent_messages,
+                sent_records=self._stats.sent_records,
+                dropped_records=self._stats.dropped_records,
+                rate_limited=self._stats.rate_limited,
+            )
+
+    def emit(self, record):
+        color = LEVEL_COLORS.get(record.levelname)
+        # ignore the logs of the sending thread itself to avoid a feedback loop
+        if color is None or threading.current_thread() is self.thread:
+            return
+        try:
+            message = record.getMessage()
+        except Exception:
+            self.handleError(record)
+            return
+        with self._condition:
+            if len(self.queue) >= self.max_queue_size:
+                dropped_level, _ = self.queue.popleft()
+                self._dropped_levels[dropped_level] += 1
+                self._stats.dropped_records += 1
+                DISCORD_LOG_RECORDS.labels("dropped").inc()
+            self.queue.append((record.levelname, message))
+            self._condition.notify()
+
+    def close(self):
+        self.thread.stop()
+        with self._condition:
+            self._condition.notify()
+        super().close()
+
+    def _thread_main(self):
+        while not self.thread.stopped():
+            with self._condition:
+                while not self.queue and not self.thread.stopped():
+                    self._condition.wait()
+            self._wait_until_sendable()
+            embeds, count = self._next_message()
+            if embeds:
+                self._send(embeds, count)
+
+    def _wait_until_sendable(self):
+        # wait for the rate limit to reset
+        while (delay := self._blocked_until - time.time()) > 0 and not self.thread.stopped():
+            time.sleep(delay)
+        # give way to the alert deliveries, but not forever
+        deadline = time.time() + MAX_BROADCAST_DEFER
+        while BROADCASTS_IN_FLIGHT.get() > 0 and time.time() < deadline and not self.thread.stopped():
+            time.sleep(BROADCAST_POLL_INTERVAL)
+
+    def _next_message(self) -> tuple[list[dict], int]:
+        """Take the pending records that fit in one message, returns the embeds and the number of records."""
+        embeds = []
+        total_length = 0
+        count = 0
+        with self._condition:
+            if self._dropped_levels:
+                summary = ", ".join(f"{number} {level}" for level, number in self._dropped_levels.items())
+                description = f"{sum(self._dropped_levels.values())} log record(s) dropped, the queue was full ({summary})."
+                embeds.append(DiscordEmbed(title="DROPPED", description=description, color=DiscordEmbed.Color.GREY).to_dict())
+                total_length += len("DROPPED") + len(description)
+                self._dropped_levels.clear()
+            while self.queue and len(embeds) < MAX_EMBEDS_PER_MESSAGE:
+                level, message = self.queue[0]
+                message = message[:MAX_EMBED_DESCRIPTION_LENGTH]
+                if embeds and total_length + len(level) + len(message) > MAX_EMBEDS_TOTAL_LENGTH:
+                    break
+                self.queue.popleft()
+                total_length += len(level) + len(message)
+                embeds.append(DiscordEmbed(title=level, description=message, color=LEVEL_COLORS[level]).to_dict())
+                count += 1
+        return embeds, count
+
+    def _send(self, embeds: list[dict], count: int):
         if not self.discord_webhook_url:
             log.warning("Discord webhook URL is not set.")
-        embed.webhook_url = self.discord_webhook_url
-        embed.send_to_webhook()
-    
-    def emit(self, record):
-        embed = None
-        
-        if record.levelname == "INFO":
-            embed = DiscordEmbed(title="INFO", description=record.msg, color=DiscordEmbed.Color.BLUE)
-        elif record.levelname == "OK":
-            embed = DiscordEmbed(title="OK", description=record.msg, color=DiscordEmbed.Color.GREEN)
-        elif record.levelname == "WARNING":
-            embed = DiscordEmbed(title="WARNING", description=record.msg, color=DiscordEmbed.Color.YELLOW)
-        elif record.levelname == "ERROR":
-            embed = DiscordEmbed(title="ERROR", description=record.msg, color=DiscordEmbed.Color.RED)
-        elif record.levelname == "CRITICAL":
-            embed = DiscordEmbed(title="CRITICAL", description=record.msg, color=DiscordEmbed.Color.PURPLE)
-        
-        if not embed:
             return
-        self.queue.put(embed)
+        attempts = 0
+        while not self.thread.stopped():
+            try:
+                response = send_embeds_to_webhook(self.discord_webhook_url, embeds, timeout=REQUEST_TIMEOUT)
+            except Exception as err:
+                response = None
+                reason = str(err)
+            else:
+                self._update_rate_limit(response)
+                if response.status_code == 429:
+                    with self._condition:
+                        self._stats.rate_limited += 1
+                    self._wait_until_sendable()
+                    continue
+                if response.ok:
+                    with self._condition:
+                        self._stats.sent_messages += 1
+                        self._stats.sent_records += count
+                    DISCORD_LOG_RECORDS.labels("sent").inc(count)
+                    return
+                reason = f"status code {response.status_code}"
+            attempts += 1
+            if attempts >= MAX_SEND_ATTEMPTS:
+                log.warning(f"Failed to send {count} log record(s) to Discord, reason: {reason}")
+                with self._condition:
+                    self._stats.dropped_records += count
+                DISCORD_LOG_RECORDS.labels("failed").inc(count)
+                return
+            time.sleep(attempts)
+
+    def _update_rate_limit(self, response):
+        # ref: https://discord.com/developers/docs/topics/rate-limits
+        headers = response.headers
+        delay = 0.0
+        try:
+            if response.status_code == 429:
+                delay = float(headers.get("Retry-After") or response.json().get("retry_after") or DEFAULT_RETRY_AFTER)
+            elif headers.get("X-RateLimit-Remaining") == "0":
+                delay = float(headers.get("X-RateLimit-Reset-After") or 0)
+        except ValueError:
+            delay = DEFAULT_RETRY_AFTER
+        if delay > 0:
+            self._blocked_until = max(self._blocked_until, time.time() + delay)
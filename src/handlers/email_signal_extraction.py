@@ -1,10 +1,94 @@
-import contextlib
-import json
 import os
+import threading
 import time
+from typing import Callable
 from datetime import datetime, timezone
-from .. import EmailListener, log, shutdown, project_main_directory, TRADINGVIEW_ALERT_EMAIL_ADDRESS
+from .. import EmailListener, StoppableThread, log, shutdown, project_main_directory, TRADINGVIEW_ALERT_EMAIL_ADDRESS
+from ..backoff import Backoff
 from ..broadcast import broadcast
+from ..dedup import get_deduplicator, content_key
+from ..email_listener.tls import ResumableSSLContext
+from ..metrics import ALERTS, ALERT_LATENCY, IMAP_RECONNECTS
+from ..payload import Payload
+
+STABLE_SESSION = 60 # seconds, a connection that lasted longer resets the reconnect backoff
+STANDBY_NOOP_INTERVAL = 240 # seconds, keep the standby connection from being logged out
+
+class HotStandby:
+    """
+    A logged in connection waiting to take over when the active one dies,
+    the takeover then costs one NOOP instead of TCP + TLS + LOGIN + SELECT.
+    With dual connections both the fetching and the IDLE connections are
+    kept ready.
+    """
+
+    def __init__(self, connect: Callable[[], EmailListener], name: str = ""):
+        self._connect = connect
+        self.name = name
+        self._listener: EmailListener | None = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: StoppableThread | None = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = StoppableThread(target=self._thread_main, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._thread.stop()
+            self._wakeup.set()
+            self._thread = None
+
+    def ready(self) -> bool:
+        return self._listener is not None
+
+    def take(self) -> EmailListener | None:
+        """
+        ### Description ###
+        Take the standby connection, a new one is prepared in the background.
+
+        ### Returns ###
+            - (EmailListener | None): The connection, None if there is no live standby connection
+        """
+        with self._lock:
+            el, self._listener = self._listener, None
+            if el is not None:
+                try:
+                    el.noop()
+                except Exception:
+                    el.shutdown()
+                    el = None
+        self._wakeup.set()
+        return el
+
+    def _thread_main(self):
+        thread = self._thread
+        backoff = Backoff(1, STANDBY_NOOP_INTERVAL)
+        while not thread.stopped():
+            wait = STANDBY_NOOP_INTERVAL
+            try:
+                if self._listener is None:
+                    # connect without the lock, `take` must never wait for a login
+                    el = self._connect()
+                    with self._lock:
+                        self._listener = el
+                    log.debug(f"Standby connection of <{self.name}> is ready.")
+                else:
+                    with self._lock:
+                        if self._listener is not None:
+                            self._listener.noop()
+                backoff.reset()
+            except Exception as err:
+                log.debug(f"Standby connection of <{self.name}> failed, reason: {err}")
+                with self._lock:
+                    el, self._listener = self._listener, None
+                if el is not None:
+                    el.shutdown()
+                wait = backoff.next()
+            self._wakeup.wait(wait)
+            self._wakeup.clear()
 
 class EmailSignalExtraction:
     # env
@@ -14,9 +98,11 @@ class EmailSignalExtraction:
     login_password: str
     imap_server_address: str
     imap_server_port: int
+    imap_incremental_fetch: bool
+    imap_ssl: bool
+    folder: str
     
     last_email_uid = -1
-    email_history = []
     loop_duration_sample = []
     displaying_loop_duration = False
     
@@ -26,7 +112,14 @@ class EmailSignalExtraction:
                  imap_server_address:str, 
                  imap_server_port:int, 
                  imap_auto_reconnect:bool, 
-                 imap_auto_reconnect_wait:int
+                 imap_auto_reconnect_wait:int,
+                 imap_incremental_fetch:bool = True,
+                 imap_ssl:bool = True,
+                 folder:str = "INBOX",
+                 imap_hot_standby:bool = False,
+                 imap_reconnect_backoff_base:float = 0.5,
+                 imap_dual_connection:bool = True,
+                 imap_lean_parsing:bool = True
                 ):
         self.email_address = email_address
         self.login_password = login_password
@@ -34,16 +127,30 @@ class EmailSignalExtraction:
         self.imap_server_port = imap_server_port
         self.imap_auto_reconnect = imap_auto_reconnect
         self.imap_auto_reconnect_wait = imap_auto_reconnect_wait
-    
-            
-    def add_email_to_history(self, email_uid: int) -> bool:
-        if email_uid in self.email_history:
-            return False
-        self.email_history.append(email_uid)
-        # if the length of email_history is greater than 20, delete the oldest one
-        if len(self.email_history) > 20:
-            del self.email_history[0]
-        return True
+        self.imap_incremental_fetch = imap_incremental_fetch
+        self.imap_ssl = imap_ssl
+        self.folder = folder
+        self.imap_dual_connection = imap_dual_connection
+        self.imap_lean_parsing = imap_lean_parsing
+        self.el: EmailListener | None = None
+        # reuse the TLS session on reconnect, skips the full handshake
+        self.ssl_context = ResumableSSLContext() if imap_ssl else None
+        # wait longer and longer between failed attempts, up to `imap_auto_reconnect_wait`
+        self.backoff = Backoff(min(imap_reconnect_backoff_base, imap_auto_reconnect_wait), imap_auto_reconnect_wait) if imap_auto_reconnect_wait > 0 else None
+        self.standby = HotStandby(self.connect_standby, self.name) if imap_hot_standby else None
+
+    @property
+    def name(self) -> str:
+        return f"{self.email_address}/{self.folder}"
+
+    def get_dedup_keys(self, el: EmailListener, data: dict) -> list[str]:
+        uid_validity = (el.folder_info or {}).get(b"UIDVALIDITY", "")
+        return [
+            f"uid:{el.email}:{el.folder}:{uid_validity}:{data['Email_UID']}",
+            f"mid:{message_id}" if (message_id := data.get("Message_ID")) else "",
+            # the lean parser gives no date to the emails without a Date header
+            content_key(data["From_Address"], data["Subject"], data["Date"].isoformat() if data["Date"] else "", data.get("Plain_Text")),
+        ]
 
     def get_latest_email(self, el: EmailListener):
         try:
@@ -52,20 +159,33 @@ class EmailSignalExtraction:
         except Exception:
             return False
 
-    def connect_imap_server(self) -> EmailListener | None:
+    def get_latest_email_uid(self, el: EmailListener) -> int:
+        if not self.imap_incremental_fetch:
+            latest_email = self.get_latest_email(el)
+            return int(latest_email["Email_UID"]) if latest_email else -1
+        # the UID of the latest email is lower than UIDNEXT, no need to fetch anything
         try:
-            el = EmailListener(email=self.email_address, app_password=self.login_password, folder="INBOX", attachment_dir=os.path.join(project_main_directory, ".temp", "emails"), logger=log.debug, imap_address=self.imap_server_address, imap_port=self.imap_server_port)
-            # Log into the IMAP server
-            el.login()
-            return el
-        except Exception as err:
-            log.error(f"Here an error has occurred, reason: {err}")
-            if not self.imap_auto_reconnect:
-                shutdown()
-            log.warning(f"The program will try to reconnect after {self.imap_auto_reconnect_wait}s...")
-            time.sleep(self.imap_auto_reconnect_wait)
-            self.main()
-            return None
+            el.last_uid = el.get_uid_next() - 1
+        except Exception:
+            return -1
+        return el.last_uid
+
+    def connect_imap_server(self) -> EmailListener:
+        el = EmailListener(email=self.email_address, app_password=self.login_password, folder=self.folder, attachment_dir=os.path.join(project_main_directory, ".temp", "emails"), logger=log.debug, imap_address=self.imap_server_address, imap_port=self.imap_server_port, imap_ssl=self.imap_ssl, ssl_context=self.ssl_context, lean_parsing=self.imap_lean_parsing)
+        # Log into the IMAP server
+        el.login()
+        return el
+
+    def connect_standby(self) -> EmailListener:
+        el = self.connect_imap_server()
+        if self.imap_dual_connection:
+            # the IDLE connection too, the takeover must not open it
+            try:
+                el.open_idle_connection()
+            except BaseException:
+                el.shutdown()
+                raise
+        return el
 
     def on_email_received(self, el, msgs):
         for data in msgs.values():
@@ -74,55 +194,102 @@ class EmailSignalExtraction:
             email_subject = data["Subject"]
             email_date = data["Date"]
             from_address = data["From_Address"]
-            last_email_uid = self.email_history[-1]
 
-            if last_email_uid < 0:
-                last_email_uid = email_uid - 1
-
-            if email_uid in self.email_history or email_uid <= last_email_uid:
+            if email_uid <= self.last_email_uid:
                 continue
 
             if from_address not in TRADINGVIEW_ALERT_EMAIL_ADDRESS:
                 log.info(f"Email from {from_address} is not from TradingView, SKIP.")
                 continue
 
-            with contextlib.suppress(ValueError):
-                email_content = json.loads(email_content)
-            email_content = json.dumps(email_content)
-            log.info(f"Sending webhook alert<{email_subject}>, content: {email_content}")
+            if not get_deduplicator().check_and_add(*self.get_dedup_keys(el, data)):
+                log.info(f"Email UID<{email_uid}> has already been broadcasted, SKIP.")
+                continue
+
+            # decoded here once, the same encoded body is then sent to every target
+            payload = Payload.from_text(email_content)
+            log.info(f"Sending webhook alert<{email_subject}>, content: {payload}")
             
-            broadcast(email_content)
-            log.info(f"The whole process taken {round((datetime.now(timezone.utc) - email_date).total_seconds(), 3)}s.")
-            self.add_email_to_history(email_uid)
+            broadcast(payload, {
+                "source": "email", "mailbox": self.name, "uid": email_uid, "message_id": data.get("Message_ID"),
+                "from": from_address, "subject": email_subject, "date": email_date,
+            })
+            ALERTS.labels("email").inc()
+            if email_date is None:
+                # no Date header, the latency is unknown
+                continue
+            process_duration = (datetime.now(timezone.utc) - email_date).total_seconds()
+            ALERT_LATENCY.labels("email").observe(process_duration)
+            log.info(f"The whole process taken {round(process_duration, 3)}s.")
     
+    def resume(self, el: EmailListener):
+        """
+        ### Description ###
+        Continue from where the previous connection stopped, the alerts that
+        arrived while disconnected are processed right away.
+
+        ### Parameters ###
+            - `el` (EmailListener): The new connection
+        """
+        previous = self.el
+        uid_validity = (el.folder_info or {}).get(b"UIDVALIDITY")
+        if previous is None or (previous.folder_info or {}).get(b"UIDVALIDITY") != uid_validity:
+            # first connection, or the UIDs of the folder have changed
+            self.last_email_uid = self.get_latest_email_uid(el)
+            return
+        if self.imap_incremental_fetch:
+            el.last_uid = previous.last_uid if previous.last_uid is not None else self.last_email_uid
+        msgs = el.scrape(incremental=self.imap_incremental_fetch, from_filter=TRADINGVIEW_ALERT_EMAIL_ADDRESS)
+        if msgs:
+            log.info(f"Processing {len(msgs)} email(s) received while disconnected.")
+            self.on_email_received(el, msgs)
+
     def start(self):
+        # the standby connection is already logged in, use it if there is one
+        el = (self.standby.take() if self.standby else None) or self.connect_imap_server()
+        try:
+            self.resume(el)
+            self.el = el
+
+            log.info(f"Listening to IMAP server({self.imap_server_address}) <{self.name}>...")
+            el.listen(
+                -1, process_func=self.on_email_received,
+                incremental=self.imap_incremental_fetch,
+                from_filter=TRADINGVIEW_ALERT_EMAIL_ADDRESS,
+                dual_connection=self.imap_dual_connection
+            )
+        except BaseException:
+            # don't wait for LOGOUT on a connection that is probably dead
+            el.shutdown()
+            raise
+
+    def main(self):
         if self.imap_auto_reconnect_wait <= 0:
             log.error("\"imap_auto_reconnect_wait\"(config.toml) must be greater than 0")
             shutdown()
-            
+
         log.info("Initializing...")
-        el = self.connect_imap_server()
-        
-        if not el:
-            return
-        
-        latest_email = self.get_latest_email(el)
-        self.last_email_uid = int(latest_email["Email_UID"]) if latest_email else -1
-        self.add_email_to_history(self.last_email_uid)
-
-        log.info(f"Listening to IMAP server({self.imap_server_address})...")
-        el.listen(-1, process_func=self.on_email_received)
-        
-    def main(self):
-        try:
-            self.start()
-        except KeyboardInterrupt:
-            log.warning("The program has been stopped by user.")
-            shutdown()
-        except Exception as err:
-            log.error(f"Here an error has occurred, reason: {err}")
-            if not self.imap_auto_reconnect:
+        if self.standby:
+            self.standby.start()
+        # reconnect in a loop, the stack does not grow with every outage
+        while True:
+            started_at = time.time()
+            try:
+                self.start()
+                return
+            except KeyboardInterrupt:
+                log.warning("The program has been stopped by user.")
                 shutdown()
-            log.warning(f"The program will try to reconnect after {self.imap_auto_reconnect_wait}s...")
-            time.sleep(self.imap_auto_reconnect_wait)
-            self.start()
+            except Exception as err:
+                log.error(f"Here an error has occurred, reason: {err}")
+                if not self.imap_auto_reconnect:
+                    shutdown()
+            IMAP_RECONNECTS.inc()
+            if time.time() - started_at >= STABLE_SESSION:
+                self.backoff.reset()
+            if self.standby and self.standby.ready():
+                log.warning("The standby connection takes over.")
+                continue
+            delay = self.backoff.next()
+            log.warning(f"The program will try to reconnect after {round(delay, 1)}s...")
+            time.sleep(delay)
@@ -0,0 +1,95 @@
+import threading
+from .. import StoppableThread, log, shutdown
+from .email_signal_extraction import EmailSignalExtraction
+
+# keys an `imap_accounts` entry inherits from the top level of the config
+ACCOUNT_KEYS = (
+    "email_address", "login_password",
+    "imap_server_address", "imap_server_port", "imap_ssl",
+    "imap_auto_reconnect", "imap_auto_reconnect_wait", "imap_incremental_fetch",
+    "imap_hot_standby", "imap_reconnect_backoff_base", "imap_dual_connection",
+    "imap_lean_parsing",
+)
+
+def build_extractions(config: dict) -> list[EmailSignalExtraction]:
+    """
+    ### Description ###
+    Create one `EmailSignalExtraction` per account/folder pair of the config.
+    The top level account listens to `imap_folders` (default ["INBOX"]), each
+    table of `imap_accounts` adds an account, the keys it does not set are
+    taken from the top level.
+
+    ### Parameters ###
+        - `config` (dict): The config
+
+    ### Returns ###
+        - (list[EmailSignalExtraction]): The extractions
+    """
+    defaults = {key: config.get(key) for key in ACCOUNT_KEYS}
+    accounts = []
+    if defaults["email_address"]:
+        accounts.append({**defaults, "folders": config.get("imap_folders", ["INBOX"])})
+    for account in config.get("imap_accounts", []):
+        accounts.append({**defaults, "folders": ["INBOX"], **account})
+
+    extractions = []
+    pairs = set()
+    for account in accounts:
+        for folder in account["folders"]:
+            # the same folder twice would open two connections for nothing
+            if (account["email_address"], folder) in pairs:
+                log.warning(f"Mailbox <{account['email_address']}/{folder}> is configured more than once, SKIP.")
+                continue
+            pairs.add((account["email_address"], folder))
+            extractions.append(EmailSignalExtraction(
+                account["email_address"], account["login_password"],
+                account["imap_server_address"], account["imap_server_port"],
+                account["imap_auto_reconnect"], account["imap_auto_reconnect_wait"],
+                True if account["imap_incremental_fetch"] is None else account["imap_incremental_fetch"],
+                True if account["imap_ssl"] is None else account["imap_ssl"],
+                folder,
+                bool(account["imap_hot_standby"]),
+                account["imap_reconnect_backoff_base"] or 0.5,
+                True if account["imap_dual_connection"] is None else account["imap_dual_connection"],
+                True if account["imap_lean_parsing"] is None else account["imap_lean_parsing"]
+            ))
+    return extractions
+
+class MailboxSupervisor:
+    """
+    Run several `EmailSignalExtraction` at once, one thread and one IDLE
+    connection per account/folder pair. All of them share the deduplicator
+    and the broadcast fan-out pool, so an alert that lands in two folders
+    is only broadcasted once.
+    """
+
+    def __init__(self, extractions: list[EmailSignalExtraction]):
+        self.extractions = extractions
+        self.threads: list[StoppableThread] = []
+        self._stopped = threading.Event()
+
+    def _run(self, extraction: EmailSignalExtraction):
+        try:
+            extraction.main()
+        finally:
+            log.error(f"The listener of <{extraction.name}> has stopped.")
+            self._stopped.set()
+
+    def main(self):
+        """
+        ### Description ###
+        Start the listeners and block until one of them stops, the program
+        is then shut down like a single listener would do.
+        """
+        log.info(f"Listening to {len(self.extractions)} mailbox(es): {', '.join(e.name for e in self.extractions)}")
+        for extraction in self.extractions:
+            thread = StoppableThread(target=self._run, args=(extraction,), daemon=True, name=f"imap-{extraction.name}")
+            thread.start()
+            self.threads.append(thread)
+        try:
+            # wait() with a timeout keeps the main thread responsive to Ctrl+C
+            while not self._stopped.wait(1):
+                pass
+        except KeyboardInterrupt:
+            log.warning("The program has been stopped by user.")
+        shutdown()
@@ -1,6 +1,12 @@
 from datetime import datetime, timezone
-from .. import log, shutdown, event_subscribe, event_unsubscribe, api_server_start, StoppableThread, TRADINGVIEW_ALERT_EMAIL_ADDRESS
+from typing import Callable
+from .. import log, shutdown, event_subscribe, event_unsubscribe, event_post, api_server_start, StoppableThread, EventBackpressure, TRADINGVIEW_ALERT_EMAIL_ADDRESS
+from .. import api_server
 from ..broadcast import broadcast
+from ..dedup import get_deduplicator, content_key
+from ..metrics import ALERTS, ALERT_LATENCY
+from ..payload import Payload
+from ..tunnel_monitor import TunnelMonitor, DEFAULT_INTERVAL as DEFAULT_MONITOR_INTERVAL, DEFAULT_FAILURE_THRESHOLD as DEFAULT_MONITOR_FAILURES
 from pyngrok import ngrok, conf as ngrok_conf
 
 class NgrokSignalRedirect:
@@ -11,13 +17,39 @@ class NgrokSignalRedirect:
     # env
     ngrok_auth_token: str
     ngrok_api_server_auth_key: str | None
+    workers: int
+    worker_initializer: Callable[[], None] | None
+    ngrok_domain: str | None
+    monitor_interval: float
+    monitor_failures: int
+    tunnel_monitor: TunnelMonitor | None = None
+    _api_key: str | None = None
         
-    def __init__(self, ngrok_auth_token: str, ngrok_api_server_auth_key: str | None = None):
+    def __init__(self, ngrok_auth_token: str, ngrok_api_server_auth_key: str | None = None,
+                 workers: int = 1, worker_initializer: Callable[[], None] | None = None,
+                 ngrok_domain: str | None = None,
+                 monitor_interval: float = DEFAULT_MONITOR_INTERVAL,
+                 monitor_failures: int = DEFAULT_MONITOR_FAILURES):
+        """
+        ### Parameters ###
+            - `ngrok_auth_token` (str): The ngrok auth token
+            - `ngrok_api_server_auth_key` (str | optional): Fixed API key, generated if not set
+            - `workers` (int): Number of API worker processes sharing the port, 1 to run the API server in this process
+            - `worker_initializer` (Callable | optional): Called first in each worker process, see `ApiWorkers`
+            - `ngrok_domain` (str | optional): Reserved ngrok domain, the URL stays the same when the tunnel is re-created
+            - `monitor_interval` (float): Seconds between two probes of the tunnel, 0 to disable the monitor
+            - `monitor_failures` (int): Consecutive failed probes before the tunnel is re-created
+        """
         self.ngrok_auth_token = ngrok_auth_token
         self.ngrok_api_server_auth_key = ngrok_api_server_auth_key
+        self.workers = workers
+        self.worker_initializer = worker_initializer
+        self.ngrok_domain = ngrok_domain
+        self.monitor_interval = monitor_interval
+        self.monitor_failures = monitor_failures
     
     def calculate_seconds_to_now(self, date_str: str) -> float:
-        timestamp = datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%S.%fZ")
+        timestamp = datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=timezone.utc)
         now = datetime.now(timezone.utc)
         diff = now - timestamp
         return diff.total_seconds()
@@ -30,26 +62,58 @@ class NgrokSignalRedirect:
         email_subject = data.get("subject")
         email_content = data.get("content")
         receive_datetime = data.get("receive_datetime")
-        print(receive_datetime)
+        log.debug(f"Alert received at {receive_datetime}")
 
         if not from_address or not email_subject or not email_content or not receive_datetime:
             log.error(f"Received data is not valid, data: {data}")
             return
         elif from_address not in TRADINGVIEW_ALERT_EMAIL_ADDRESS:
             log.info(f"Email from {from_address} is not from TradingView, SKIP.")
-            return         
+            return
+        # a forwarder retry sends the same data again
+        dedup_keys = (
+            f"mid:{message_id}" if (message_id := data.get("message_id")) else "",
+            content_key(from_address, email_subject, email_content, receive_datetime),
+        )
+        if not get_deduplicator().check_and_add(*dedup_keys):
+            log.info(f"Alert<{email_subject}> received at {receive_datetime} has already been broadcasted, SKIP.")
+            return
 
-        log.info(f"Sending webhook alert<{email_subject}>, content: {email_content}")
-        broadcast(email_content)
-        log.info(f"The whole process taken {self.calculate_seconds_to_now(receive_datetime)}s.")
+        payload = Payload.of(email_content)
+        log.info(f"Sending webhook alert<{email_subject}>, content: {payload}")
+        broadcast(payload, {
+            "source": "ngrok", "message_id": data.get("message_id"),
+            "from": from_address, "subject": email_subject, "date": receive_datetime,
+        })
+        process_duration = self.calculate_seconds_to_now(receive_datetime)
+        ALERTS.labels("ngrok").inc()
+        ALERT_LATENCY.labels("ngrok").observe(process_duration)
+        log.info(f"The whole process taken {process_duration}s.")
         
+    def connect_ngrok(self, port: int) -> str:
+        # a reserved domain keeps the URL the forwarders know
+        options = {"domain": self.ngrok_domain} if self.ngrok_domain else {}
+        return ngrok.connect(str(port), "http", **options).public_url
     def setup_ngrok(self, port: int):
         log.info("Setting up ngrok...")
         ngrok.set_auth_token(self.ngrok_auth_token)
         ngrok_conf.get_default().log_event_callback = None
-        http_tunnel = ngrok.connect(port=port, proto="http")
-        log.info(f"Your ngrok URL: {http_tunnel.public_url}")
+        self.tunnel_monitor = TunnelMonitor(
+            lambda: self.connect_ngrok(port), ngrok.disconnect,
+            api_key=self._api_key or api_server.api_key,
+            interval=self.monitor_interval or DEFAULT_MONITOR_INTERVAL, failure_threshold=self.monitor_failures,
+        )
+        public_url = self.tunnel_monitor.open()
+        log.info(f"Your ngrok URL: {public_url}")
+        if self.monitor_interval:
+            self.tunnel_monitor.start()
         event_unsubscribe(self._EventID.API_PORT, self.setup_ngrok)        
+    def subscribe_data_received(self):
+        # the API server answers at once, the alerts wait in the queue (503 when it is full)
+        event_subscribe(
+            self._EventID.API_REV, self.on_data_received,
+            asynchronous=True, queue_size=api_server.MAX_QUEUE_SIZE, policy=EventBackpressure.REJECT,
+        )
     def setup_api_server(self):
         thread = StoppableThread(target=api_server_start, args=(self._EventID.API_PORT,))
         thread.start()
@@ -59,7 +123,21 @@ class NgrokSignalRedirect:
             log.error("Missing ngrok auth token, please set it in the config file.")
             shutdown()
         event_subscribe(self._EventID.API_PORT, self.setup_ngrok)
-        event_subscribe(self._EventID.API_REV, self.on_data_received)
+        if self.workers > 1:
+            self.main_workers()
+            return
+        self.subscribe_data_received()
         thread = StoppableThread(target=api_server_start, args=(self._EventID.API_PORT, self._EventID.API_REV, self.ngrok_api_server_auth_key))
         thread.start()
         thread.join()
+
+    def main_workers(self):
+        # several processes accept on the same port, this one supervises them
+        from .api_workers import ApiWorkers
+        api_key = self._api_key = self.ngrok_api_server_auth_key or api_server.generate_api_key(api_server.GEN_API_KEY_LENGTH)
+        workers = ApiWorkers(self.workers, self.ngrok_auth_token, api_key, self.worker_initializer)
+        port = workers.start()
+        log.info(f"Your API key: {api_key}")
+        log.info("Please add 'X-API-KEY' and the API key to the header as the header name and header value of your request.")
+        event_post(self._EventID.API_PORT, port)
+        workers.supervise()
@@ -0,0 +1,375 @@
+import abc
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+from .multi_task import StoppableThread
+from .logger import logger as log
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    labels = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+class _CounterChild:
+    __slots__ = ("_value", "_lock")
+
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    def get(self) -> float:
+        return self._value
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ("_function",)
+
+    def __init__(self):
+        super().__init__()
+        self._function: Callable[[], float] | None = None
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    def set(self, value: float):
+        self._value = value
+
+    def set_function(self, function: Callable[[], float]):
+        self._function = function
+
+    def get(self) -> float:
+        if self._function is not None:
+            try:
+                return float(self._function())
+            except Exception:
+                return math.nan
+        return self._value
+
+    @contextmanager
+    def track_in_progress(self):
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+class _HistogramChild:
+    __slots__ = ("_buckets", "_counts", "_sum", "_lock")
+
+    def __init__(self, buckets: tuple):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time)
+
+    def snapshot(self) -> tuple[list[int], float]:
+        with self._lock:
+            return list(self._counts), self._sum
+
+class _Metric(abc.ABC):
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._children: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        if not self.label_names:
+            self._default = self.labels()
+
+    @abc.abstractmethod
+    def _new_child(self):
+        pass
+
+    def labels(self, *values, **kwargs):
+        """
+        ### Description ###
+        Get the child metric of the given label values.
+
+        ### Returns ###
+            - The child metric
+        """
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.label_names)
+        values = tuple(str(value) for value in values)
+        if len(values) != len(self.label_names):
+            raise ValueError(f"Expected {len(self.label_names)} label value(s) for {self.name}, got {len(values)}")
+        # lock-free read for the existing children
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def __getattr__(self, name: str):
+        # allow `metric.inc()` etc. on the metrics without labels
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if not self.label_names:
+            return getattr(self._default, name)
+        raise AttributeError(f"{self.name} has labels, use .labels() first")
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for values, child in list(self._children.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, values)} {_format_value(child.get())}")
+        return lines
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, label_names)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for values, child in list(self._children.items()):
+            counts, total = child.snapshot()
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, values)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, values)} {cumulative}")
+        return lines
+
+class Registry:
+    """
+    A collection of metrics that can be rendered in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """
+        ### Description ###
+        Render all metrics in the Prometheus text format.
+
+        ### Returns ###
+            - (str): The metrics
+        """
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+_renderer: Callable[[], str] = REGISTRY.render
+
+def render() -> str:
+    """
+    ### Description ###
+    Render the metrics served at "/metrics", the registry of this process
+    unless another renderer is set (eg. the aggregate of the API workers).
+
+    ### Returns ###
+        - (str): The metrics in the Prometheus text format
+    """
+    return _renderer()
+
+def set_renderer(renderer: Callable[[], str]):
+    """
+    ### Description ###
+    Replace the renderer of "/metrics".
+
+    ### Parameters ###
+        - `renderer` (Callable): Return the metrics in the Prometheus text format
+    """
+    global _renderer
+    _renderer = renderer
+
+def _add_label(series: str, name: str, value: str) -> str:
+    label = f'{name}="{_escape(value)}"'
+    if series.endswith("}"):
+        metric, _, labels = series[:-1].partition("{")
+        return f"{metric}{{{label},{labels}}}" if labels else f"{metric}{{{label}}}"
+    return f"{series}{{{label}}}"
+
+def merge(texts: list[str], cumulative_only: bool = False, sources: list[str] | None = None) -> str:
+    """
+    ### Description ###
+    Merge metrics rendered by several processes: the counters and the
+    histograms of the same series are summed. The gauges of each process
+    get a `worker` label with its source, or keep the max of the processes
+    if there are no sources.
+
+    ### Parameters ###
+        - `texts` (list[str]): The metrics in the Prometheus text format, see `Registry.render`
+        - `cumulative_only` (bool): Keep only the counters and the histograms
+        - `sources` (list[str] | optional): The process of each text, eg. "parent" or the worker index
+
+    ### Returns ###
+        - (str): The merged metrics
+    """
+    # family -> (HELP line, TYPE line) and family -> {series: value}, in the order of first appearance
+    headers: dict[str, tuple[str, str]] = {}
+    samples: dict[str, dict[str, float]] = {}
+    for index, text in enumerate(texts):
+        family = help_line = None
+        cumulative = True
+        for line in text.splitlines():
+            if line.startswith("# HELP "):
+                family, help_line = line.split(" ", 3)[2], line
+            elif line.startswith("# TYPE "):
+                cumulative = line.rsplit(" ", 1)[1] in ("counter", "histogram")
+                if cumulative_only and not cumulative:
+                    family = None
+                    continue
+                headers.setdefault(family, (help_line, line))
+                samples.setdefault(family, {})
+            elif line and family is not None:
+                series, value = line.rsplit(" ", 1)
+                values = samples[family]
+                if cumulative:
+                    values[series] = values.get(series, 0.0) + float(value)
+                elif sources is not None:
+                    # the value of a process, eg. the latency of a proxy, is not added to those of the others
+                    values[_add_label(series, "worker", sources[index])] = float(value)
+                else:
+                    values[series] = max(values.get(series, -math.inf), float(value))
+    lines = []
+    for family, (help_line, type_line) in headers.items():
+        lines.extend((help_line, type_line))
+        lines.extend(f"{series} {_format_value(value)}" for series, value in samples[family].items())
+    return "\n".join(lines) + "\n"
+
+def counter(name: str, documentation: str, label_names: tuple = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, label_names))
+
+def gauge(name: str, documentation: str, label_names: tuple = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, label_names))
+
+def histogram(name: str, documentation: str, label_names: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, label_names, buckets))
+
+# ---------------* Metrics *---------------
+IMAP_IDLE_WAKEUPS = counter("tvwa_imap_idle_wakeups_total", "Number of IDLE responses received from the IMAP server")
+IMAP_FETCHED_EMAILS = counter("tvwa_imap_fetched_emails_total", "Number of emails downloaded from the IMAP server")
+IMAP_FETCH_BYTES = counter("tvwa_imap_fetch_bytes_total", "Number of email bytes downloaded from the IMAP server")
+IMAP_RECONNECTS = counter("tvwa_imap_reconnects_total", "Number of reconnections to the IMAP server")
+
+API_REQUESTS = counter("tvwa_api_requests_total", "Number of requests received by the API server", ("path", "status"))
+API_REQUEST_DURATION = histogram("tvwa_api_request_duration_seconds", "Time taken to answer API requests", ("path",))
+API_QUEUE_DEPTH = gauge("tvwa_api_queue_depth", "Number of received alerts waiting to be processed")
+API_WORKERS_ALIVE = gauge("tvwa_api_workers_alive", "Number of API worker processes running")
+TUNNEL_HEALTHY = gauge("tvwa_tunnel_healthy", "Whether the ngrok tunnel answers the probes (1) or not (0)")
+TUNNEL_RTT = gauge("tvwa_tunnel_rtt_seconds", "Round-trip time of the last successful probe through the ngrok tunnel")
+TUNNEL_RECONNECTS = counter("tvwa_tunnel_reconnects_total", "Number of times the ngrok tunnel was re-created after failed probes")
+API_WORKER_RESTARTS = counter("tvwa_api_worker_restarts_total", "Number of API worker processes restarted after they exited")
+
+EVENT_QUEUE_DEPTH = gauge("tvwa_event_queue_depth", "Number of posted events waiting for their asynchronous subscribers", ("event",))
+EVENT_HANDLER_DURATION = histogram("tvwa_event_handler_duration_seconds", "Time taken by the asynchronous subscribers to handle an event", ("event",))
+EVENT_DISCARDED = counter("tvwa_event_discarded_total", "Number of events discarded because the subscriber queue was full or the subscriber was stopped, by reason (dropped, rejected)", ("event", "reason"))
+
+SCHEDULER_PENDING_TASKS = gauge("tvwa_scheduler_pending_tasks", "Number of planned tasks (eg. retries) waiting to run")
+
+ALERTS = counter("tvwa_alerts_total", "Number of alerts broadcasted", ("source",))
+ALERT_LATENCY = histogram("tvwa_alert_latency_seconds", "Time from the alert being sent by TradingView to the end of the broadcast", ("source",))
+DELIVERIES = counter("tvwa_deliveries_total", "Number of deliveries by target host and status", ("target", "status"))
+DELIVERY_DURATION = histogram("tvwa_delivery_duration_seconds", "Time taken to deliver an alert by target host", ("target",))
+BROADCASTS_IN_FLIGHT = gauge("tvwa_broadcasts_in_flight", "Number of broadcasts being delivered")
+DELIVERY_RETRIES = counter("tvwa_delivery_retries_total", "Number of failed deliveries by target host and outcome (queued, delivered, gave_up)", ("target", "outcome"))
+RETRY_QUEUE_DEPTH = gauge("tvwa_retry_queue_depth", "Number of failed deliveries waiting to be retried")
+PROXY_HEALTHY = gauge("tvwa_proxy_healthy", "Whether a proxy of the pool is healthy (1) or not (0)", ("proxy",))
+PROXY_LATENCY = gauge("tvwa_proxy_latency_seconds", "Average probe latency of a proxy of the pool", ("proxy",))
+TELEGRAM_QUEUE_DEPTH = gauge("tvwa_telegram_queue_depth", "Number of alerts waiting to be sent to Telegram")
+
+DISCORD_LOG_QUEUE_DEPTH = gauge("tvwa_discord_log_queue_depth", "Number of log records waiting to be sent to Discord")
+DISCORD_LOG_RECORDS = counter("tvwa_discord_log_records_total", "Number of log records handled by the Discord log handler", ("status",))
+
+# ---------------* Standalone Server *---------------
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # disable logging to avoid double logging
+        pass
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    ### Description ###
+    Serve the metrics on `http://<host>:<port>/metrics` from a background thread.
+
+    ### Parameters ###
+        - `port` (int): The port to listen on
+        - `host` (str): The address to listen on, default is localhost only
+
+    ### Returns ###
+        - (ThreadingHTTPServer): The server
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    server.daemon_threads = True
+    StoppableThread(target=server.serve_forever, daemon=True).start()
+    log.info(f"Metrics are available at http://{host}:{port}/metrics")
+    return server
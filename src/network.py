@@ -1,9 +1,12 @@
 import contextlib
 import re
-import json
+import time
+import threading
 import requests
 from requests.adapters import HTTPAdapter, Retry
 
+from .payload import Payload
+
 #! The "URL_REGEX" not support localhost use 127.0.0.1 instead
 URL_REGEX = r"^https?:\/\/((?:www\.)?[-a-zA-Z0-9@:%._\+~#=]{1,256}\.[a-zA-Z0-9()]{1,6}\b)(?:[-a-zA-Z0-9()@:%_\+.~#?&\/=]*)$"
 POST_REQUEST_HEADERS = {
@@ -14,6 +17,21 @@ POST_REQUEST_HEADERS = {
 # increase retries number
 requests.adapters.DEFAULT_RETRIES = 5
 
+# ---------------* Connection Pool *---------------
+# One `urllib3` pool is kept per host, each pool holds up to `POOL_MAXSIZE`
+# keep-alive connections. Pools that have not been used for
+# `POOL_IDLE_TIMEOUT` seconds are closed to release the sockets.
+POOL_CONNECTIONS = 32 # Number of host pools to cache
+POOL_MAXSIZE = 16 # Number of connections to keep per host
+POOL_IDLE_TIMEOUT = 90 # seconds
+POOL_EVICTION_INTERVAL = 15 # seconds, how often idle pools are checked
+
+_session: requests.Session | None = None
+_adapter: HTTPAdapter | None = None
+_session_lock = threading.Lock()
+_host_last_used: dict[str, float] = {}
+_last_eviction = 0.0
+
 def is_url_valid(url: str) -> bool:
     """
     ### Description ###
@@ -40,38 +58,120 @@ def extract_url_domain(url: str) -> str | None:
     """
     return m[1] if (m := re.search(URL_REGEX, url)) else None
 
-def send_post_request(url: str, payload: str | dict, headers: dict | None = None, proxies: dict | None = None) -> requests.models.Response:
+def get_session() -> requests.Session:
+    """
+    ### Description ###
+    Get the shared HTTP session, create it if it does not exist yet.
+    All outbound requests share this session so the TCP/TLS connections
+    are reused across deliveries.
+
+    ### Returns ###
+        - (requests.Session): The shared session
+    """
+    global _session, _adapter
+    if _session is not None:
+        return _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            # set retry policy
+            retry = Retry(connect=3, backoff_factor=0.5)
+            _adapter = HTTPAdapter(
+                max_retries=retry,
+                pool_connections=POOL_CONNECTIONS,
+                pool_maxsize=POOL_MAXSIZE
+            )
+            # add adapter to session
+            session.mount("http://", _adapter)
+            session.mount("https://", _adapter)
+            _session = session
+    return _session
+
+def close_session():
+    """
+    ### Description ###
+    Close the shared HTTP session and all of its pooled connections.
+    """
+    global _session, _adapter
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _adapter = None
+        _host_last_used.clear()
+
+def evict_idle_connections(idle_timeout: float = POOL_IDLE_TIMEOUT) -> int:
+    """
+    ### Description ###
+    Close the connection pools of the hosts that have not been used for
+    `idle_timeout` seconds.
+
+    ### Parameters ###
+        - `idle_timeout` (float): Idle time in seconds before a pool is closed
+
+    ### Returns ###
+        - (int): Number of pools closed
+    """
+    global _last_eviction
+    now = time.monotonic()
+    _last_eviction = now
+    if _adapter is None:
+        return 0
+    idle_hosts = {host for host, last_used in list(_host_last_used.items()) if now - last_used >= idle_timeout}
+    if not idle_hosts:
+        return 0
+    closed = 0
+    with _session_lock:
+        # the requests through a proxy have their own pools, in the manager of the proxy
+        managers = [_adapter.poolmanager, *list(_adapter.proxy_manager.values())]
+        for manager in managers:
+            pools = manager.pools
+            for pool_key in list(pools.keys()):
+                if pool_key.key_host in idle_hosts:
+                    # `RecentlyUsedContainer` closes the pool when it is removed
+                    with contextlib.suppress(KeyError):
+                        del pools[pool_key]
+                        closed += 1
+        for host in idle_hosts:
+            _host_last_used.pop(host, None)
+    return closed
+
+def _touch_host(url: str, host: str | None = None):
+    host = host or requests.utils.urlparse(url).hostname
+    if host:
+        _host_last_used[host] = time.monotonic()
+    if time.monotonic() - _last_eviction >= POOL_EVICTION_INTERVAL:
+        evict_idle_connections()
+
+def send_post_request(url: str, payload: Payload | bytes | str | dict, headers: dict | None = None, proxies: dict | None = None, timeout: float | None = None, host: str | None = None) -> requests.models.Response:
     """
     ### Description ###
-    Send HTTP POST request
+    Send HTTP POST request through the shared connection pool
 
     ### Parameters ###
         - `url` (str): URL
-        - `payload` (str or dict): Payload
+        - `payload` (Payload, bytes, str or dict): Payload, a `Payload` or bytes are sent as they are,
+          the others are encoded to JSON first
         - `headers` (dict): Headers
         - `proxies` (dict): Proxies
+        - `timeout` (float | optional): Request timeout in seconds, no timeout if not specified
+        - `host` (str | optional): The host name of the URL, the URL is then known to be valid and is not parsed again
 
     ### Returns ###
         - (requests.models.Response): Response
     """
-    if not is_url_valid(url):
+    if host is None and not is_url_valid(url):
         raise ValueError(f"Invalid URL <{url}>")
-    # decode JSON if the payload is in JSON format
-    with contextlib.suppress(Exception):
-        payload = json.loads(payload)
-    # convert to JSON
-    payload = json.dumps(payload)
-    # start a session
-    session = requests.Session()
-    # set retry policy
-    retry = Retry(connect=3, backoff_factor=0.5)
-    adapter = HTTPAdapter(max_retries=retry)
-    # add adapter to session
-    session.mount('http://', adapter)
-    session.mount('https://', adapter)
-    return session.post(
+    # the payloads sent to many targets are encoded once by the caller
+    if isinstance(payload, Payload):
+        payload = payload.body
+    elif not isinstance(payload, (bytes, bytearray)):
+        payload = Payload.of(payload).body
+    _touch_host(url, host)
+    return get_session().post(
         url,
         data=payload,
         headers=POST_REQUEST_HEADERS if headers is None else headers,
-        proxies=proxies
-    )
\ No newline at end of file
+        proxies=proxies,
+        timeout=timeout
+    )
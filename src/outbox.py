@@ -0,0 +1,229 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+
+from . import StoppableThread, log
+
+class DeliveryState:
+    PENDING = "pending"
+    RETRYING = "retrying"
+    DELIVERED = "delivered"
+    FAILED = "failed"
+    EXPIRED = "expired"
+
+UNFINISHED_STATES = (DeliveryState.PENDING, DeliveryState.RETRYING)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS alerts (
+    id TEXT PRIMARY KEY,
+    created REAL NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS deliveries (
+    alert_id TEXT NOT NULL,
+    target TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL,
+    error TEXT,
+    PRIMARY KEY (alert_id, target)
+);
+CREATE INDEX IF NOT EXISTS deliveries_state ON deliveries (state);
+"""
+
+@dataclass
+class PendingAlert:
+    """
+    An alert with at least one unfinished delivery.
+    """
+    alert_id: str
+    created: float
+    payload: str
+    targets: list[str] = field(default_factory=list)
+
+class Outbox:
+    """
+    An append-only on-disk record of the alerts and the state of their
+    deliveries, stored in SQLite (WAL mode).
+
+    The writes are handed to a writer thread which commits them in batches
+    (group commit). `add_alert` waits until the commit of its batch, so an
+    alert is on disk before it is delivered and survives a crash. The
+    delivery states (`mark`) are committed in the background, a crash can
+    lose those of the last `flush_interval` seconds, the deliveries are then
+    replayed as pending.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 0.005, batch_size: int = 512):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._queue = queue.SimpleQueue()
+
+        # create folder if not exist
+        if folder := os.path.dirname(path):
+            os.makedirs(folder, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+        conn.close()
+
+        self._thread = StoppableThread(target=self._thread_main, daemon=True)
+        self._thread.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # fsync every commit, the group commit keeps it to one per batch
+        conn.execute("PRAGMA synchronous=FULL")
+        return conn
+
+    def add_alert(self, payload: str, targets: list[str]) -> str:
+        """
+        ### Description ###
+        Record a new alert and mark all of its deliveries as pending,
+        returns once the alert is committed.
+
+        ### Parameters ###
+            - `payload` (str): The alert payload
+            - `targets` (list[str]): The targets the alert will be delivered to
+
+        ### Returns ###
+            - (str): The alert ID
+        """
+        alert_id = uuid.uuid4().hex
+        committed = threading.Event()
+        self._queue.put(("alert", alert_id, time.time(), payload, tuple(targets), committed))
+        committed.wait()
+        return alert_id
+
+    def mark(self, alert_id: str, target: str, state: str, error: str | None = None):
+        """
+        ### Description ###
+        Update the state of one delivery.
+
+        ### Parameters ###
+            - `alert_id` (str): The alert ID returned by `add_alert`
+            - `target` (str): The target name
+            - `state` (str): The new state, see `DeliveryState`
+            - `error` (str | optional): The reason of the failure
+        """
+        self._queue.put(("mark", alert_id, target, state, error, time.time()))
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """
+        ### Description ###
+        Wait until all queued records are committed.
+
+        ### Parameters ###
+            - `timeout` (float | optional): Max seconds to wait
+
+        ### Returns ###
+            - (bool): True if all records are committed
+        """
+        done = threading.Event()
+        self._queue.put(("flush", done))
+        return done.wait(timeout)
+
+    def pending(self, max_age: float | None = None) -> list[PendingAlert]:
+        """
+        ### Description ###
+        Get the alerts with unfinished deliveries, oldest first.
+        Unfinished deliveries older than `max_age` are marked as expired
+        and not returned.
+
+        ### Parameters ###
+            - `max_age` (float | optional): Max age of an alert in seconds
+
+        ### Returns ###
+            - (list[PendingAlert]): The pending alerts
+        """
+        self.flush()
+        conn = self._connect()
+        try:
+            if max_age is not None:
+                with conn:
+                    conn.execute(
+                        f"UPDATE deliveries SET state = ?, updated = ? WHERE state IN ({', '.join('?' * len(UNFINISHED_STATES))}) "
+                        "AND alert_id IN (SELECT id FROM alerts WHERE created < ?)",
+                        (DeliveryState.EXPIRED, time.time(), *UNFINISHED_STATES, time.time() - max_age)
+                    )
+            rows = conn.execute(
+                "SELECT alerts.id, alerts.created, alerts.payload, deliveries.target FROM deliveries "
+                "JOIN alerts ON alerts.id = deliveries.alert_id "
+                f"WHERE deliveries.state IN ({', '.join('?' * len(UNFINISHED_STATES))}) "
+                "ORDER BY alerts.created",
+                UNFINISHED_STATES
+            ).fetchall()
+        finally:
+            conn.close()
+
+        alerts: dict[str, PendingAlert] = {}
+        for alert_id, created, payload, target in rows:
+            alerts.setdefault(alert_id, PendingAlert(alert_id, created, payload)).targets.append(target)
+        return list(alerts.values())
+
+    def prune(self, older_than: float):
+        """
+        ### Description ###
+        Delete the finished alerts older than `older_than` seconds.
+
+        ### Parameters ###
+            - `older_than` (float): Age in seconds
+        """
+        self._queue.put(("prune", time.time() - older_than))
+
+    def _thread_main(self):
+        conn = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            waited = batch[0][0] in ("alert", "flush")
+            # group the records that arrive within the flush interval into one commit,
+            # only those already queued if someone waits for the commit
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and (remaining := deadline - time.monotonic()) > 0:
+                try:
+                    record = self._queue.get_nowait() if waited else self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(record)
+                waited = waited or record[0] in ("alert", "flush")
+            try:
+                self._write(conn, batch)
+            except Exception as err:
+                log.error(f"Failed to write {len(batch)} record(s) to the outbox, reason: {err}")
+            for record in batch:
+                if record[0] == "flush":
+                    record[1].set()
+                elif record[0] == "alert":
+                    record[-1].set()
+
+    @staticmethod
+    def _write(conn: sqlite3.Connection, batch: list[tuple]):
+        with conn:
+            for record in batch:
+                kind = record[0]
+                if kind == "alert":
+                    _, alert_id, created, payload, targets, _ = record
+                    conn.execute("INSERT INTO alerts (id, created, payload) VALUES (?, ?, ?)", (alert_id, created, payload))
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO deliveries (alert_id, target, state, attempts, updated) VALUES (?, ?, ?, 0, ?)",
+                        [(alert_id, target, DeliveryState.PENDING, created) for target in targets]
+                    )
+                elif kind == "mark":
+                    _, alert_id, target, state, error, updated = record
+                    conn.execute(
+                        "UPDATE deliveries SET state = ?, error = ?, updated = ?, attempts = attempts + 1 WHERE alert_id = ? AND target = ?",
+                        (state, error, updated, alert_id, target)
+                    )
+                elif kind == "prune":
+                    _, before = record
+                    conn.execute(
+                        "DELETE FROM alerts WHERE created < ? AND id NOT IN "
+                        f"(SELECT alert_id FROM deliveries WHERE state IN ({', '.join('?' * len(UNFINISHED_STATES))}))",
+                        (before, *UNFINISHED_STATES)
+                    )
+                    conn.execute("DELETE FROM deliveries WHERE alert_id NOT IN (SELECT id FROM alerts)")
@@ -0,0 +1,139 @@
+import json
+
+# optional, several times faster than the json module, `pip install orjson`
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_BACKENDS = ("auto", "orjson", "json")
+
+_use_orjson = orjson is not None
+
+def set_json_backend(name: str = "auto") -> str:
+    """
+    ### Description ###
+    Choose the JSON library used to encode and decode the payloads.
+
+    ### Parameters ###
+        - `name` (str): "auto" (orjson if installed), "orjson" or "json"
+
+    ### Returns ###
+        - (str): The library in use, "json" if orjson is asked for but not installed
+    """
+    global _use_orjson
+    if name not in JSON_BACKENDS:
+        raise ValueError(f"Unknown JSON backend <{name}>, expected one of {JSON_BACKENDS}")
+    _use_orjson = orjson is not None and name != "json"
+    return "orjson" if _use_orjson else "json"
+
+def dumps(obj) -> bytes:
+    """
+    ### Description ###
+    Encode an object to JSON.
+
+    ### Parameters ###
+        - `obj`: The object
+
+    ### Returns ###
+        - (bytes): The UTF-8 encoded JSON
+    """
+    if _use_orjson:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # eg. keys that are not strings, the json module is more lenient
+            pass
+    return json.dumps(obj).encode()
+
+def loads(data: str | bytes):
+    """
+    ### Description ###
+    Decode JSON.
+
+    ### Parameters ###
+        - `data` (str | bytes): The JSON
+
+    ### Returns ###
+        - The object
+
+    ### Raises ###
+        - ValueError: If the data is not valid JSON
+    """
+    if _use_orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+class Payload:
+    """
+    The content of an alert, decoded once and encoded once.
+
+    The same `body` (bytes) is sent to every webhook and the same `text`
+    to Telegram, instead of decoding and encoding the content again for
+    every target.
+    """
+    __slots__ = ("data", "_body", "_text")
+
+    def __init__(self, data):
+        """
+        ### Parameters ###
+            - `data`: The decoded content (eg. dict), or the text if the content is not JSON
+        """
+        self.data = data
+        self._body: bytes | None = None
+        self._text: str | None = None
+
+    @classmethod
+    def from_text(cls, text: str | bytes) -> "Payload":
+        """
+        ### Description ###
+        Create a payload from a text, decoded if it is JSON.
+
+        ### Parameters ###
+            - `text` (str | bytes): The text
+
+        ### Returns ###
+            - (Payload): The payload
+        """
+        try:
+            return cls(loads(text))
+        except ValueError:
+            return cls(text.decode(errors="replace") if isinstance(text, bytes) else text)
+
+    @classmethod
+    def of(cls, value) -> "Payload":
+        """
+        ### Description ###
+        Get the payload of a value, the texts are decoded if they are JSON.
+
+        ### Parameters ###
+            - `value` (Payload | str | bytes | dict | list): The value
+
+        ### Returns ###
+            - (Payload): The payload, `value` itself if it is one
+        """
+        if isinstance(value, Payload):
+            return value
+        if isinstance(value, (str, bytes)):
+            return cls.from_text(value)
+        return cls(value)
+
+    @property
+    def body(self) -> bytes:
+        """The JSON encoded content, the request body of the webhooks."""
+        if self._body is None:
+            self._body = dumps(self.data)
+        return self._body
+
+    @property
+    def text(self) -> str:
+        """The content as text, eg. for Telegram and the outbox, JSON encoded unless it is a plain text."""
+        if self._text is None:
+            self._text = self.data if isinstance(self.data, str) else self.body.decode()
+        return self._text
+
+    def __str__(self) -> str:
+        return self.text
+
+    def __repr__(self) -> str:
+        return f"Payload({self.text})"
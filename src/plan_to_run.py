@@ -1,47 +1,163 @@
+import heapq
+import itertools
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
-from . import StoppableThread
+from . import StoppableThread, log
+from .metrics import SCHEDULER_PENDING_TASKS
 
-pending_tasks = []
+MAX_WORKERS = 8 # Number of threads to run the due tasks
+
+class TaskHandle:
+    """
+    A handle of a planned task, can be used to cancel the task.
+    """
+    __slots__ = ("timestamp", "func", "func_args", "cancelled", "started")
+
+    def __init__(self, timestamp: float, func, func_args: tuple):
+        self.timestamp = timestamp
+        self.func = func
+        self.func_args = func_args
+        self.cancelled = False
+        self.started = False
+
+    def cancel(self) -> bool:
+        """
+        ### Description ###
+        Cancel the task.
+
+        ### Returns ###
+            - (bool): True if the task is cancelled, False if it has already started
+        """
+        return cancel(self)
+
+# heap of (timestamp, sequence, TaskHandle)
+pending_tasks: list[tuple[float, int, TaskHandle]] = []
 stop_flag = False
 
-def run_at(timestamp:float , func, func_args):
+_sequence = itertools.count()
+_condition = threading.Condition()
+_cancelled_count = 0
+_thread: StoppableThread | None = None
+_executor: ThreadPoolExecutor | None = None
+
+def run_at(timestamp:float , func, func_args:tuple = ()) -> TaskHandle:
     """
     ### Description ###
     Run a function at a specific time.
-    
+
     ### Parameters ###
         - `timestamp` (float): The timestamp to run the function at.
         - `func` (function): The function to run.
         - `func_args` (tuple): The arguments to pass to the function.
+
+    ### Returns ###
+        - (TaskHandle): The handle of the task, can be used to cancel the task.
     """
-    pending_tasks.append((timestamp, func, func_args))
-    
+    global stop_flag
+    task = TaskHandle(timestamp, func, tuple(func_args))
+    with _condition:
+        stop_flag = False
+        heapq.heappush(pending_tasks, (timestamp, next(_sequence), task))
+        _ensure_thread()
+        # only wake the thread when the new task is the next one to run
+        if pending_tasks[0][2] is task:
+            _condition.notify()
+    return task
+
+def cancel(task: TaskHandle) -> bool:
+    """
+    ### Description ###
+    Cancel a planned task.
+
+    ### Parameters ###
+        - `task` (TaskHandle): The handle returned by `run_at`.
+
+    ### Returns ###
+        - (bool): True if the task is cancelled, False if it has already started
+    """
+    global _cancelled_count
+    with _condition:
+        if task.started or task.cancelled:
+            return False
+        task.cancelled = True
+        _cancelled_count += 1
+        # drop the cancelled tasks when they take up most of the heap
+        if _cancelled_count > 64 and _cancelled_count > len(pending_tasks) // 2:
+            pending_tasks[:] = [entry for entry in pending_tasks if not entry[2].cancelled]
+            heapq.heapify(pending_tasks)
+            _cancelled_count = 0
+        _condition.notify()
+    return True
+
+def pending_count() -> int:
+    """
+    ### Description ###
+    Get the number of tasks waiting to run.
+
+    ### Returns ###
+        - (int): The number of pending tasks
+    """
+    with _condition:
+        return len(pending_tasks) - _cancelled_count
+
 def terminate():
     """
     ### Description ###
     Terminate the PlanToRun thread.
     """
-    global stop_flag
-    stop_flag = True
-            
-def _thread_check():
-    now_timestamp = time.time()
-    for task in pending_tasks:
-        target_timestamp = task[0]
-        if now_timestamp >= target_timestamp:
-            func = task[1]
-            func_args = task[2]
-            func(*func_args)
-            pending_tasks.remove(task)
-            
+    global stop_flag, _thread
+    with _condition:
+        stop_flag = True
+        thread, _thread = _thread, None
+        _condition.notify_all()
+    # wait for the dispatcher to exit, so `run_at` never has two of them running
+    if thread is not None and thread is not threading.current_thread():
+        thread.join()
+
+def _ensure_thread():
+    global _thread, _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="plan-to-run")
+    if _thread is None or not _thread.is_alive():
+        _thread = StoppableThread(target=_thread_main, daemon=True)
+        _thread.start()
+
+def _next_due_task() -> TaskHandle | None:
+    global _cancelled_count
+    with _condition:
+        # a dispatcher replaced after `terminate` exits even if `run_at` cleared the stop flag
+        while not stop_flag and _thread is threading.current_thread():
+            if not pending_tasks:
+                _condition.wait()
+                continue
+            timestamp, _, task = pending_tasks[0]
+            if task.cancelled:
+                heapq.heappop(pending_tasks)
+                _cancelled_count -= 1
+                continue
+            delay = timestamp - time.time()
+            if delay > 0:
+                # sleep until the task is due or a new task/cancel arrives
+                _condition.wait(delay)
+                continue
+            heapq.heappop(pending_tasks)
+            task.started = True
+            return task
+    return None
+
+def _run_task(task: TaskHandle):
+    try:
+        task.func(*task.func_args)
+    except Exception as err:
+        log.error(f"Planned task {getattr(task.func, '__name__', task.func)} failed, reason: {err}")
+
 def _thread_main():
-    while not stop_flag:
-        _thread_check()
-        time.sleep(0.05)
+    while (task := _next_due_task()) is not None:
+        _executor.submit(_run_task, task)
 
-thread = StoppableThread(target=_thread_main)
-thread.start()
+SCHEDULER_PENDING_TASKS.set_function(pending_count)
 
 if __name__ == "__main__":
     def test_func(a, b, c):
@@ -49,5 +165,6 @@ if __name__ == "__main__":
     print(time.time())
     run_at(time.time()+3, test_func, func_args=("Hello World!", 1, 2))
     run_at(time.time()+6, test_func, func_args=("Hello World!", 3, 4))
+    run_at(time.time()+4, test_func, func_args=("Cancelled", 5, 6)).cancel()
     time.sleep(10)
     terminate()
@@ -0,0 +1,222 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, TypeVar
+from urllib.parse import urlparse
+
+import requests
+
+from . import StoppableThread, log, network_get_session
+from .metrics import PROXY_HEALTHY, PROXY_LATENCY
+
+DEFAULT_PROBE_URL = "https://www.gstatic.com/generate_204"
+DEFAULT_PROBE_INTERVAL = 30 # seconds
+DEFAULT_PROBE_TIMEOUT = 5 # seconds
+DEFAULT_FAILURE_THRESHOLD = 2 # consecutive failures before a proxy is unhealthy
+MAX_FAILOVER = 3 # max proxies tried by one request
+LATENCY_SMOOTHING = 0.3 # weight of the latest probe in the average latency
+
+# the proxy could not be reached (or could not reach the target), another proxy may do better
+PROXY_ERRORS = (requests.exceptions.ProxyError, requests.exceptions.ConnectTimeout)
+
+T = TypeVar("T")
+
+@dataclass
+class Proxy:
+    """
+    A proxy of the pool and its health.
+
+    - `url`: The proxy URL
+    - `healthy`: False after `failure_threshold` consecutive failures, True again after a successful probe
+    - `latency`: The average probe latency in seconds, None until the first successful probe
+    - `failures`: The number of consecutive failures
+    """
+    url: str
+    healthy: bool = True
+    latency: float | None = None
+    failures: int = 0
+
+    @property
+    def proxies(self) -> dict:
+        return {"http": self.url, "https": self.url}
+
+    @property
+    def label(self) -> str:
+        # never show the credentials of the proxy URL
+        parsed = urlparse(self.url)
+        return f"{parsed.hostname}:{parsed.port}" if parsed.port else str(parsed.hostname)
+
+class ProxyPool:
+    """
+    Several proxies, the requests go through the fastest healthy one and
+    fail over to the next one when it can't be reached.
+
+    A background thread probes every proxy each `probe_interval` seconds
+    (a request to `probe_url` through it) to measure its latency and check
+    its health, the failures of the requests also count against a proxy.
+    """
+
+    def __init__(self,
+                 urls: list[str],
+                 probe_url: str = DEFAULT_PROBE_URL,
+                 probe_interval: float = DEFAULT_PROBE_INTERVAL,
+                 probe_timeout: float = DEFAULT_PROBE_TIMEOUT,
+                 failure_threshold: int = DEFAULT_FAILURE_THRESHOLD):
+        if not urls:
+            raise ValueError("'urls' must not be empty")
+        self.proxies = [Proxy(url) for url in urls]
+        self.probe_url = probe_url
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.failure_threshold = failure_threshold
+        self._lock = threading.Lock()
+        self._ranked = list(self.proxies)
+        self._executor: ThreadPoolExecutor | None = None
+        self._thread: StoppableThread | None = None
+        self._wakeup = threading.Event()
+
+    def start(self):
+        """
+        ### Description ###
+        Start probing the proxies in the background.
+        """
+        if self._thread is None:
+            self._executor = ThreadPoolExecutor(max_workers=len(self.proxies), thread_name_prefix="proxy-probe")
+            self._thread = StoppableThread(target=self._thread_main, daemon=True, name="proxy-pool")
+            self._thread.start()
+
+    def stop(self):
+        """
+        ### Description ###
+        Stop probing the proxies.
+        """
+        if self._thread is not None:
+            self._thread.stop()
+            self._wakeup.set()
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def candidates(self) -> list[Proxy]:
+        """
+        ### Description ###
+        Get the proxies in the order to try them: the healthy ones from
+        the fastest, then the unhealthy ones from the least failing.
+
+        ### Returns ###
+            - (list[Proxy]): The proxies
+        """
+        return self._ranked
+
+    def best(self) -> Proxy:
+        """
+        ### Description ###
+        Get the proxy to use now.
+
+        ### Returns ###
+            - (Proxy): The fastest healthy proxy, the least failing one if none is healthy
+        """
+        return self._ranked[0]
+
+    def call(self, func: Callable[[dict], T]) -> T:
+        """
+        ### Description ###
+        Run a request through the best proxy, and through the next ones
+        while the proxy can't be reached.
+
+        ### Parameters ###
+            - `func` (Callable): Send the request, `func(proxies)` where `proxies` is the `requests` proxies
+
+        ### Returns ###
+            - The return value of `func`
+
+        ### Raises ###
+            - The error of the last proxy tried if none of them could be reached
+        """
+        last_error = None
+        for proxy in self.candidates()[:MAX_FAILOVER]:
+            try:
+                result = func(proxy.proxies)
+            except PROXY_ERRORS as err:
+                last_error = err
+                self.report(proxy, False)
+                log.warning(f"Proxy <{proxy.label}> failed, reason: {err}")
+                continue
+            self.report(proxy, True)
+            return result
+        raise last_error
+
+    def report(self, proxy: Proxy, success: bool, latency: float | None = None):
+        """
+        ### Description ###
+        Record the result of a request or a probe through a proxy.
+
+        ### Parameters ###
+            - `proxy` (Proxy): The proxy
+            - `success` (bool): Whether the proxy could be reached
+            - `latency` (float | optional): The probe latency in seconds
+        """
+        with self._lock:
+            if success:
+                proxy.failures = 0
+                # only a probe proves an unhealthy proxy is back, a request may have gone through by chance
+                if latency is not None:
+                    proxy.healthy = True
+                    proxy.latency = latency if proxy.latency is None else (
+                        LATENCY_SMOOTHING * latency + (1 - LATENCY_SMOOTHING) * proxy.latency
+                    )
+            else:
+                proxy.failures += 1
+                if proxy.healthy and proxy.failures >= self.failure_threshold:
+                    proxy.healthy = False
+                    log.warning(f"Proxy <{proxy.label}> is unhealthy after {proxy.failures} failure(s).")
+            self._rank()
+        PROXY_HEALTHY.labels(proxy.label).set(1 if proxy.healthy else 0)
+        if proxy.latency is not None:
+            PROXY_LATENCY.labels(proxy.label).set(proxy.latency)
+
+    def _rank(self):
+        # must hold the lock, replaced at once so the readers never see a half sorted list
+        self._ranked = sorted(self.proxies, key=lambda proxy: (
+            not proxy.healthy,
+            proxy.failures if not proxy.healthy else 0,
+            float("inf") if proxy.latency is None else proxy.latency,
+        ))
+
+    def probe(self, proxy: Proxy) -> bool:
+        """
+        ### Description ###
+        Measure the latency of a proxy with a request to `probe_url`, any
+        HTTP response counts as a success.
+
+        ### Parameters ###
+            - `proxy` (Proxy): The proxy
+
+        ### Returns ###
+            - (bool): True if the proxy could be reached
+        """
+        start_time = time.perf_counter()
+        try:
+            network_get_session().head(self.probe_url, proxies=proxy.proxies, timeout=self.probe_timeout, allow_redirects=False)
+        except requests.exceptions.RequestException as err:
+            log.debug(f"Probe of proxy <{proxy.label}> failed, reason: {err}")
+            self.report(proxy, False)
+            return False
+        self.report(proxy, True, time.perf_counter() - start_time)
+        return True
+
+    def _thread_main(self):
+        thread = self._thread
+        while not thread.stopped():
+            executor = self._executor
+            if executor is None:
+                return
+            # probe them all at once, a dead proxy must not delay the others
+            try:
+                list(executor.map(self.probe, self.proxies))
+            except RuntimeError:
+                # stopped meanwhile
+                return
+            self._wakeup.wait(self.probe_interval)
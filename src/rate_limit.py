@@ -0,0 +1,77 @@
+import threading
+import time
+
+class TokenBucket:
+    """
+    Token bucket rate limiter, `rate` tokens are added per second up to
+    `capacity`, so short bursts of up to `capacity` requests are allowed
+    while the average stays at `rate` per second.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        if rate <= 0:
+            raise ValueError("'rate' must be greater than 0")
+        self.rate = rate
+        self.capacity = max(1.0, rate) if capacity is None else capacity
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        # must hold the lock
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self, tokens: float = 1) -> float:
+        """
+        ### Description ###
+        Get the time to wait until `tokens` tokens are available, without taking them.
+
+        ### Parameters ###
+            - `tokens` (float): The number of tokens
+
+        ### Returns ###
+            - (float): The delay in seconds, 0 if they are available now
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            return max(0.0, (tokens - self._tokens) / self.rate)
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """
+        ### Description ###
+        Take `tokens` tokens if they are available.
+
+        ### Parameters ###
+            - `tokens` (float): The number of tokens
+
+        ### Returns ###
+            - (bool): True if the tokens are taken
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens < tokens:
+                return False
+            self._tokens -= tokens
+            return True
+
+    def release(self, tokens: float = 1):
+        """
+        ### Description ###
+        Give back `tokens` tokens taken with `try_acquire` but not used.
+
+        ### Parameters ###
+            - `tokens` (float): The number of tokens
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.capacity, self._tokens + tokens)
+
+    def drain(self):
+        """
+        ### Description ###
+        Take all the tokens, eg. when the server says the limit is reached.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, 0.0)
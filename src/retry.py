@@ -0,0 +1,178 @@
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable
+
+from . import log, plan_to_run_run_at
+from .backoff import Backoff
+from .fan_out import DeliveryResult
+
+# the status codes worth retrying, the others will fail again the same way
+RETRYABLE_STATUS_CODES = frozenset((408, 425, 429, 500, 502, 503, 504))
+
+@dataclass
+class RetryPolicy:
+    """
+    How the failed deliveries of a target are retried.
+
+    - `max_attempts`: Max number of attempts, the first one included
+    - `backoff_base`: The max delay (seconds) before the first retry
+    - `backoff_cap`: The max delay (seconds) between two retries
+    - `jitter`: Whether the delays are picked at random up to the max delay
+    - `max_age`: Give up when the alert is older than this (seconds), a late order can be worse than none
+    """
+    max_attempts: int = 5
+    backoff_base: float = 1.0
+    backoff_cap: float = 60.0
+    jitter: bool = True
+    max_age: float = 300.0
+
+    @classmethod
+    def from_config(cls, values: dict, default: "RetryPolicy | None" = None) -> "RetryPolicy":
+        """
+        ### Description ###
+        Create a policy from a config table, the missing keys are taken from `default`.
+
+        ### Parameters ###
+            - `values` (dict): eg. {"max_attempts": 3, "max_age": 60}
+            - `default` (RetryPolicy | optional): The policy to take the missing keys from
+
+        ### Returns ###
+            - (RetryPolicy): The policy
+        """
+        default = default or cls()
+        return cls(
+            max_attempts=int(values.get("max_attempts", default.max_attempts)),
+            backoff_base=float(values.get("backoff_base", default.backoff_base)),
+            backoff_cap=float(values.get("backoff_cap", default.backoff_cap)),
+            jitter=bool(values.get("jitter", default.jitter)),
+            max_age=float(values.get("max_age", default.max_age)),
+        )
+
+    def is_retryable(self, result: DeliveryResult) -> bool:
+        """
+        ### Description ###
+        Check if a failed delivery is worth retrying, ie. network errors and
+        the temporary HTTP errors (timeout, rate limit, 5xx).
+
+        ### Parameters ###
+            - `result` (DeliveryResult): The failed delivery
+
+        ### Returns ###
+            - (bool): True if the delivery can be retried
+        """
+        if result.success or not result.retryable or self.max_attempts <= 1:
+            return False
+        return result.status_code is None or result.status_code in RETRYABLE_STATUS_CODES
+
+@dataclass
+class RetryEntry:
+    payload: str | dict
+    alert_id: str | None
+    created: float
+    attempts: int
+
+class RetryQueue:
+    """
+    The retries of one target. They are sent one at a time in the order they
+    failed, so a target that is down or rate limited gets one request per
+    delay instead of one per failed alert, and the other targets are never
+    sent the alert again.
+
+    The delay grows with the consecutive failures of the target (see
+    `Backoff`) and is reset by a success, a `Retry-After` given by the target
+    is used instead when there is one.
+    """
+
+    def __init__(self, target: str, send: Callable[[str | dict, str | None], DeliveryResult], policy: RetryPolicy,
+                 on_result: Callable[[RetryEntry, DeliveryResult, bool], None] | None = None):
+        """
+        ### Parameters ###
+            - `target` (str): The target name
+            - `send` (Callable): Send a payload to the target, `send(payload, alert_id)`
+            - `policy` (RetryPolicy): The retry policy of the target
+            - `on_result` (Callable | optional): Called after each retry with `(entry, result, final)`,
+              `final` is True when the entry will not be retried again
+        """
+        self.target = target
+        self.policy = policy
+        self._send = send
+        self._on_result = on_result
+        self._backoff = Backoff(policy.backoff_base, max(policy.backoff_base, policy.backoff_cap), jitter=policy.jitter)
+        self._entries: deque[RetryEntry] = deque()
+        self._lock = threading.Lock()
+        self._scheduled = False
+        self._not_before = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, payload: str | dict, alert_id: str | None, created: float, result: DeliveryResult) -> bool:
+        """
+        ### Description ###
+        Queue the retry of a failed first attempt.
+
+        ### Parameters ###
+            - `payload` (str | dict): The payload
+            - `alert_id` (str | optional): The outbox ID of the alert
+            - `created` (float): When the alert was first sent (timestamp)
+            - `result` (DeliveryResult): The failed delivery
+
+        ### Returns ###
+            - (bool): True if the retry is queued, False if the policy does not allow it
+        """
+        if not self.policy.is_retryable(result) or time.time() - created >= self.policy.max_age:
+            return False
+        with self._lock:
+            # the queued retries are already waiting for the target, only the first failure counts
+            if not self._entries or result.retry_after is not None:
+                self._delay(result.retry_after)
+            self._entries.append(RetryEntry(payload, alert_id, created, 1))
+            self._schedule()
+        return True
+
+    def _delay(self, retry_after: float | None):
+        # must hold the lock, only push the next attempt later, never earlier
+        delay = retry_after if retry_after is not None else self._backoff.next()
+        self._not_before = max(self._not_before, time.time() + delay)
+
+    def _schedule(self):
+        # must hold the lock, a single task runs the queue
+        if self._scheduled or not self._entries:
+            return
+        self._scheduled = True
+        plan_to_run_run_at(self._not_before, self._run)
+
+    def _run(self):
+        with self._lock:
+            entry = self._entries.popleft() if self._entries else None
+        if entry is None:
+            with self._lock:
+                self._scheduled = False
+            return
+        sent = time.time() - entry.created < self.policy.max_age
+        if sent:
+            entry.attempts += 1
+            try:
+                result = self._send(entry.payload, entry.alert_id)
+            except Exception as err:
+                result = DeliveryResult(self.target, False, error=str(err), retryable=isinstance(err, OSError))
+            final = result.success or entry.attempts >= self.policy.max_attempts or not self.policy.is_retryable(result)
+        else:
+            result = DeliveryResult(self.target, False, error=f"Gave up, the alert is older than {self.policy.max_age}s")
+            final = True
+        with self._lock:
+            if result.success:
+                self._backoff.reset()
+            elif sent:
+                self._delay(result.retry_after)
+                if not final:
+                    # keep the order, the next retry of the target is this one again
+                    self._entries.appendleft(entry)
+            self._scheduled = False
+            self._schedule()
+        if not result.success and final:
+            log.error(f"Delivery to {self.target} failed after {entry.attempts} attempt(s), reason: {result.error or result.status_code}")
+        if self._on_result is not None:
+            self._on_result(entry, result, final)
@@ -0,0 +1,223 @@
+import re
+from collections import defaultdict
+from dataclasses import dataclass
+
+from . import log
+
+# matched against the source of the alert (see `broadcast`), the other fields against its JSON content
+SOURCE_FIELDS = ("subject", "from", "source", "mailbox")
+UNMATCHED_POLICIES = ("all", "none")
+# backreferences and conditionals by group number, eg. (a)\1
+_NUMBERED_GROUP_REFERENCE = re.compile(r"\\[1-9]|\\g<\d|\(\?\(\d")
+
+@dataclass(frozen=True)
+class Route:
+    """
+    A routing rule, the alerts whose `field` matches go to `targets`.
+
+    - `field`: "subject", "from", "source" (eg. "email"), "mailbox", or a field of the JSON alert, eg. "ticker" or "strategy.name"
+    - `targets`: The target names, the webhook names (their URL if not named) and "telegram"
+    - `equals`: The values the field must be equal to
+    - `pattern`: A regular expression searched in the field, instead of `equals`
+    - `ignore_case`: Whether the case is ignored
+    - `name`: The rule name, for the logs
+    """
+    field: str
+    targets: tuple[str, ...]
+    equals: tuple[str, ...] = ()
+    pattern: str | None = None
+    ignore_case: bool = False
+    name: str = ""
+
+class _FieldMatcher:
+    """
+    The rules of one field: the exact values in a hash map, the patterns
+    in one regular expression, so a field is matched against all its
+    rules with one lookup and one search.
+    """
+
+    def __init__(self):
+        self.exact: dict[str, list[int]] = defaultdict(list)
+        self.exact_folded: dict[str, list[int]] = defaultdict(list)
+        self.patterns: list[tuple[int, str, int]] = []
+        self.regex: re.Pattern | None = None
+        self.fallback: list[tuple[int, re.Pattern]] = []
+
+    def compile(self):
+        combined = []
+        for index, pattern, flags in self.patterns:
+            if _NUMBERED_GROUP_REFERENCE.search(pattern):
+                # the group numbers are not the same in the combined expression
+                self.fallback.append((index, re.compile(pattern, flags)))
+            else:
+                combined.append((index, pattern, flags))
+        if not combined:
+            return
+        # an optional lookahead per rule, every rule gets its chance at the start of the text
+        # and the groups that matched give the rules
+        source = "".join(
+            f"(?:(?=(?s:.*?)(?P<r{index}>{f'(?i:{pattern})' if flags & re.IGNORECASE else pattern})))?"
+            for index, pattern, flags in combined
+        )
+        try:
+            self.regex = re.compile(source)
+        except re.error:
+            # eg. global flags or group names used twice, each pattern is searched on its own
+            self.fallback += [(index, re.compile(pattern, flags)) for index, pattern, flags in combined]
+
+    def match(self, value: str, matched: set[int]):
+        matched.update(self.exact.get(value, ()))
+        if self.exact_folded:
+            matched.update(self.exact_folded.get(value.casefold(), ()))
+        if self.regex is not None:
+            for group, text in self.regex.match(value).groupdict().items():
+                if text is not None:
+                    matched.add(int(group[1:]))
+        for index, regex in self.fallback:
+            if regex.search(value):
+                matched.add(index)
+
+class Router:
+    """
+    Select the targets of each alert with routing rules, compiled once
+    at startup: per field, a hash map of the exact values and one
+    regular expression of all the patterns.
+
+    An alert goes to the targets of all the rules it matches, the alerts
+    that match no rule go to every target, or to none.
+    """
+
+    def __init__(self, routes: list[Route], unmatched: str = "all"):
+        """
+        ### Parameters ###
+            - `routes` (list[Route]): The rules
+            - `unmatched` (str): Where the alerts that match no rule go, "all" or "none"
+
+        ### Raises ###
+            - ValueError: If a rule is invalid
+        """
+        if unmatched not in UNMATCHED_POLICIES:
+            raise ValueError(f"Unknown unmatched policy <{unmatched}>, expected one of {UNMATCHED_POLICIES}")
+        self.routes = routes
+        self.unmatched = unmatched
+        self._fields: dict[str, _FieldMatcher] = defaultdict(_FieldMatcher)
+        for index, route in enumerate(routes):
+            if bool(route.equals) == bool(route.pattern):
+                raise ValueError(f"Route <{route.name or index}> must set either 'equals' or 'pattern'")
+            matcher = self._fields[route.field]
+            if route.pattern:
+                flags = re.IGNORECASE if route.ignore_case else 0
+                try:
+                    re.compile(route.pattern, flags)
+                except re.error as err:
+                    raise ValueError(f"Route <{route.name or index}> has an invalid pattern, reason: {err}")
+                matcher.patterns.append((index, route.pattern, flags))
+            for value in route.equals:
+                if route.ignore_case:
+                    matcher.exact_folded[value.casefold()].append(index)
+                else:
+                    matcher.exact[value].append(index)
+        for matcher in self._fields.values():
+            matcher.compile()
+        self._fields = dict(self._fields)
+
+    @staticmethod
+    def _field_value(field: str, data, source: dict) -> str | None:
+        if field in SOURCE_FIELDS:
+            value = source.get(field)
+        else:
+            value = data
+            for key in field.split("."):
+                if not isinstance(value, dict):
+                    return None
+                value = value.get(key)
+        if value is None or isinstance(value, (dict, list)):
+            return None
+        return str(value)
+
+    def match(self, data, source: dict | None = None) -> list[Route]:
+        """
+        ### Description ###
+        Get the rules an alert matches.
+
+        ### Parameters ###
+            - `data`: The decoded content of the alert (eg. `Payload.data`)
+            - `source` (dict | optional): Where the alert comes from, eg. "subject" and "from"
+
+        ### Returns ###
+            - (list[Route]): The rules, in the config order
+        """
+        source = source or {}
+        matched: set[int] = set()
+        for field, matcher in self._fields.items():
+            value = self._field_value(field, data, source)
+            if value is not None:
+                matcher.match(value, matched)
+        return [self.routes[index] for index in sorted(matched)]
+
+    def select(self, targets: list[str], data, source: dict | None = None) -> list[str]:
+        """
+        ### Description ###
+        Get the targets an alert goes to.
+
+        ### Parameters ###
+            - `targets` (list[str]): The available target names
+            - `data`: The decoded content of the alert (eg. `Payload.data`)
+            - `source` (dict | optional): Where the alert comes from, eg. "subject" and "from"
+
+        ### Returns ###
+            - (list[str]): The targets, in the order of `targets`
+        """
+        routes = self.match(data, source)
+        if not routes:
+            return list(targets) if self.unmatched == "all" else []
+        selected = {target for route in routes for target in route.targets}
+        return [target for target in targets if target in selected]
+
+def build_router(config: dict, known_targets: list[str]) -> Router | None:
+    """
+    ### Description ###
+    Create the router of the `routes` tables of the config, each can set
+    `name`, `field`, `equals` (a value or a list), `pattern`, `ignore_case`
+    and `targets`. The invalid rules are logged and skipped.
+
+    ### Parameters ###
+        - `config` (dict): The config
+        - `known_targets` (list[str]): The configured target names, the unknown ones are logged
+
+    ### Returns ###
+        - (Router | None): The router, None if there is no rule
+    """
+    routes = []
+    known = set(known_targets)
+    for index, entry in enumerate(config.get("routes", [])):
+        name = entry.get("name") or str(index)
+        equals = entry.get("equals", [])
+        targets = entry.get("targets") or []
+        if not entry.get("field") or not isinstance(targets, list):
+            log.error(f"Route <{name}> is skipped, reason: 'field' and 'targets' are required")
+            continue
+        route = Route(
+            field=entry["field"],
+            targets=tuple(targets),
+            equals=tuple(str(value) for value in (equals if isinstance(equals, list) else [equals])),
+            pattern=entry.get("pattern") or None,
+            ignore_case=bool(entry.get("ignore_case", False)),
+            name=name,
+        )
+        try:
+            # validated on its own, one bad rule must not disable the others
+            Router([route])
+        except ValueError as err:
+            log.error(f"{err}, SKIP.")
+            continue
+        for target in set(targets) - known:
+            log.warning(f"Route <{name}> has an unknown target <{target}>.")
+        routes.append(route)
+    if not routes:
+        return None
+    unmatched = config.get("routes_unmatched", "all")
+    if unmatched not in UNMATCHED_POLICIES:
+        log.error(f"Unknown 'routes_unmatched' <{unmatched}>, expected one of {UNMATCHED_POLICIES}, \"all\" is used.")
+        unmatched = "all"
+    return Router(routes, unmatched)
@@ -0,0 +1,41 @@
+import time
+
+# imported first by `src`, the time spent by the interpreter itself is not counted
+_started = time.perf_counter()
+_stages: list[tuple[str, float]] = []
+
+def mark(stage: str):
+    """
+    ### Description ###
+    Record the end of a startup stage, the stage lasted since the previous mark.
+
+    ### Parameters ###
+        - `stage` (str): The stage name, eg. "imports"
+    """
+    _stages.append((stage, time.perf_counter()))
+
+def elapsed() -> float:
+    """
+    ### Description ###
+    Get the time since the startup began.
+
+    ### Returns ###
+        - (float): The time in seconds
+    """
+    return time.perf_counter() - _started
+
+def report() -> str:
+    """
+    ### Description ###
+    Get the duration of each startup stage, run `python -X importtime main.py`
+    to see the imports in detail.
+
+    ### Returns ###
+        - (str): eg. "Started in 212.5 ms (imports 120.3 ms, config 2.1 ms, ...)"
+    """
+    previous = _started
+    durations = []
+    for stage, at in _stages:
+        durations.append(f"{stage} {(at - previous) * 1000:.1f} ms")
+        previous = at
+    return f"Started in {elapsed() * 1000:.1f} ms ({', '.join(durations)})"
@@ -0,0 +1,286 @@
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable
+
+from . import StoppableThread, log
+from .backoff import Backoff
+from .fan_out import DeliveryResult
+from .rate_limit import TokenBucket
+from .retry import RetryPolicy
+
+# https://core.telegram.org/bots/api#sendmessage
+MAX_MESSAGE_LENGTH = 4096
+# https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this
+DEFAULT_CHAT_RATE = 1.0 # messages per second and chat
+DEFAULT_CHAT_BURST = 3
+DEFAULT_GLOBAL_RATE = 30.0 # messages per second, all chats together
+DEFAULT_MAX_QUEUE = 1000
+MAX_DIGEST_ALERTS = 50
+TARGET_NAME = "telegram"
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> list[str]:
+    """
+    ### Description ###
+    Split a text into messages of at most `limit` characters, at line
+    breaks when possible.
+
+    ### Parameters ###
+        - `text` (str): The text
+        - `limit` (int): The max length of a message
+
+    ### Returns ###
+        - (list[str]): The messages
+    """
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit + 1)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        # the line break the text is split at is not sent
+        text = text[cut + 1:] if text[cut] == "\n" else text[cut:]
+    chunks.append(text)
+    return chunks
+
+def format_digest(texts: list[str]) -> str:
+    """
+    ### Description ###
+    Combine the texts of several alerts into one message.
+
+    ### Parameters ###
+        - `texts` (list[str]): The texts, oldest first
+
+    ### Returns ###
+        - (str): The message
+    """
+    return f"{len(texts)} alerts:\n\n" + "\n\n".join(texts)
+
+@dataclass
+class _Alert:
+    text: str
+    alert_id: str | None
+    created: float
+
+@dataclass
+class _Outgoing:
+    alerts: list[_Alert]
+    chunks: list[str]
+    index: int = 0
+    attempts: int = 0
+
+@dataclass
+class _Chat:
+    bucket: TokenBucket
+    backoff: Backoff
+    waiting: deque = field(default_factory=deque)
+    current: _Outgoing | None = None
+    not_before: float = 0.0
+
+class TelegramSender:
+    """
+    Send the Telegram messages from a dedicated thread, so they never hold up
+    the webhook deliveries.
+
+    Each chat has a token bucket (Telegram allows about one message per
+    second per chat) and all chats share a global one. The long messages are
+    split, the failed ones are retried according to the `RetryPolicy`
+    (`retry_after` given by Telegram included). When `digest_threshold`
+    alerts or more are waiting for a chat, they are sent together in one
+    digest message instead of one message each.
+    """
+
+    def __init__(self,
+                 send: Callable[[str, str], DeliveryResult],
+                 policy: RetryPolicy,
+                 chat_rate: float = DEFAULT_CHAT_RATE,
+                 chat_burst: float = DEFAULT_CHAT_BURST,
+                 global_rate: float = DEFAULT_GLOBAL_RATE,
+                 max_queue: int = DEFAULT_MAX_QUEUE,
+                 digest_threshold: int = 0,
+                 on_result: Callable[[list[str | None], DeliveryResult], None] | None = None):
+        """
+        ### Parameters ###
+            - `send` (Callable): Send one message, `send(chat_id, text)`
+            - `policy` (RetryPolicy): The retry policy of the failed messages
+            - `chat_rate` (float): Max messages per second and chat
+            - `chat_burst` (float): Max messages sent at once to a chat
+            - `global_rate` (float): Max messages per second, all chats together
+            - `max_queue` (int): Max number of alerts waiting, all chats together
+            - `digest_threshold` (int): Send the waiting alerts in one message when there are this many, 0 to disable
+            - `on_result` (Callable | optional): Called when the alerts of a message are done, `on_result(alert_ids, result)`
+        """
+        self._send = send
+        self.policy = policy
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_queue = max_queue
+        self.digest_threshold = digest_threshold
+        self._on_result = on_result
+        self.global_rate = global_rate
+        self._bucket_factory: Callable[[str, float, float | None], TokenBucket] = lambda name, rate, capacity: TokenBucket(rate, capacity)
+        self._global_bucket = TokenBucket(global_rate)
+        self._chats: dict[str, _Chat] = {}
+        self._pending = 0
+        self._condition = threading.Condition()
+        self._thread: StoppableThread | None = None
+
+    def set_bucket_factory(self, factory: Callable[[str, float, float | None], TokenBucket]):
+        """
+        ### Description ###
+        Get the rate limits from somewhere else, eg. shared by several
+        processes. Must be called before the first alert is submitted.
+
+        ### Parameters ###
+            - `factory` (Callable): Get a token bucket, `factory(name, rate, capacity)`,
+              the name is "telegram" for the global limit and "telegram:<chat_id>" for a chat
+        """
+        with self._condition:
+            self._bucket_factory = factory
+            self._global_bucket = factory(TARGET_NAME, self.global_rate, None)
+
+    def pending(self) -> int:
+        """
+        ### Description ###
+        Get the number of alerts waiting to be sent.
+
+        ### Returns ###
+            - (int): The number of alerts
+        """
+        return self._pending
+
+    def submit(self, chat_id: str, text: str, alert_id: str | None = None, created: float | None = None) -> bool:
+        """
+        ### Description ###
+        Queue an alert to be sent to a chat, returns at once.
+
+        ### Parameters ###
+            - `chat_id` (str): The chat ID
+            - `text` (str): The text, split if too long
+            - `alert_id` (str | optional): The outbox ID of the alert
+            - `created` (float | optional): When the alert was received (timestamp), now if not specified
+
+        ### Returns ###
+            - (bool): True if queued, False if the queue is full
+        """
+        with self._condition:
+            if self._pending >= self.max_queue:
+                return False
+            chat = self._chats.get(chat_id)
+            if chat is None:
+                chat = self._chats[chat_id] = _Chat(
+                    self._bucket_factory(f"{TARGET_NAME}:{chat_id}", self.chat_rate, self.chat_burst),
+                    Backoff(self.policy.backoff_base, max(self.policy.backoff_base, self.policy.backoff_cap), jitter=self.policy.jitter)
+                )
+            chat.waiting.append(_Alert(text, alert_id, time.time() if created is None else created))
+            self._pending += 1
+            self._ensure_thread()
+            self._condition.notify()
+        return True
+
+    def stop(self):
+        """
+        ### Description ###
+        Stop the sender thread, the waiting alerts are not sent.
+        """
+        with self._condition:
+            if self._thread is not None:
+                self._thread.stop()
+                self._thread = None
+            self._condition.notify_all()
+
+    def _ensure_thread(self):
+        # must hold the lock
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = StoppableThread(target=self._thread_main, daemon=True, name="telegram-sender")
+            self._thread.start()
+
+    def _next_chat(self) -> tuple[str | None, float | None]:
+        # must hold the lock, get a chat that can be sent to now, or the time to wait for one
+        now = time.time()
+        wait = None
+        for chat_id, chat in self._chats.items():
+            if chat.current is None and not chat.waiting:
+                continue
+            delay = max(chat.not_before - now, chat.bucket.delay(), self._global_bucket.delay())
+            if delay <= 0 and self._global_bucket.try_acquire():
+                if chat.bucket.try_acquire():
+                    # the chat sent to goes last, the others are not starved by a busy one
+                    self._chats[chat_id] = self._chats.pop(chat_id)
+                    return chat_id, None
+                # eg. taken by another process sharing the chat limit
+                self._global_bucket.release()
+            wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    def _thread_main(self):
+        thread = self._thread
+        while not thread.stopped():
+            with self._condition:
+                chat_id, wait = self._next_chat()
+                if chat_id is None:
+                    self._condition.wait(wait if wait is None else max(wait, 0.001))
+                    continue
+                outgoing = self._take(self._chats[chat_id])
+            if outgoing is not None:
+                self._send_chunk(chat_id, self._chats[chat_id], outgoing)
+
+    def _take(self, chat: _Chat) -> _Outgoing | None:
+        # must hold the lock, the message being sent, or the next one from the waiting alerts
+        if chat.current is not None:
+            return chat.current
+        alerts = []
+        while chat.waiting and len(alerts) < MAX_DIGEST_ALERTS:
+            alert = chat.waiting.popleft()
+            if time.time() - alert.created >= self.policy.max_age:
+                self._pending -= 1
+                self._done([alert], DeliveryResult(TARGET_NAME, False, error=f"Gave up, the alert is older than {self.policy.max_age}s"))
+                continue
+            alerts.append(alert)
+            # one message per alert, unless they pile up
+            if not self.digest_threshold or len(chat.waiting) + len(alerts) < self.digest_threshold:
+                break
+        if not alerts:
+            return None
+        text = alerts[0].text if len(alerts) == 1 else format_digest([alert.text for alert in alerts])
+        chat.current = _Outgoing(alerts, split_message(text))
+        return chat.current
+
+    def _send_chunk(self, chat_id: str, chat: _Chat, outgoing: _Outgoing):
+        start_time = time.perf_counter()
+        try:
+            result = self._send(chat_id, outgoing.chunks[outgoing.index])
+        except Exception as err:
+            result = DeliveryResult(TARGET_NAME, False, error=str(err), retryable=isinstance(err, OSError))
+        result.elapsed = time.perf_counter() - start_time
+
+        with self._condition:
+            final = True
+            if result.success:
+                chat.backoff.reset()
+                outgoing.index += 1
+                outgoing.attempts = 0
+                final = outgoing.index == len(outgoing.chunks)
+            else:
+                outgoing.attempts += 1
+                if result.status_code == 429:
+                    chat.bucket.drain()
+                oldest = min(alert.created for alert in outgoing.alerts)
+                if (self.policy.is_retryable(result) and outgoing.attempts < self.policy.max_attempts
+                        and time.time() - oldest < self.policy.max_age):
+                    final = False
+                    delay = result.retry_after if result.retry_after is not None else chat.backoff.next()
+                    chat.not_before = time.time() + delay
+                    log.warning(f"Telegram message to chat {chat_id} failed, reason: {result.error or result.status_code}, retry after {round(delay, 1)}s...")
+            if final:
+                chat.current = None
+                self._pending -= len(outgoing.alerts)
+        if final:
+            if not result.success:
+                log.error(f"Telegram message to chat {chat_id} failed after {outgoing.attempts} attempt(s), reason: {result.error or result.status_code}")
+            self._done(outgoing.alerts, result)
+
+    def _done(self, alerts: list[_Alert], result: DeliveryResult):
+        if self._on_result is not None:
+            self._on_result([alert.alert_id for alert in alerts], result)
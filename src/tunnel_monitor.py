@@ -0,0 +1,172 @@
+import threading
+import time
+from typing import Callable
+
+import requests
+
+from . import StoppableThread, log
+from .backoff import Backoff
+from .metrics import TUNNEL_HEALTHY, TUNNEL_RTT, TUNNEL_RECONNECTS
+
+DEFAULT_INTERVAL = 30 # seconds between two probes
+DEFAULT_TIMEOUT = 10 # seconds
+DEFAULT_FAILURE_THRESHOLD = 3 # consecutive failed probes before the tunnel is re-created
+REOPEN_BACKOFF_BASE = 1 # seconds before trying again to open the tunnel, doubles after every failure
+REOPEN_BACKOFF_CAP = 60 # seconds
+PING_PATH = "/ping"
+
+class TunnelMonitor:
+    """
+    Keep a public tunnel (eg. ngrok) to the API server working.
+
+    A background thread requests `/ping` of the API server through the
+    public URL every `interval` seconds and records the round-trip time.
+    After `failure_threshold` consecutive failures the tunnel is closed
+    and opened again, until it works.
+    """
+
+    def __init__(self,
+                 open_tunnel: Callable[[], str],
+                 close_tunnel: Callable[[str], None],
+                 api_key: str | None = None,
+                 interval: float = DEFAULT_INTERVAL,
+                 timeout: float = DEFAULT_TIMEOUT,
+                 failure_threshold: int = DEFAULT_FAILURE_THRESHOLD):
+        """
+        ### Parameters ###
+            - `open_tunnel` (Callable): Open the tunnel and get its public URL
+            - `close_tunnel` (Callable): Close the tunnel of a public URL
+            - `api_key` (str | optional): The API key, the probes expect 204 with it and any answer of the API server without it
+            - `interval` (float): Seconds between two probes
+            - `timeout` (float): Seconds to wait for the answer of a probe
+            - `failure_threshold` (int): Consecutive failed probes before the tunnel is re-created
+        """
+        if interval <= 0:
+            raise ValueError("'interval' must be greater than 0")
+        if failure_threshold <= 0:
+            raise ValueError("'failure_threshold' must be greater than 0")
+        self._open_tunnel = open_tunnel
+        self._close_tunnel = close_tunnel
+        self.api_key = api_key
+        self.interval = interval
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.public_url: str | None = None
+        self.healthy = False
+        self.rtt: float | None = None
+        self.failures = 0
+        self.reconnects = 0
+        self._thread: StoppableThread | None = None
+        self._wakeup = threading.Event()
+        # not the shared session, its retries would hide the failures and skew the RTT
+        self._session = requests.Session()
+
+    def open(self) -> str:
+        """
+        ### Description ###
+        Open the tunnel.
+
+        ### Returns ###
+            - (str): The public URL
+        """
+        self.public_url = self._open_tunnel()
+        self.healthy = True
+        self.failures = 0
+        TUNNEL_HEALTHY.set(1)
+        return self.public_url
+
+    def start(self):
+        """
+        ### Description ###
+        Start probing the tunnel in the background, it must be open.
+        """
+        if self._thread is None:
+            self._thread = StoppableThread(target=self._thread_main, daemon=True, name="tunnel-monitor")
+            self._thread.start()
+
+    def stop(self):
+        """
+        ### Description ###
+        Stop probing the tunnel, it stays open.
+        """
+        if self._thread is not None:
+            self._thread.stop()
+            self._wakeup.set()
+            self._thread = None
+
+    def probe(self) -> bool:
+        """
+        ### Description ###
+        Request `/ping` of the API server through the tunnel.
+
+        ### Returns ###
+            - (bool): True if the API server answered
+        """
+        params = {"auth": self.api_key} if self.api_key else None
+        start_time = time.perf_counter()
+        try:
+            response = self._session.get(
+                self.public_url.rstrip("/") + PING_PATH, params=params, timeout=self.timeout,
+                headers={"ngrok-skip-browser-warning": "1"}, allow_redirects=False,
+            )
+        except requests.exceptions.RequestException as err:
+            log.debug(f"Tunnel probe failed, reason: {err}")
+            return self._report(False)
+        # without the key the API server answers 403, the errors of the tunnel itself are 4xx/5xx too
+        if response.status_code != 204 and (self.api_key or response.status_code != 403):
+            log.debug(f"Tunnel probe failed, status: {response.status_code}")
+            return self._report(False)
+        return self._report(True, time.perf_counter() - start_time)
+
+    def _report(self, success: bool, rtt: float | None = None) -> bool:
+        if success:
+            if not self.healthy:
+                log.ok("The tunnel is healthy again.")
+            self.healthy = True
+            self.failures = 0
+            self.rtt = rtt
+            TUNNEL_RTT.set(rtt)
+        else:
+            self.failures += 1
+            if self.healthy and self.failures >= self.failure_threshold:
+                self.healthy = False
+                log.warning(f"The tunnel is unhealthy after {self.failures} failed probe(s).")
+        TUNNEL_HEALTHY.set(1 if self.healthy else 0)
+        return success
+
+    def reopen(self):
+        """
+        ### Description ###
+        Close the tunnel and open it again, until it works.
+        """
+        backoff = Backoff(REOPEN_BACKOFF_BASE, REOPEN_BACKOFF_CAP)
+        previous_url = self.public_url
+        try:
+            self._close_tunnel(previous_url)
+        except Exception as err:
+            log.debug(f"Failed to close the tunnel, reason: {err}")
+        while self._thread is not None and not self._thread.stopped():
+            try:
+                self.open()
+                break
+            except Exception as err:
+                delay = backoff.next()
+                log.error(f"Failed to open the tunnel, retrying in {delay:.1f}s, reason: {err}")
+                self._wakeup.wait(delay)
+        else:
+            return
+        self.reconnects += 1
+        TUNNEL_RECONNECTS.inc()
+        if self.public_url != previous_url:
+            log.warning(f"The tunnel is re-created with a new URL, update the forwarders: {self.public_url}")
+        else:
+            log.ok(f"The tunnel is re-created: {self.public_url}")
+
+    def _thread_main(self):
+        thread = self._thread
+        while not thread.stopped():
+            self._wakeup.wait(self.interval)
+            if thread.stopped():
+                return
+            if not self.probe() and self.failures >= self.failure_threshold:
+                self.reopen()
@@ -0,0 +1,4 @@
+import os
+
+# `src` loads the config when it is imported, the tests use the example one
+os.environ.setdefault("TVWA_CONFIG", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config.example.toml"))
@@ -0,0 +1,94 @@
+import asyncio
+import itertools
+import threading
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from src import api_server, event
+from src.event import Backpressure
+
+API_KEY = "test-api-key"
+_names = itertools.count()
+
+class Receiver:
+    """
+    The subscriber of the received alerts, waits for `release` before handling them.
+    """
+
+    def __init__(self):
+        self.received = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, data):
+        self.release.wait(5)
+        self.received.append(data)
+
+@pytest.fixture
+def receiver(monkeypatch):
+    name = f"test-receive-{next(_names)}"
+    receiver = Receiver()
+    event.subscribe(name, receiver, asynchronous=True, queue_size=api_server.MAX_QUEUE_SIZE, policy=Backpressure.REJECT)
+    monkeypatch.setattr(api_server, "api_key", API_KEY)
+    monkeypatch.setattr(api_server, "event_id_receive", name)
+    yield receiver
+    receiver.release.set()
+    event.unsubscribe(name, receiver)
+
+def request(method: str, path: str, **kwargs):
+    async def send():
+        async with TestClient(TestServer(api_server.create_app())) as client:
+            response = await client.request(method, path, **kwargs)
+            return response.status, response.headers, await response.text()
+    return asyncio.run(send())
+
+@pytest.mark.parametrize("headers", [{}, {"X-API-KEY": ""}, {"X-API-KEY": "wrong"}, {"X-API-KEY": API_KEY + "x"}])
+def test_api_key_is_required(receiver, headers):
+    status, _, _ = request("POST", "/api", json={"action": "buy"}, headers=headers)
+    assert status == 403
+    assert request("GET", "/ping", params={"auth": headers.get("X-API-KEY", "")})[0] == 403
+    assert request("GET", "/metrics", headers=headers)[0] == 403
+    assert receiver.received == []
+
+def test_api(receiver):
+    status, _, _ = request("POST", "/api", json={"action": "buy"}, headers={"X-API-KEY": API_KEY})
+    assert status == 204
+    assert event.join(api_server.event_id_receive, 5)
+    assert receiver.received == [{"action": "buy"}]
+    assert request("GET", "/ping", params={"auth": API_KEY})[0] == 204
+
+def test_invalid_json(receiver):
+    status, _, _ = request("POST", "/api", data="{", headers={"X-API-KEY": API_KEY})
+    assert status == 400
+
+def test_batch(receiver):
+    status, _, _ = request("POST", "/api/batch", json=[{"index": index} for index in range(3)], headers={"X-API-KEY": API_KEY})
+    assert status == 204
+    assert event.join(api_server.event_id_receive, 5)
+    assert receiver.received == [{"index": index} for index in range(3)]
+
+@pytest.mark.parametrize("body", ['{"action": "buy"}', '"buy"', "1", "null"])
+def test_batch_must_be_a_list(receiver, body):
+    status, _, text = request("POST", "/api/batch", data=body, headers={"X-API-KEY": API_KEY})
+    assert status == 400
+    assert text == "Expected a JSON list"
+
+def test_batch_size_is_limited(receiver):
+    body = [{"index": index} for index in range(api_server.MAX_BATCH_SIZE + 1)]
+    status, _, _ = request("POST", "/api/batch", json=body, headers={"X-API-KEY": API_KEY})
+    assert status == 413
+    assert receiver.received == []
+    assert request("POST", "/api/batch", json=body[:-1], headers={"X-API-KEY": API_KEY})[0] == 204
+
+def test_busy_when_the_queue_is_full(receiver, monkeypatch):
+    monkeypatch.setattr(api_server, "MAX_QUEUE_SIZE", 2)
+    receiver.release.clear()
+    headers = {"X-API-KEY": API_KEY}
+    assert request("POST", "/api/batch", json=[1, 2], headers=headers)[0] == 204
+    # queued or being handled, the queue is full either way
+    status, response_headers, _ = request("POST", "/api/batch", json=[3, 4], headers=headers)
+    assert (status, response_headers.get("Retry-After")) == (503, "1")
+    receiver.release.set()
+    assert event.join(api_server.event_id_receive, 5)
+    assert receiver.received == [1, 2]
@@ -0,0 +1,53 @@
+import datetime
+import os
+
+from src.email_listener.archive import AlertArchive, iter_archive
+
+def names(directory) -> list[str]:
+    return sorted(os.listdir(directory))
+
+def test_records_are_read_back(tmp_path):
+    archive = AlertArchive(str(tmp_path), flush_interval=0.01)
+    archive.write({"subject": "Alert: BTCUSD", "date": datetime.datetime(2024, 1, 2, 3, 4, 5)})
+    archive.write({"subject": "Alert: ETHUSD"})
+    assert archive.flush(5)
+    archive.close()
+    assert list(iter_archive(str(tmp_path))) == [
+        {"subject": "Alert: BTCUSD", "date": "2024-01-02 03:04:05"},
+        {"subject": "Alert: ETHUSD"},
+    ]
+
+def test_rotated_files_are_compressed_and_read_in_order(tmp_path):
+    archive = AlertArchive(str(tmp_path), max_bytes=100, flush_interval=0.01, batch_size=1)
+    for index in range(10):
+        archive.write({"index": index, "padding": "x" * 40})
+        # one batch per record, the file is rotated before the next one
+        assert archive.flush(5)
+    archive.close()
+    files = names(tmp_path)
+    assert len([name for name in files if name.endswith(".jsonl.gz")]) >= 4
+    assert not [name for name in files if name.endswith(".tmp")]
+    assert [record["index"] for record in iter_archive(str(tmp_path))] == list(range(10))
+
+def test_archives_of_other_names_are_kept_apart(tmp_path):
+    main = AlertArchive(str(tmp_path), max_bytes=1, flush_interval=0.01, batch_size=1)
+    worker = AlertArchive(str(tmp_path), name="alerts-worker-0", flush_interval=0.01)
+    for index in range(3):
+        main.write({"archive": "main", "index": index})
+        assert main.flush(5)
+    worker.write({"archive": "worker"})
+    assert worker.flush(5)
+    main.close()
+    # a new archive must not take the live file of the worker for one of its own rotated files
+    AlertArchive(str(tmp_path)).close()
+    worker.close()
+    assert "alerts-worker-0.jsonl" in names(tmp_path)
+    assert {record["archive"] for record in iter_archive(str(tmp_path))} == {"main"}
+    assert list(iter_archive(str(tmp_path), name="alerts-worker-0")) == [{"archive": "worker"}]
+
+def test_files_rotated_by_a_previous_run_are_compressed(tmp_path):
+    left = tmp_path / "alerts-20240102-030405-000001.jsonl"
+    left.write_text('{"index": 0}\n', encoding="utf-8")
+    AlertArchive(str(tmp_path)).close()
+    assert names(tmp_path) == ["alerts-20240102-030405-000001.jsonl.gz"]
+    assert list(iter_archive(str(tmp_path))) == [{"index": 0}]
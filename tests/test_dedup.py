@@ -0,0 +1,66 @@
+import pytest
+
+from src import dedup
+from src.dedup import Deduplicator, content_key
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_700_000_000.0]
+    monkeypatch.setattr(dedup.time, "time", lambda: now[0])
+    return now
+
+def test_check_and_add():
+    deduplicator = Deduplicator()
+    assert deduplicator.check_and_add("uid:1", "mid:a")
+    assert not deduplicator.check_and_add("uid:1")
+    # any known key makes the alert a duplicate, and the new keys are not added then
+    assert not deduplicator.check_and_add("uid:2", "mid:a")
+    assert not deduplicator.seen("uid:2")
+    # the empty keys are ignored
+    assert deduplicator.check_and_add("uid:3", "")
+    assert deduplicator.check_and_add("uid:4", "")
+    assert len(deduplicator) == 4
+
+def test_ttl(clock):
+    deduplicator = Deduplicator(ttl=60)
+    assert deduplicator.check_and_add("uid:1")
+    clock[0] += 59
+    assert deduplicator.seen("uid:1")
+    clock[0] += 2
+    assert not deduplicator.seen("uid:1")
+    assert deduplicator.check_and_add("uid:1")
+
+def test_max_entries_evicts_the_oldest():
+    deduplicator = Deduplicator(max_entries=2)
+    for key in ("a", "b", "c"):
+        assert deduplicator.check_and_add(key)
+    assert not deduplicator.seen("a")
+    assert deduplicator.seen("b") and deduplicator.seen("c")
+
+def test_keys_survive_a_restart(tmp_path, clock):
+    path = str(tmp_path / "dedup.log")
+    deduplicator = Deduplicator(path, ttl=60)
+    assert deduplicator.check_and_add("uid:1", "mid:a")
+    deduplicator.close()
+
+    assert not Deduplicator(path, ttl=60).check_and_add("mid:a")
+    clock[0] += 120
+    assert Deduplicator(path, ttl=60).check_and_add("mid:a")
+
+def test_file_is_compacted(tmp_path, monkeypatch):
+    monkeypatch.setattr(dedup, "COMPACT_MIN_LINES", 10)
+    path = tmp_path / "dedup.log"
+    deduplicator = Deduplicator(str(path), max_entries=5)
+    for index in range(50):
+        assert deduplicator.check_and_add(f"uid:{index}")
+    deduplicator.close()
+    assert len(path.read_text().splitlines()) <= 10
+
+    reloaded = Deduplicator(str(path), max_entries=5)
+    assert reloaded.seen("uid:49")
+    assert not reloaded.seen("uid:40")
+
+def test_content_key():
+    assert content_key("a", "subject", "body") == content_key("a", "subject", "body")
+    assert content_key("ab", "c") != content_key("a", "bc")
+    assert content_key("a", None).startswith("hash:")
@@ -0,0 +1,40 @@
+import pytest
+
+from src.email_listener import EmailListener
+
+class Stop(Exception):
+    pass
+
+class StubServer:
+    """Answers idle_check at once with nothing, like a connection at EOF."""
+
+    def __init__(self, idle_done_responses):
+        self.idle_done_responses = idle_done_responses
+        self.checks = 0
+
+    def idle(self):
+        pass
+
+    def idle_check(self, timeout):
+        self.checks += 1
+        if self.checks > 1:
+            raise Stop()
+        return []
+
+    def idle_done(self):
+        return b"IDLE terminated", self.idle_done_responses
+
+def idle(idle_done_responses):
+    el = EmailListener("test@example.com", "password")
+    el.server = StubServer(idle_done_responses)
+    scraped = []
+    el.scrape = lambda **kwargs: {"1": "email"}
+    with pytest.raises(Stop):
+        el._EmailListener__idle(timeout=30, process_func=lambda el, msgs: scraped.append(msgs))
+    return scraped
+
+def test_idle_scrapes_the_emails_reported_by_idle_done():
+    assert idle([(3, b"EXISTS")]) == [{"1": "email"}]
+
+def test_idle_ignores_the_other_responses_of_idle_done():
+    assert idle([(3, b"FETCH", (b"FLAGS", (b"\\Seen",)))]) == []
@@ -0,0 +1,150 @@
+import itertools
+import threading
+
+import pytest
+
+from src import event
+from src.event import Backpressure
+
+_names = itertools.count()
+
+@pytest.fixture
+def event_name():
+    name = f"test-event-{next(_names)}"
+    yield name
+    for subscriber in list(event.subscribers.pop(name, [])):
+        if isinstance(subscriber, event._AsyncSubscriber):
+            subscriber.stop()
+
+class Blocked:
+    """
+    A subscriber that waits for `release` before handling the data.
+    """
+
+    def __init__(self):
+        self.received = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, data):
+        self.started.set()
+        self.release.wait(5)
+        self.received.append(data)
+
+def test_synchronous_subscriber(event_name):
+    received = []
+    event.subscribe(event_name, received.append)
+    assert event.post_event(event_name, 1)
+    assert received == [1]
+    event.unsubscribe(event_name, received.append)
+    event.post_event(event_name, 2)
+    assert received == [1]
+
+def test_asynchronous_subscriber_keeps_the_order(event_name):
+    received = []
+    event.subscribe(event_name, received.append, asynchronous=True)
+    for index in range(100):
+        assert event.post_event(event_name, index)
+    assert event.join(event_name, 5)
+    assert received == list(range(100))
+    assert event.queue_depth(event_name) == 0
+
+def test_reject_policy(event_name):
+    handler = Blocked()
+    event.subscribe(event_name, handler, asynchronous=True, queue_size=2, policy=Backpressure.REJECT)
+    assert event.post_event(event_name, 0)
+    assert handler.started.wait(5)
+    # the first one is being handled, two fit in the queue
+    assert event.post_event(event_name, 1) and event.post_event(event_name, 2)
+    assert not event.post_event(event_name, 3)
+    assert event.queue_depth(event_name) == 2
+    handler.release.set()
+    assert event.join(event_name, 5)
+    assert handler.received == [0, 1, 2]
+
+def test_drop_oldest_policy(event_name):
+    handler = Blocked()
+    event.subscribe(event_name, handler, asynchronous=True, queue_size=2, policy=Backpressure.DROP_OLDEST)
+    event.post_event(event_name, 0)
+    assert handler.started.wait(5)
+    for index in range(1, 5):
+        assert event.post_event(event_name, index)
+    handler.release.set()
+    assert event.join(event_name, 5)
+    assert handler.received == [0, 3, 4]
+    stats = [item for item in event.stats() if item.event_name == event_name][0]
+    assert (stats.processed, stats.dropped) == (3, 2)
+
+def test_block_policy_waits_for_a_free_slot(event_name):
+    handler = Blocked()
+    event.subscribe(event_name, handler, asynchronous=True, queue_size=1, policy=Backpressure.BLOCK)
+    event.post_event(event_name, 0)
+    assert handler.started.wait(5)
+    event.post_event(event_name, 1)
+    posted = threading.Event()
+    threading.Thread(target=lambda: posted.set() if event.post_event(event_name, 2) else None, daemon=True).start()
+    assert not posted.wait(0.1)
+    handler.release.set()
+    assert posted.wait(5)
+    assert event.join(event_name, 5)
+    assert handler.received == [0, 1, 2]
+
+def test_failed_handler_does_not_stop_the_worker(event_name):
+    received = []
+
+    def handler(data):
+        if data == "bad":
+            raise ValueError(data)
+        received.append(data)
+
+    event.subscribe(event_name, handler, asynchronous=True)
+    for data in ("good", "bad", "good again"):
+        event.post_event(event_name, data)
+    assert event.join(event_name, 5)
+    assert received == ["good", "good again"]
+    stats = [item for item in event.stats() if item.event_name == event_name][0]
+    assert (stats.processed, stats.failed) == (3, 1)
+
+def test_invalid_subscriber(event_name):
+    with pytest.raises(ValueError):
+        event.subscribe(event_name, print, asynchronous=True, queue_size=0)
+    with pytest.raises(ValueError):
+        event.subscribe(event_name, print, asynchronous=True, policy="some")
+
+def test_stop_releases_join(event_name):
+    handler = Blocked()
+    event.subscribe(event_name, handler, asynchronous=True, queue_size=2)
+    event.post_event(event_name, 0)
+    assert handler.started.wait(5)
+    event.post_event(event_name, 1)
+    event.post_event(event_name, 2)
+    subscriber = event.subscribers[event_name][0]
+    event.unsubscribe(event_name, handler)
+    # no timeout, it would wait forever for the queued data
+    joined = threading.Event()
+    threading.Thread(target=lambda: joined.set() if subscriber.join() else None, daemon=True).start()
+    assert joined.wait(5)
+    assert subscriber.depth() == 0
+    assert subscriber.stats().dropped == 2
+    handler.release.set()
+
+def test_block_policy_rejects_after_stop(event_name):
+    handler = Blocked()
+    event.subscribe(event_name, handler, asynchronous=True, queue_size=1, policy=Backpressure.BLOCK)
+    event.post_event(event_name, 0)
+    assert handler.started.wait(5)
+    event.post_event(event_name, 1)
+    subscriber = event.subscribers[event_name][0]
+    results = []
+    waiting = threading.Thread(target=lambda: results.append(subscriber.offer(2)), daemon=True)
+    waiting.start()
+    waiting.join(0.1)
+    assert waiting.is_alive()
+    subscriber.stop()
+    # the producer waiting for a free slot is released, and rejected
+    waiting.join(5)
+    assert results == [False]
+    assert not subscriber.offer(3)
+    assert subscriber.depth() == 0
+    assert subscriber.stats().rejected == 2
+    handler.release.set()
@@ -0,0 +1,51 @@
+import threading
+import time
+
+import pytest
+
+from benchmarks.fake_imap import FakeIMAPServer
+from src.handlers.email_signal_extraction import EmailSignalExtraction
+
+def wait_until(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+@pytest.fixture
+def imap():
+    server = FakeIMAPServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_takeover_with_dual_connections_opens_nothing(imap):
+    extraction = EmailSignalExtraction(
+        "test@example.com", "password", "127.0.0.1", imap.server_address[1],
+        imap_auto_reconnect=True, imap_auto_reconnect_wait=10, imap_ssl=False,
+        imap_hot_standby=True, imap_dual_connection=True,
+    )
+    threading.Thread(target=extraction.main, daemon=True).start()
+    try:
+        assert wait_until(lambda: extraction.el is not None and extraction.el.idle_server is not None)
+        assert wait_until(extraction.standby.ready)
+        standby = extraction.standby._listener
+        # both connections of the standby are logged in and selected
+        assert standby.server is not None and standby.idle_server is not None
+        fetch_server, idle_server = standby.server, standby.idle_server
+        # no new standby after the takeover, every login would be the takeover's
+        extraction.standby.stop()
+        logins = imap.logins
+
+        assert wait_until(lambda: imap.drop_idle_connections() > 0)
+        assert wait_until(lambda: extraction.el is standby)
+        assert wait_until(lambda: any(handler.idling for handler in list(imap.connections)))
+        assert standby.server is fetch_server
+        assert standby.idle_server is idle_server
+        assert imap.logins == logins
+    finally:
+        extraction.standby.stop()
@@ -0,0 +1,95 @@
+import base64
+import quopri
+
+import pytest
+
+from src.email_listener import EmailListener
+from src.email_listener.lean import parse_lean, html_to_text
+
+HEADERS = (
+    "From: TradingView <noreply@tradingview.com>\r\n"
+    "To: you@example.com\r\n"
+    "Subject: {subject}\r\n"
+    "Date: Wed, 02 Feb 2022 04:16:44 +0000\r\n"
+    "Message-ID: <alert@tradingview.com>\r\n"
+    "MIME-Version: 1.0\r\n"
+)
+
+def message(body: str, content_type: str = "text/plain; charset=utf-8", subject: str = "Alert: BTCUSD", extra: str = "") -> bytes:
+    return (HEADERS.format(subject=subject) + f"Content-Type: {content_type}\r\n" + extra + "\r\n" + body).encode()
+
+def alternative(plain: str, html: str) -> bytes:
+    return message(
+        "--b1\r\n"
+        "Content-Type: text/plain; charset=utf-8\r\n\r\n"
+        f"{plain}\r\n"
+        "--b1\r\n"
+        "Content-Type: text/html; charset=utf-8\r\n\r\n"
+        f"{html}\r\n"
+        "--b1--\r\n",
+        content_type='multipart/alternative; boundary="b1"',
+    )
+
+def parse_full(raw_message: bytes) -> dict:
+    el = EmailListener("test@example.com", "password", lean_parsing=False)
+    _, data = el._EmailListener__parse_message(1, raw_message, True)
+    return data
+
+def assert_same(raw_message: bytes) -> dict:
+    full = parse_full(raw_message)
+    lean = parse_lean(1, raw_message)
+    for key in ("From_Address", "Email_UID", "Date", "Subject", "Message_ID", "Plain_Text"):
+        assert lean[key] == full[key], key
+    return full
+
+def test_single_part():
+    data = assert_same(message('{"action": "buy"}\r\n'))
+    assert data["Plain_Text"] == '{"action": "buy"}'
+    assert data["From_Address"] == "noreply@tradingview.com"
+
+def test_crlf_lines_are_kept():
+    data = assert_same(message("line 1\r\nline 2\r\n"))
+    assert data["Plain_Text"] == "line 1\r\nline 2"
+
+def test_multipart_alternative_uses_the_text_part():
+    data = assert_same(alternative("buy BTCUSD", "<p>sell BTCUSD</p>"))
+    assert data["Plain_Text"] == "buy BTCUSD"
+
+def test_html_only():
+    html = "<html><head><style>p {color: red}</style></head><body><p>buy&nbsp;BTCUSD</p><p>at 42 &amp; more</p></body></html>"
+    data = assert_same(message(html, content_type="text/html; charset=utf-8"))
+    assert data["Plain_Text"] == "buy\xa0BTCUSD\nat 42 & more"
+
+def test_html_only_multipart():
+    raw = message(
+        "--b1\r\nContent-Type: text/html; charset=utf-8\r\n\r\n<div>buy</div>\r\n--b1--\r\n",
+        content_type='multipart/mixed; boundary="b1"',
+    )
+    assert assert_same(raw)["Plain_Text"] == "buy"
+
+@pytest.mark.parametrize("subject, expected", [
+    ("=?utf-8?q?Alert=3A_BTCUSD_=E2=86=91?=", "Alert: BTCUSD ↑"),
+    ("=?utf-8?b?" + base64.b64encode("Alerte : prix élevé".encode()).decode() + "?=", "Alerte : prix élevé"),
+    ("", "No Subject"),
+])
+def test_encoded_subjects(subject, expected):
+    assert assert_same(message("buy", subject=subject))["Subject"] == expected
+
+def test_quoted_printable_body():
+    text = 'prix : 42 €, {"action": "buy", "comment": "' + "x" * 80 + '"}'
+    body = quopri.encodestring(text.encode()).decode().replace("\n", "\r\n")
+    data = assert_same(message(body + "\r\n", extra="Content-Transfer-Encoding: quoted-printable\r\n"))
+    assert data["Plain_Text"] == text
+
+def test_base64_body():
+    text = "prix : 42 €\r\nbuy"
+    body = base64.encodebytes(text.encode()).decode().replace("\n", "\r\n")
+    data = assert_same(message(body, extra="Content-Transfer-Encoding: base64\r\n"))
+    assert data["Plain_Text"] == text
+
+def test_latin1_charset():
+    raw = HEADERS.format(subject="Alert").encode() + b"Content-Type: text/plain; charset=iso-8859-1\r\n\r\nprix \xe9lev\xe9\r\n"
+    assert assert_same(raw)["Plain_Text"] == "prix élevé"
+
+def test_html_to_text():
+    assert html_to_text("<p>a</p><script>b</script><br/>c &lt;d&gt;") == "a\n\nc <d>"
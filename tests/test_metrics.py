@@ -0,0 +1,54 @@
+from src.handlers.api_workers import _MetricsStore
+from src.metrics import Counter, Gauge, Histogram, Registry, merge
+
+def render(requests: int, depth: int, *durations: float) -> str:
+    registry = Registry()
+    registry.register(Counter("test_requests_total", "Requests", ("path",))).labels("/api").inc(requests)
+    registry.register(Gauge("test_queue_depth", "Queue depth")).set(depth)
+    histogram = registry.register(Histogram("test_duration_seconds", "Duration", buckets=(1,)))
+    for duration in durations:
+        histogram.observe(duration)
+    return registry.render()
+
+def samples(text: str) -> dict[str, float]:
+    return {line.rsplit(" ", 1)[0]: float(line.rsplit(" ", 1)[1]) for line in text.splitlines() if line and not line.startswith("#")}
+
+def test_merge_sums_the_cumulative_series():
+    merged = merge([render(1, 2, 0.5), render(3, 4, 2)])
+    assert merged.count("# TYPE test_requests_total counter") == 1
+    assert samples(merged) == {
+        'test_requests_total{path="/api"}': 4,
+        # not summed, eg. the latency of a proxy probed by every process
+        "test_queue_depth": 4,
+        'test_duration_seconds_bucket{le="1"}': 1,
+        'test_duration_seconds_bucket{le="+Inf"}': 2,
+        "test_duration_seconds_sum": 2.5,
+        "test_duration_seconds_count": 2,
+    }
+
+def test_merge_labels_the_gauges_by_source():
+    registry = Registry()
+    registry.register(Gauge("test_proxy_healthy", "Healthy", ("proxy",))).labels("a").set(1)
+    merged = samples(merge([registry.render(), registry.render(), render(1, 7)], sources=["parent", "0", "1"]))
+    assert merged['test_proxy_healthy{worker="parent",proxy="a"}'] == 1
+    assert merged['test_proxy_healthy{worker="0",proxy="a"}'] == 1
+    assert merged['test_queue_depth{worker="1"}'] == 7
+    assert merged['test_requests_total{path="/api"}'] == 1
+
+def test_merge_cumulative_only():
+    merged = merge([render(1, 2, 0.5)], cumulative_only=True)
+    assert "test_queue_depth" not in merged
+    assert samples(merged)['test_requests_total{path="/api"}'] == 1
+
+def test_counters_of_a_restarted_worker_do_not_go_back():
+    store = _MetricsStore()
+    store.push(0, 100, render(5, 3))
+    store.push(1, 101, render(1, 1))
+    # worker 0 is restarted, its new process starts from zero
+    store.push(0, 200, render(2, 0))
+    values = samples(store.render())
+    assert values['test_requests_total{path="/api"}'] == 8
+    # the gauges of the exited process are gone
+    assert values['test_queue_depth{worker="0"}'] == 0
+    assert values['test_queue_depth{worker="1"}'] == 1
+    assert 'test_queue_depth{worker="retired"}' not in values
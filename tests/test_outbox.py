@@ -0,0 +1,55 @@
+import sqlite3
+import time
+
+from src.outbox import DeliveryState, Outbox
+
+def test_add_alert_returns_once_committed(tmp_path):
+    path = str(tmp_path / "outbox.sqlite3")
+    outbox = Outbox(path, flush_interval=1)
+    alert_id = outbox.add_alert('{"ticker": "BTCUSD"}', ["exchange", "telegram"])
+    # read from another connection without flushing, as after a crash
+    conn = sqlite3.connect(path)
+    try:
+        assert conn.execute("SELECT payload FROM alerts WHERE id = ?", (alert_id,)).fetchone() == ('{"ticker": "BTCUSD"}',)
+        states = conn.execute("SELECT target, state FROM deliveries WHERE alert_id = ? ORDER BY target", (alert_id,)).fetchall()
+    finally:
+        conn.close()
+    assert states == [("exchange", DeliveryState.PENDING), ("telegram", DeliveryState.PENDING)]
+
+def test_pending_after_restart(tmp_path):
+    path = str(tmp_path / "outbox.sqlite3")
+    outbox = Outbox(path)
+    first = outbox.add_alert("first", ["exchange", "backup"])
+    second = outbox.add_alert("second", ["exchange"])
+    outbox.mark(first, "exchange", DeliveryState.DELIVERED)
+    outbox.mark(first, "backup", DeliveryState.RETRYING, "timeout")
+    outbox.mark(second, "exchange", DeliveryState.FAILED, "404")
+    assert outbox.flush(5)
+
+    pending = Outbox(path).pending()
+    assert [(alert.alert_id, alert.payload, alert.targets) for alert in pending] == [(first, "first", ["backup"])]
+
+def test_pending_expires_the_old_alerts(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.sqlite3"))
+    alert_id = outbox.add_alert("old", ["exchange"])
+    time.sleep(0.05)
+    assert outbox.pending(max_age=0.01) == []
+    assert outbox.pending() == []
+    outbox.mark(alert_id, "exchange", DeliveryState.DELIVERED)
+    assert outbox.flush(5)
+
+def test_prune_keeps_the_unfinished_alerts(tmp_path):
+    path = str(tmp_path / "outbox.sqlite3")
+    outbox = Outbox(path)
+    delivered = outbox.add_alert("delivered", ["exchange"])
+    pending = outbox.add_alert("pending", ["exchange"])
+    outbox.mark(delivered, "exchange", DeliveryState.DELIVERED)
+    outbox.prune(older_than=0)
+    assert outbox.flush(5)
+
+    conn = sqlite3.connect(path)
+    try:
+        assert conn.execute("SELECT id FROM alerts").fetchall() == [(pending,)]
+        assert conn.execute("SELECT alert_id FROM deliveries").fetchall() == [(pending,)]
+    finally:
+        conn.close()
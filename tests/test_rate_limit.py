@@ -0,0 +1,106 @@
+import threading
+import time
+
+from src.fan_out import DeliveryResult
+from src.rate_limit import TokenBucket
+from src.retry import RetryPolicy
+from src.telegram_sender import TelegramSender, format_digest, split_message
+
+def test_token_bucket_burst_then_rate():
+    bucket = TokenBucket(rate=10, capacity=3)
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+    assert 0 < bucket.delay() <= 0.1
+    time.sleep(0.11)
+    assert bucket.try_acquire()
+
+def test_token_bucket_release_and_drain():
+    bucket = TokenBucket(rate=0.001, capacity=2)
+    assert bucket.try_acquire() and bucket.try_acquire()
+    bucket.release()
+    assert bucket.try_acquire()
+    bucket.release(5)
+    # never above the capacity
+    assert bucket.try_acquire(2) and not bucket.try_acquire()
+    bucket.release()
+    bucket.drain()
+    assert not bucket.try_acquire()
+
+def test_split_message():
+    assert split_message("short", 10) == ["short"]
+    assert split_message("line one\nline two", 10) == ["line one", "line two"]
+    assert split_message("a" * 25, 10) == ["a" * 10, "a" * 10, "a" * 5]
+    assert format_digest(["a", "b"]) == "2 alerts:\n\na\n\nb"
+
+class Sent:
+    def __init__(self, count: int):
+        self.messages: list[tuple[str, str]] = []
+        self.done = threading.Event()
+        self.count = count
+
+    def send(self, chat_id: str, text: str) -> DeliveryResult:
+        self.messages.append((chat_id, text))
+        if len(self.messages) >= self.count:
+            self.done.set()
+        return DeliveryResult("telegram", True, status_code=200)
+
+class TakenElsewhere(TokenBucket):
+    """
+    A shared bucket that looks available, but another process takes the token first once.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        super().__init__(rate, capacity)
+        self.lost = False
+
+    def delay(self, tokens: float = 1) -> float:
+        return 0.0
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        if not self.lost:
+            self.lost = True
+            return False
+        return super().try_acquire(tokens)
+
+def test_chat_token_is_kept_when_the_global_one_is_taken():
+    sent = Sent(1)
+    chat_buckets = []
+
+    def bucket_factory(name, rate, capacity):
+        if name == "telegram":
+            return TakenElsewhere(rate, capacity)
+        chat_buckets.append(TokenBucket(rate, capacity))
+        return chat_buckets[-1]
+
+    # one message per chat and ~17 minutes, a wasted chat token would hold the message back
+    sender = TelegramSender(sent.send, RetryPolicy(), chat_rate=0.001, chat_burst=1)
+    sender.set_bucket_factory(bucket_factory)
+    try:
+        assert sender.submit("chat", "alert")
+        assert sent.done.wait(5)
+    finally:
+        sender.stop()
+    assert sent.messages == [("chat", "alert")]
+
+def test_waiting_alerts_are_sent_as_a_digest():
+    sent = Sent(2)
+    sender = TelegramSender(sent.send, RetryPolicy(), chat_rate=0.001, chat_burst=1, digest_threshold=3)
+    try:
+        # the sender thread waits until they are all queued
+        with sender._condition:
+            for index in range(4):
+                assert sender.submit("chat", f"alert {index}")
+        deadline = time.monotonic() + 5
+        while not sent.messages and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # below the threshold, one message per alert, once the chat limit allows it
+        assert sender.submit("chat", "alert 4")
+        time.sleep(0.1)
+        assert sender.pending() == 1
+        with sender._condition:
+            sender._chats["chat"].bucket.release()
+            sender._condition.notify_all()
+        assert sent.done.wait(5)
+    finally:
+        sender.stop()
+    assert sent.messages == [("chat", format_digest([f"alert {index}" for index in range(4)])), ("chat", "alert 4")]
+    assert sender.pending() == 0
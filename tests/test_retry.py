@@ -0,0 +1,85 @@
+import threading
+import time
+
+import pytest
+
+from src.fan_out import DeliveryResult
+from src.retry import RetryPolicy, RetryQueue
+
+FAST = RetryPolicy(max_attempts=3, backoff_base=0.01, backoff_cap=0.02, jitter=False, max_age=60)
+
+class Recorder:
+    """
+    The `send` and `on_result` of a retry queue, answers with the given status codes in turn.
+    """
+
+    def __init__(self, *status_codes: int):
+        self.status_codes = list(status_codes)
+        self.sent: list[str] = []
+        self.results: list[tuple[str, bool, bool]] = []
+        self.finished = threading.Event()
+        self.expected_final = 1
+
+    def send(self, payload, alert_id) -> DeliveryResult:
+        self.sent.append(payload)
+        status_code = self.status_codes.pop(0) if self.status_codes else 200
+        return DeliveryResult("target", 200 <= status_code < 300, status_code=status_code)
+
+    def on_result(self, entry, result, final):
+        self.results.append((entry.payload, result.success, final))
+        if sum(final for *_, final in self.results) >= self.expected_final:
+            self.finished.set()
+
+def failed(status_code: int | None = 503, **kwargs) -> DeliveryResult:
+    return DeliveryResult("target", False, status_code=status_code, **kwargs)
+
+@pytest.mark.parametrize("result, expected", [
+    (failed(503), True),
+    (failed(429), True),
+    (failed(None, error="Connection refused"), True),
+    (failed(404), False),
+    (failed(None, retryable=False), False),
+    (DeliveryResult("target", True, status_code=200), False),
+])
+def test_is_retryable(result, expected):
+    assert RetryPolicy().is_retryable(result) is expected
+
+def test_single_attempt_policy_never_retries():
+    assert not RetryPolicy(max_attempts=1).is_retryable(failed(503))
+
+def test_from_config_keeps_the_default_values():
+    policy = RetryPolicy.from_config({"max_attempts": 2}, RetryPolicy(max_age=30))
+    assert (policy.max_attempts, policy.max_age) == (2, 30)
+
+def test_retried_until_delivered():
+    recorder = Recorder(503, 200)
+    queue = RetryQueue("target", recorder.send, FAST, recorder.on_result)
+    assert queue.add("alert", None, time.time(), failed(503))
+    assert recorder.finished.wait(5)
+    assert recorder.results == [("alert", False, False), ("alert", True, True)]
+    assert len(queue) == 0
+
+def test_gives_up_after_max_attempts():
+    recorder = Recorder(503, 503, 503)
+    queue = RetryQueue("target", recorder.send, FAST, recorder.on_result)
+    assert queue.add("alert", None, time.time(), failed(503))
+    assert recorder.finished.wait(5)
+    # the first attempt is not made by the queue
+    assert recorder.sent == ["alert", "alert"]
+    assert recorder.results[-1] == ("alert", False, True)
+
+def test_retries_keep_the_order():
+    recorder = Recorder(503, 200, 200)
+    recorder.expected_final = 2
+    queue = RetryQueue("target", recorder.send, FAST, recorder.on_result)
+    created = time.time()
+    assert queue.add("first", None, created, failed(503))
+    assert queue.add("second", None, created, failed(503))
+    assert recorder.finished.wait(5)
+    assert recorder.sent == ["first", "first", "second"]
+
+def test_not_queued():
+    queue = RetryQueue("target", Recorder().send, FAST)
+    assert not queue.add("alert", None, time.time(), failed(404))
+    assert not queue.add("alert", None, time.time() - FAST.max_age, failed(503))
+    assert len(queue) == 0
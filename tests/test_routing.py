@@ -0,0 +1,119 @@
+import pytest
+
+from src.routing import Route, Router, build_router
+
+TARGETS = ["exchange", "backup", "telegram"]
+
+def route(targets, **kwargs) -> Route:
+    return Route(field=kwargs.pop("field", "ticker"), targets=tuple(targets), **kwargs)
+
+def names(routes: list[Route]) -> list[str]:
+    return [route.name for route in routes]
+
+def test_anchors_are_kept():
+    router = Router([
+        route(["exchange"], pattern="^BTC", name="starts"),
+        route(["backup"], pattern="USD$", name="ends"),
+    ])
+    assert names(router.match({"ticker": "BTCUSD"})) == ["starts", "ends"]
+    assert names(router.match({"ticker": "XBTCUSDT"})) == []
+    assert names(router.match({"ticker": "ETHUSD"})) == ["ends"]
+
+def test_overlapping_rules_all_match():
+    router = Router([
+        route(["exchange"], pattern="BTC", name="btc"),
+        route(["backup"], pattern="BTCUSD", name="btcusd"),
+        route(["telegram"], equals=("BTCUSD",), name="exact"),
+        route(["telegram"], pattern="USD", name="usd"),
+    ])
+    assert names(router.match({"ticker": "BTCUSD"})) == ["btc", "btcusd", "exact", "usd"]
+    assert router.select(TARGETS, {"ticker": "BTCUSD"}) == TARGETS
+
+def test_ignore_case_applies_to_its_rule_only():
+    router = Router([
+        route(["exchange"], pattern="btc", ignore_case=True, name="folded"),
+        route(["backup"], pattern="btc", name="exact_case"),
+        route(["telegram"], equals=("ethusd",), ignore_case=True, name="equals_folded"),
+    ])
+    assert names(router.match({"ticker": "BTCUSD"})) == ["folded"]
+    assert names(router.match({"ticker": "btcusd"})) == ["folded", "exact_case"]
+    assert names(router.match({"ticker": "ETHUSD"})) == ["equals_folded"]
+
+def test_combined_expression_is_used():
+    router = Router([route(["exchange"], pattern="BTC"), route(["backup"], pattern="ETH")])
+    matcher = router._fields["ticker"]
+    assert matcher.regex is not None
+    assert matcher.fallback == []
+
+@pytest.mark.parametrize("patterns, first, second", [
+    # inline global flags are only allowed at the start of an expression
+    (["(?i)btc", "eth"], "BTC", "eth"),
+    # the same group name in two rules
+    (["(?P<coin>BTC)", "(?P<coin>ETH)"], "BTC", "ETH"),
+])
+def test_fallback_when_the_patterns_cannot_be_combined(patterns, first, second):
+    router = Router([route(["exchange"], pattern=patterns[0], name="first"), route(["backup"], pattern=patterns[1], name="second")])
+    matcher = router._fields["ticker"]
+    assert matcher.regex is None
+    assert len(matcher.fallback) == 2
+    assert names(router.match({"ticker": first})) == ["first"]
+    assert names(router.match({"ticker": second})) == ["second"]
+    assert names(router.match({"ticker": first + second})) == ["first", "second"]
+
+def test_global_flags_with_ignore_case():
+    router = Router([route(["exchange"], pattern="(?i)btc", ignore_case=True, name="flags")])
+    assert names(router.match({"ticker": "BTC"})) == ["flags"]
+
+def test_backreferences_are_searched_on_their_own():
+    router = Router([route(["exchange"], pattern="X", name="x"), route(["backup"], pattern=r"(A)\1", name="double")])
+    matcher = router._fields["ticker"]
+    assert matcher.regex is not None
+    assert [index for index, _ in matcher.fallback] == [1]
+    assert names(router.match({"ticker": "XAA"})) == ["x", "double"]
+    assert names(router.match({"ticker": "XA"})) == ["x"]
+
+def test_source_and_nested_fields():
+    router = Router([
+        route(["exchange"], field="subject", pattern="^Alert: ", name="subject"),
+        route(["backup"], field="strategy.name", equals=("grid",), name="nested"),
+    ])
+    data = {"strategy": {"name": "grid"}}
+    assert names(router.match(data, {"subject": "Alert: BTC"})) == ["subject", "nested"]
+    assert names(router.match({"strategy": "grid"})) == []
+    assert names(router.match("plain text alert", {"subject": "Other"})) == []
+
+@pytest.mark.parametrize("unmatched, expected", [("all", TARGETS), ("none", [])])
+def test_unmatched_policy(unmatched, expected):
+    router = Router([route(["backup"], equals=("BTCUSD",))], unmatched)
+    assert router.select(TARGETS, {"ticker": "ETHUSD"}) == expected
+    assert router.select(TARGETS, {"ticker": "BTCUSD"}) == ["backup"]
+
+def test_invalid_rules():
+    with pytest.raises(ValueError):
+        Router([route(["exchange"])])
+    with pytest.raises(ValueError):
+        Router([route(["exchange"], equals=("BTC",), pattern="BTC")])
+    with pytest.raises(ValueError):
+        Router([route(["exchange"], pattern="(")])
+    with pytest.raises(ValueError):
+        Router([], "some")
+
+def test_build_router_skips_the_invalid_rules():
+    router = build_router({
+        "routes_unmatched": "none",
+        "routes": [
+            {"name": "bad", "field": "ticker", "pattern": "(", "targets": ["exchange"]},
+            {"name": "no_field", "equals": "BTC", "targets": ["exchange"]},
+            {"name": "good", "field": "ticker", "equals": "BTCUSD", "targets": ["exchange"]},
+        ],
+    }, TARGETS)
+    assert names(router.routes) == ["good"]
+    assert router.unmatched == "none"
+    assert router.routes[0].equals == ("BTCUSD",)
+
+def test_build_router_without_rules():
+    assert build_router({}, TARGETS) is None
+
+def test_build_router_unknown_unmatched_policy():
+    router = build_router({"routes_unmatched": "some", "routes": [{"field": "ticker", "equals": "BTC", "targets": ["exchange"]}]}, TARGETS)
+    assert router.unmatched == "all"